@@ -7,9 +7,12 @@ from datetime import datetime
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-from PyQt5.QtCore import QObject, QUrl
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+import log
+import metrics
 
+logger = log.get_logger("alarm")
+
+# Qt 多媒体模块只在播放音频警报时才导入，无界面的后台服务 (service.py) 可以不加载 Qt 而使用规则判断与邮件通知
 
 def get_project_root():
     """获取项目根目录路径"""
@@ -34,7 +37,7 @@ def save_rules_to_json(rules):
             json.dump(rules_data, f, ensure_ascii=False, indent=2)
         return True
     except Exception as e:
-        print(f"保存规则时出错: {e}")
+        logger.error("保存规则时出错: %s", e)
         return False
 
 
@@ -48,7 +51,7 @@ def load_rules_from_json():
             rules_data = json.load(f)
         return [AlarmRule.from_dict(data) for data in rules_data]
     except Exception as e:
-        print(f"加载规则时出错: {e}")
+        logger.error("加载规则时出错: %s", e)
         return []
 
 
@@ -70,6 +73,9 @@ class AlarmRule:
         self.is_triggered = False
         # 添加标记表示是否已发送恢复通知
         self.recovery_notified = True  # 初始值为True，避免未触发警报前就发送恢复通知
+        # 按设备检查时规则副本所属的设备 (见 DeviceAlarms)，不保存到文件
+        self.device_id = None
+        self.device_name = None
 
     def to_dict(self):
         """将规则转换为字典，用于JSON序列化"""
@@ -134,12 +140,28 @@ class AlarmRule:
         return f"{sensor_names[self.sensor_type]} {condition_symbols[self.condition_type]} {self.threshold}{units[self.sensor_type]} → {notification_info}"
 
 
-class AlarmManager(QObject):
-    """警报管理器，负责触发警报和处理警报恢复"""
+def _player_key(rule):
+    # 同一规则在不同设备上的副本 id 相同，音频按 (设备, 规则) 区分
+    return rule.device_id, rule.id
+
+
+def _subject_prefix(rule):
+    return f"[{rule.device_name}] " if rule.device_name else ""
+
 
-    def __init__(self):
-        super().__init__()
-        self.active_players = {}  # 记录正在播放的音频 {rule_id: QMediaPlayer对象}
+class AlarmManager:
+    """
+    警报管理器，负责触发警报和处理警报恢复。
+    sound_enabled: 是否播放音频 (后台服务没有界面，不播放)；
+    email_enabled: 是否发送邮件 (界面连接到后台服务时由服务发送，界面不重复发送)；
+    metrics_enabled: 是否计入警报触发与恢复次数 (历史回放的检查不计入)。
+    """
+
+    def __init__(self, sound_enabled=True, email_enabled=True, metrics_enabled=True):
+        self.active_players = {}  # 记录正在播放的音频 {(设备id, rule_id): QMediaPlayer对象}
+        self.sound_enabled = sound_enabled
+        self.email_enabled = email_enabled
+        self.metrics_enabled = metrics_enabled
         # 增加邮件冷却时间为300秒(5分钟)
         self.EMAIL_COOLDOWN = 300
 
@@ -154,9 +176,13 @@ class AlarmManager(QObject):
             if is_triggered:
                 # 规则被触发
                 rule.recovery_notified = False  # 重置恢复通知状态
+                if self.metrics_enabled:
+                    metrics.increment("alarm_triggers")
                 self.trigger_alarm(rule, current_value)
             else:
                 # 规则恢复正常，触发恢复操作
+                if self.metrics_enabled:
+                    metrics.increment("alarm_recoveries")
                 self.recover_alarm(rule, current_value)
 
         # 如果规则持续触发，检查邮件是否在冷却时间
@@ -195,7 +221,7 @@ class AlarmManager(QObject):
 
     def play_sound_alert(self, rule):
         """播放音频警报，使用QMediaPlayer替代QSound"""
-        if not rule.sound_file:
+        if not rule.sound_file or not self.sound_enabled:
             return
 
         # 确保之前的声音已停止
@@ -205,6 +231,9 @@ class AlarmManager(QObject):
         sound_path = os.path.join(get_project_root(), rule.sound_file)
 
         try:
+            from PyQt5.QtCore import QUrl
+            from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+
             # 创建新的QMediaPlayer对象
             player = QMediaPlayer()
 
@@ -222,30 +251,31 @@ class AlarmManager(QObject):
             player.play()
 
             # 保存播放器引用以便后续停止
-            self.active_players[rule.id] = player
-            print(f"开始播放音频警报: {rule.sound_file}")
+            self.active_players[_player_key(rule)] = player
+            logger.debug("开始播放音频警报: %s", rule.sound_file)
 
         except Exception as e:
-            print(f"播放音频警报失败: {e}")
+            logger.warning("播放音频警报失败: %s", e)
 
     def stop_sound_alert(self, rule):
         """停止音频警报"""
-        if rule.id in self.active_players:
+        key = _player_key(rule)
+        if key in self.active_players:
             try:
-                player = self.active_players[rule.id]
+                player = self.active_players[key]
                 player.stop()
                 # 断开之前的信号连接以避免循环播放
                 player.mediaStatusChanged.disconnect()
-                print(f"停止音频警报: {rule.sound_file}")
+                logger.debug("停止音频警报: %s", rule.sound_file)
             except Exception as e:
-                print(f"停止音频警报失败: {e}")
+                logger.warning("停止音频警报失败: %s", e)
             finally:
                 # 从active_players中移除
-                del self.active_players[rule.id]
+                del self.active_players[key]
 
     def send_email_alert(self, rule, current_value):
         """发送邮件警报"""
-        if not rule.email_file:
+        if not rule.email_file or not self.email_enabled:
             return
 
         try:
@@ -263,7 +293,7 @@ class AlarmManager(QObject):
             msg = MIMEMultipart()
             msg['From'] = email_config.get('sender_email', 'smart_env_monitor@example.com')
             msg['To'] = email_config.get('receiver_email', '')
-            msg['Subject'] = f"环境监测警报: {sensor_names[rule.sensor_type]}异常"
+            msg['Subject'] = f"{_subject_prefix(rule)}环境监测警报: {sensor_names[rule.sensor_type]}异常"
 
             # 构建邮件正文
             body = email_config.get('alarm_template', '').format(
@@ -282,19 +312,22 @@ class AlarmManager(QObject):
             smtp_username = email_config.get('smtp_username', '')
             smtp_password = email_config.get('smtp_password', '')
 
+            start = time.perf_counter()
             with smtplib.SMTP(smtp_server, smtp_port) as server:
                 server.starttls()
                 server.login(smtp_username, smtp_password)
                 server.send_message(msg)
+            metrics.histogram("email_send").observe((time.perf_counter() - start) * 1000.0)
 
-            print(f"成功发送警报邮件至 {msg['To']}")
+            logger.info("成功发送警报邮件至 %s", msg['To'])
 
         except Exception as e:
-            print(f"发送邮件警报失败: {e}")
+            metrics.increment("email_failures")
+            logger.error("发送邮件警报失败: %s", e)
 
     def send_recovery_email(self, rule, current_value):
         """发送警报恢复通知邮件"""
-        if not rule.email_file:
+        if not rule.email_file or not self.email_enabled:
             return
 
         try:
@@ -312,7 +345,7 @@ class AlarmManager(QObject):
             msg = MIMEMultipart()
             msg['From'] = email_config.get('sender_email', 'smart_env_monitor@example.com')
             msg['To'] = email_config.get('receiver_email', '')
-            msg['Subject'] = f"环境监测通知: {sensor_names[rule.sensor_type]}已恢复正常"
+            msg['Subject'] = f"{_subject_prefix(rule)}环境监测通知: {sensor_names[rule.sensor_type]}已恢复正常"
 
             # 使用配置文件中的恢复通知邮件模板
             body = email_config['recovery_template'].format(
@@ -331,15 +364,18 @@ class AlarmManager(QObject):
             smtp_username = email_config.get('smtp_username', '')
             smtp_password = email_config.get('smtp_password', '')
 
+            start = time.perf_counter()
             with smtplib.SMTP(smtp_server, smtp_port) as server:
                 server.starttls()
                 server.login(smtp_username, smtp_password)
                 server.send_message(msg)
+            metrics.histogram("email_send").observe((time.perf_counter() - start) * 1000.0)
 
-            print(f"成功发送恢复通知邮件至 {msg['To']}")
+            logger.info("成功发送恢复通知邮件至 %s", msg['To'])
 
         except Exception as e:
-            print(f"发送恢复通知邮件失败: {e}")
+            metrics.increment("email_failures")
+            logger.error("发送恢复通知邮件失败: %s", e)
 
     def stop_all_alarms(self):
         """停止所有活动的警报"""
@@ -357,7 +393,67 @@ class AlarmManager(QObject):
                         pass
                     del self.active_players[rule_id]
             except Exception as e:
-                print(f"停止音频警报失败: {e}")
+                logger.warning("停止音频警报失败: %s", e)
 
         # 确保清空活动的播放器字典
-        self.active_players.clear()
\ No newline at end of file
+        self.active_players.clear()
+
+class DeviceAlarms:
+    """
+    按设备检查警报规则: 每台设备使用独立的规则副本，触发、恢复与邮件冷却状态互不影响，
+    一台设备超限时另一台设备的正常数据不会让它"恢复"。界面与后台服务 (service.py) 共用。
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.rules = []          # 规则原件 (界面编辑或从 rule.json 加载)，本身不参与检查
+        self.device_rules = {}   # {设备id: [AlarmRule 副本]}
+
+    def _copy(self, rule, device_id, device_name, state=None):
+        copy = AlarmRule.from_dict(rule.to_dict())
+        copy.device_id = device_id
+        copy.device_name = device_name
+        # 新设备或重新启用的规则从未触发状态开始，不沿用文件中保存的状态
+        copy.is_triggered = state.is_triggered if state else False
+        copy.last_email_time = state.last_email_time if state else 0
+        copy.recovery_notified = state.recovery_notified if state else True
+        return copy
+
+    def set_rules(self, rules):
+        """
+        更新规则 (添加、删除或启停后调用)，保留仍启用的规则在各设备上的状态；
+        被删除或停用的规则在各设备上停止警报 (不发送恢复邮件)。
+        """
+        self.rules = list(rules)
+        active = {rule.id for rule in self.rules if rule.is_active}
+        for device_id, old_rules in self.device_rules.items():
+            previous = {}
+            for old in old_rules:
+                if old.id in active:
+                    previous[old.id] = old
+                elif old.is_triggered:
+                    self.manager.recover_alarm(old)
+            device_name = old_rules[0].device_name if old_rules else None
+            self.device_rules[device_id] = [self._copy(rule, device_id, device_name, previous.get(rule.id))
+                                            for rule in self.rules]
+
+    def check(self, device_id, data, device_name=None):
+        """用一台设备的一条数据检查规则，返回状态 (触发/恢复) 发生变化的规则副本"""
+        rules = self.device_rules.get(device_id)
+        if rules is None:
+            rules = self.device_rules[device_id] = [self._copy(rule, device_id, device_name) for rule in self.rules]
+        changed = []
+        for rule in rules:
+            value = data.get(rule.sensor_type)
+            if not rule.is_active or value is None:
+                continue
+            was_triggered = rule.is_triggered
+            self.manager.check_rule(rule, value)
+            if rule.is_triggered != was_triggered:
+                changed.append(rule)
+        return changed
+
+    def silence(self, device_id):
+        """停止一台设备正在播放的音频警报 (数据已过期时)，不改变触发状态"""
+        for rule in self.device_rules.get(device_id, []):
+            self.manager.stop_sound_alert(rule)
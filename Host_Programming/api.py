@@ -0,0 +1,481 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import alarm
+import dbconn
+import devices
+import exporter
+import live
+import log
+import metrics
+import query
+import router
+import service
+
+# 本地 HTTP/JSON 查询接口 (只使用标准库 asyncio)，供其他程序读取数据:
+#   GET /api/devices                         设备列表
+#   GET /api/latest[?device=ID]              各设备 (或指定设备) 的最新数据
+#   GET /api/range?start=..[&end=..][&resolution=auto|raw|1m|1h|1d][&device=ID]
+#                                            时间范围内的数据，与界面使用相同的查询层 (query.fetch_range)
+#   GET /api/alarms                          警报规则，以及各设备的最新数据是否满足规则
+#   GET /api/stream[?device=ID][&interval=秒][&queue=N]
+#                                            新数据的实时推送 (Server-Sent Events，见 live.py)
+#   GET /metrics                             本进程的监控指标 (Prometheus 文本格式，见 exporter.py)
+# 查询在固定大小的线程池中执行，每个线程持有一个长连接读取端 (dbconn.reader)，相当于读取连接池，
+# 事件循环只负责收发；单点查询与范围查询使用不同的线程池，最新值请求不必排在大范围查询之后。
+# 结束时间早于今天的范围查询结果不再变化，按 LRU 缓存并带 ETag，客户端重复请求时可用 If-None-Match 得到 304；
+# 跨天的原始数据逐天查询并以分块传输编码流式返回。
+DB_PATH = "db/sqlite.db"
+DEFAULT_HOST = "127.0.0.1"       # 默认只监听本机
+DEFAULT_PORT = 8080
+POOL_SIZE = 4                    # 范围查询线程数 (即读取连接数)
+POINT_POOL_SIZE = 2              # 最新值、警报状态等单点查询使用单独的线程，不排在大范围查询之后
+CACHE_MAX_BYTES = 64 * 1024 * 1024       # 响应缓存总大小上限
+CACHE_MAX_ENTRY_BYTES = 8 * 1024 * 1024  # 超过该大小的响应不缓存
+CACHE_TTL = 3600                 # 缓存有效期 (秒)；导入历史数据 (importer.py) 后过去的数据也可能变化，不永久缓存
+KEEPALIVE_TIMEOUT = 30           # 空闲连接保持时长 (秒)
+MAX_HEADERS = 100
+COLUMNS = ("timestamp", "temperature", "humidity", "pm25", "noise", "id", "device_id")
+
+logger = log.get_logger("api")
+
+
+class ApiError(Exception):
+    """请求无法处理，以 status 状态码和 JSON 错误信息返回给客户端"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Reply:
+    """响应: body 为完整的响应体；stream 不为 None 时是逐块生成响应体的异步生成器"""
+
+    def __init__(self, body=b"", status=200, etag=None, max_age=0, stream=None, cache=None,
+                 content_type="application/json; charset=utf-8"):
+        self.body = body
+        self.status = status
+        self.etag = etag
+        self.max_age = max_age
+        self.stream = stream
+        self.cache = cache  # "HIT" / "MISS"，便于客户端与负载测试观察缓存效果
+        self.content_type = content_type
+
+
+class ResponseCache:
+    """按总字节数限制的 LRU 响应缓存，条目为 (etag, 响应体, 写入时间)。只在事件循环线程中访问，无需加锁"""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[2] > self.ttl:
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, etag, body):
+        if len(body) > min(CACHE_MAX_ENTRY_BYTES, self.max_bytes):
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (etag, body, time.monotonic())
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, body, _ = self.entries.pop(key)
+        self.size -= len(body)
+
+
+def _encode(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _etag(body):
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _parse_time(params, name, end=False):
+    """接受 'YYYY-MM-DD'、'YYYY-MM-DD HH:MM:SS' 或 'YYYY-MM-DDTHH:MM:SS'，日期表示当天开始 (end 为 True 时为当天结束)"""
+    value = params.get(name, "").replace("T", " ")
+    if len(value) == 10:
+        value = f"{value} {'23:59:59' if end else '00:00:00'}"
+    try:
+        datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise ApiError(400, f"参数 {name} 不是有效的时间: {params.get(name, '')!r}") from None
+    return value
+
+
+def _parse_device(params):
+    if "device" not in params:
+        return None
+    try:
+        return int(params["device"])
+    except ValueError:
+        raise ApiError(400, f"参数 device 不是有效的设备id: {params['device']!r}") from None
+
+
+def _day_windows(start_str, end_str):
+    """将时间范围拆分为按天的窗口，流式返回原始数据时逐天查询"""
+    day = datetime.strptime(start_str[:10], "%Y-%m-%d")
+    while day.strftime("%Y-%m-%d") <= end_str[:10]:
+        day_str = day.strftime("%Y-%m-%d")
+        yield max(start_str, f"{day_str} 00:00:00"), min(end_str, f"{day_str} 23:59:59")
+        day += timedelta(days=1)
+
+
+def _row_dict(row):
+    return dict(zip(COLUMNS, row)) if row is not None else None
+
+
+# 以下函数在查询线程中执行，conn 为该线程的读取端；JSON 编码也在查询线程中完成，不占用事件循环
+
+def _devices_body(conn):
+    return _encode({'devices': [{'id': device_id, 'name': name, 'address': address}
+                                for device_id, name, address in devices.list_devices(conn)]})
+
+
+def _latest_body(conn, device_id):
+    result = []
+    for known_id, name, address in devices.list_devices(conn):
+        if device_id is None or known_id == device_id:
+            result.append({'id': known_id, 'name': name, 'address': address,
+                           'latest': _row_dict(query.fetch_latest(conn, device_id=known_id))})
+    if device_id is not None:
+        if not result:
+            raise ApiError(404, f"设备 {device_id} 不存在")
+        return _encode(result[0])
+    return _encode({'devices': result})
+
+
+def _range_body(conn, start_str, end_str, resolution, device_id):
+    rows = query.fetch_range(conn, start_str, end_str, resolution, device_id=device_id)
+    return _encode({'resolution': resolution, 'columns': COLUMNS, 'rows': rows})
+
+
+def _raw_rows_chunk(conn, start_str, end_str, device_id):
+    """一个时间窗口内的原始数据，编码为以逗号分隔的 JSON 数组元素 (不含方括号)，无数据时返回空字节串"""
+    rows = query.fetch_raw(conn, start_str, end_str, device_id=device_id)
+    return _encode(rows)[1:-1] if rows else b""
+
+
+def _alarms_body(conn):
+    """警报规则及各设备最新数据的判断结果。触发状态与邮件记录保存在界面或后台服务进程中，这里按最新数据重新判断"""
+    now = datetime.now()
+    latest = {device_id: query.fetch_latest(conn, device_id=device_id)
+              for device_id, _, _ in devices.list_devices(conn)}
+    rules = []
+    for rule in alarm.load_rules_from_json():
+        states = []
+        for device_id, row in latest.items():
+            value = row[COLUMNS.index(rule.sensor_type)] if row is not None else None
+            fresh = row is not None and (
+                now - datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")).total_seconds() <= service.ALARM_FRESHNESS_SECONDS
+            states.append({'device_id': device_id, 'timestamp': row[0] if row is not None else None,
+                           'value': value, 'fresh': fresh,
+                           'triggered': bool(rule.is_active and fresh and value is not None
+                                             and rule.check_condition(value))})
+        rules.append({'id': rule.id, 'sensor_type': rule.sensor_type, 'condition_type': rule.condition_type,
+                      'threshold': rule.threshold, 'notification_type': rule.notification_type,
+                      'is_active': rule.is_active, 'devices': states})
+    return _encode({'service': service.read_service(), 'rules': rules})
+
+
+class ApiServer:
+    def __init__(self, db_path=DB_PATH, pool_size=POOL_SIZE, cache_bytes=CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(pool_size, thread_name_prefix="ApiReader")
+        self.point_executor = ThreadPoolExecutor(POINT_POOL_SIZE, thread_name_prefix="ApiPointReader")
+        self.cache = ResponseCache(cache_bytes)
+        self.routes = {
+            "/api/devices": self.get_devices,
+            "/api/latest": self.get_latest,
+            "/api/range": self.get_range,
+            "/api/alarms": self.get_alarms,
+            "/api/stream": self.get_stream,
+            "/metrics": self.get_metrics,
+        }
+        self.hub = live.LiveHub()
+
+    async def run_query(self, func, *args, point=False):
+        """在查询线程中执行 func(conn, *args)，point 为 True 时使用单点查询线程池"""
+        loop = asyncio.get_running_loop()
+        executor = self.point_executor if point else self.executor
+        return await loop.run_in_executor(executor, self._call, func, args)
+
+    def _call(self, func, args):
+        return func(dbconn.reader(self.db_path), *args)
+
+    async def get_devices(self, params):
+        return Reply(await self.run_query(_devices_body, point=True))
+
+    async def get_latest(self, params):
+        return Reply(await self.run_query(_latest_body, _parse_device(params), point=True))
+
+    async def get_alarms(self, params):
+        return Reply(await self.run_query(_alarms_body, point=True))
+
+    async def get_metrics(self, params):
+        return Reply(exporter.render().encode("utf-8"), content_type=exporter.CONTENT_TYPE)
+
+    async def get_range(self, params):
+        if "start" not in params:
+            raise ApiError(400, "缺少参数 start")
+        start_str = _parse_time(params, "start")
+        end_str = _parse_time(params, "end", end=True) if "end" in params \
+            else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if end_str < start_str:
+            raise ApiError(400, "结束时间早于开始时间")
+        resolution = params.get("resolution", "auto")
+        if resolution == "auto":
+            span = datetime.strptime(end_str, "%Y-%m-%d %H:%M:%S") - datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S")
+            resolution = query.pick_resolution(span.total_seconds())
+        elif resolution not in query.RESOLUTIONS:
+            raise ApiError(400, f"未知的数据分辨率: {resolution}")
+        device_id = _parse_device(params)
+
+        if resolution == "raw" and start_str[:10] != end_str[:10]:
+            return Reply(stream=self._stream_raw(start_str, end_str, device_id))
+        # 结束于今天之前的范围不会再有新数据写入 (汇总表的时间桶也已完整)
+        immutable = end_str < datetime.now().strftime("%Y-%m-%d 00:00:00")
+        if not immutable:
+            return Reply(await self.run_query(_range_body, start_str, end_str, resolution, device_id))
+        key = (start_str, end_str, resolution, device_id)
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.increment("api_cache_hits")
+            return Reply(cached[1], etag=cached[0], max_age=CACHE_TTL, cache="HIT")
+        metrics.increment("api_cache_misses")
+        body = await self.run_query(_range_body, start_str, end_str, resolution, device_id)
+        etag = _etag(body)
+        self.cache.put(key, etag, body)
+        return Reply(body, etag=etag, max_age=CACHE_TTL, cache="MISS")
+
+    async def get_stream(self, params):
+        try:
+            interval = float(params.get("interval", 0))
+            queue_size = int(params.get("queue", live.QUEUE_SIZE))
+        except ValueError:
+            raise ApiError(400, "参数 interval 或 queue 格式错误") from None
+        if interval < 0 or not 1 <= queue_size <= live.MAX_QUEUE_SIZE:
+            raise ApiError(400, f"interval 不能为负数，queue 应在 1 到 {live.MAX_QUEUE_SIZE} 之间")
+        subscription = live.Subscription(_parse_device(params), interval, queue_size)
+        return Reply(stream=self.hub.stream(subscription), content_type=live.CONTENT_TYPE)
+
+    async def _stream_raw(self, start_str, end_str, device_id):
+        yield b'{"resolution":"raw","columns":' + _encode(COLUMNS) + b',"rows":['
+        first = True
+        today = datetime.now().strftime("%Y-%m-%d 00:00:00")
+        for window_start, window_end in _day_windows(start_str, end_str):
+            # 过去各天的窗口同样不再变化，编码后的数据块也放入缓存
+            key = ("raw", window_start, window_end, device_id) if window_end < today else None
+            cached = self.cache.get(key) if key else None
+            if cached is not None:
+                metrics.increment("api_cache_hits")
+                chunk = cached[1]
+            else:
+                chunk = await self.run_query(_raw_rows_chunk, window_start, window_end, device_id)
+                if key:
+                    metrics.increment("api_cache_misses")
+                    self.cache.put(key, None, chunk)
+            if chunk:
+                yield chunk if first else b"," + chunk
+                first = False
+        yield b"]}"
+
+    async def handle_connection(self, reader, writer):
+        """处理一个 HTTP/1.1 连接 (支持 keep-alive)，同一连接上的请求依次处理"""
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEPALIVE_TIMEOUT)
+                except ApiError as e:
+                    await _send(writer, Reply(_encode({'error': e.message}), status=e.status), (), False, False)
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+                if not await self.respond(writer, method, target, version, headers, keep_alive):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, target, version, headers, keep_alive):
+        """处理一个请求并发送响应，返回连接是否可以继续使用"""
+        started = time.perf_counter()
+        url = urlsplit(target)
+        try:
+            if method != "GET":
+                raise ApiError(405, f"不支持的请求方法: {method}")
+            handler = self.routes.get(url.path)
+            if handler is None:
+                raise ApiError(404, f"未知的接口: {url.path}")
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            reply = await handler(params)
+        except ApiError as e:
+            reply = Reply(_encode({'error': e.message}), status=e.status)
+        except sqlite3.Error as e:
+            logger.error("接口查询失败 (%s): %s", target, e)
+            reply = Reply(_encode({'error': "数据库查询失败"}), status=500)
+        if_none_match = {tag.strip() for tag in headers.get("if-none-match", "").split(",")}
+        try:
+            keep_alive = await _send(writer, reply, if_none_match, keep_alive, version == "HTTP/1.1")
+        except sqlite3.Error as e:
+            # 流式响应已发出状态码，只能中断连接，客户端会收到不完整的响应
+            logger.error("接口查询失败 (%s): %s", target, e)
+            keep_alive = False
+        metrics.increment("api_requests")
+        if reply.content_type != live.CONTENT_TYPE:
+            # 实时推送的响应持续到客户端断开，不计入请求耗时
+            metrics.histogram("api_request").observe((time.perf_counter() - started) * 1000)
+        return keep_alive
+
+
+async def _read_request(reader):
+    """读取请求行与请求头，连接关闭时返回 None。GET 请求的请求体 (如有) 读取后丢弃"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(400, "请求行格式错误") from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ApiError(431, "请求头过多")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise ApiError(400, "Content-Length 格式错误")
+    if int(length):
+        await reader.readexactly(int(length))
+    return method, target, version, headers
+
+
+async def _send(writer, reply, if_none_match, keep_alive, chunked):
+    """发送响应，返回连接是否可以继续使用 (HTTP/1.0 的流式响应以关闭连接结束)"""
+    status = reply.status
+    body = reply.body
+    lines = [f"Content-Type: {reply.content_type}"]
+    if reply.cache:
+        lines.append(f"X-Cache: {reply.cache}")
+    if reply.stream is None:
+        etag = reply.etag or _etag(body)
+        lines.append(f"ETag: {etag}")
+        lines.append(f"Cache-Control: max-age={reply.max_age}" if reply.max_age else "Cache-Control: no-cache")
+        if status == 200 and etag in if_none_match:
+            status, body = 304, b""
+        else:
+            lines.append(f"Content-Length: {len(body)}")
+    else:
+        lines.append("Cache-Control: no-cache")
+        keep_alive = keep_alive and chunked
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n" + "\r\n".join(lines) + "\r\n\r\n"
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+    if reply.stream is not None:
+        # 逐块发送并等待发送缓冲区排空，慢速客户端不会使服务端积压整个响应
+        try:
+            async for chunk in reply.stream:
+                if chunked:
+                    writer.write(f"{len(chunk):X}\r\n".encode("latin-1") + chunk + b"\r\n")
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+        finally:
+            # 客户端断开时立即结束生成器 (实时推送据此退订)，不等待垃圾回收
+            await reply.stream.aclose()
+        if chunked:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+    return keep_alive
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, db_path=DB_PATH, pool_size=POOL_SIZE, live_feed="tail"):
+    """
+    live_feed: 实时推送的样本来源，"tail" 为跟踪数据库 (接口单独运行)，
+    "ingest" 为同一进程中的入库线程 (由 service.py 启动接口时使用)。
+    """
+    api = ApiServer(db_path, pool_size)
+    api.hub.start(asyncio.get_running_loop())
+    tail_task = None  # 保留任务的引用，事件循环只持有任务的弱引用
+    if live_feed == "ingest":
+        router.SAMPLE_LISTENERS.append(api.hub.publish)
+    else:
+        tail_task = asyncio.create_task(api.hub.tail(db_path, api.point_executor))
+    server = await asyncio.start_server(api.handle_connection, host, port)
+    logger.info("HTTP 接口已启动: http://%s:%s/api/ (查询线程 %d 个)", host, port, pool_size)
+    async with server:
+        await server.serve_forever()
+
+
+def run_api(host=DEFAULT_HOST, port=DEFAULT_PORT, db_path=DB_PATH, pool_size=POOL_SIZE, live_feed="tail"):
+    """在当前线程运行接口服务 (阻塞)，用于单独的进程或线程"""
+    log.setup("api")
+    asyncio.run(serve(host, port, db_path, pool_size, live_feed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 本地 HTTP/JSON 查询接口")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="监听地址 (默认只允许本机访问)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件")
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help="查询线程 (读取连接) 数")
+    parser.add_argument("--log-level", type=log.parse_levels, default={},
+                        help='日志级别，如 "DEBUG" 或 "router=DEBUG,api=WARNING"')
+    args = parser.parse_args(argv)
+    log.setup("api", args.log_level)
+
+    router.DB_PATH = args.db
+    try:
+        # 与采集进程相同的建表与迁移，接口先于采集启动时数据库结构也是最新的
+        router.connect_to_db()
+    except sqlite3.Error:
+        return 1
+    try:
+        run_api(args.host, args.port, args.db, args.pool)
+    except OSError as e:
+        print(f"无法启动 HTTP 接口: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
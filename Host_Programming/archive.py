@@ -0,0 +1,334 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import dbconn
+import devices
+import partition
+
+# 冷数据归档格式 (.fsa):
+#   MAGIC | 列块 ... | 索引JSON | 索引长度(u32, 小端) | MAGIC
+# 每个块包含 BLOCK_ROWS 行，每列单独编码: 定点整数 -> 差分 -> zigzag -> 最小无符号整型 -> zlib 压缩。
+# 索引记录每个块的起止时间与各列的偏移/长度/类型，读取时 mmap 文件，只解压与查询范围相交的块。
+ARCHIVE_DIR = "db/archive"
+DB_PATH = "db/sqlite.db"
+MAGIC = b"FSA1"
+BLOCK_ROWS = 4096
+COMPRESS_LEVEL = 6
+
+# 列名 -> 定点倍数 (存储的整数 = round(值 * 倍数))；温湿度为 0.1 精度，与下位机数据精度一致
+COLUMNS = (
+    ("time", 1),
+    ("id", 1),
+    ("temperature", 10),
+    ("humidity", 10),
+    ("pm25", 1),
+    ("noise", 1),
+    ("device", 1),
+)
+
+_FILE_PATTERN = re.compile(r"^sensor_(\d{4}-\d{2}(?:-\d{2})?)\.fsa$")
+
+
+def zigzag_encode(values):
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def zigzag_decode(values):
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def _smallest_dtype(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def encode_column(ints):
+    """差分 + zigzag 编码并压缩一列整数，返回 (数据, 类型名)"""
+    deltas = np.diff(ints, prepend=np.int64(0))
+    encoded = zigzag_encode(deltas)
+    dtype = _smallest_dtype(int(encoded.max()) if len(encoded) else 0)
+    return zlib.compress(encoded.astype(dtype).tobytes(), COMPRESS_LEVEL), np.dtype(dtype).str
+
+
+def decode_column(data, dtype):
+    encoded = np.frombuffer(zlib.decompress(data), dtype=np.dtype(dtype))
+    return np.cumsum(zigzag_decode(encoded))
+
+
+def to_epoch(timestamp):
+    return datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def from_epoch(epoch):
+    return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def archive_path(key, archive_dir=None):
+    return os.path.join(archive_dir or ARCHIVE_DIR, f"sensor_{key}.fsa")
+
+
+def list_archives(archive_dir=None):
+    """返回已存在的归档 [(key, path)]，按时间先后排序"""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+    archives = []
+    for name in os.listdir(archive_dir):
+        match = _FILE_PATTERN.match(name)
+        if match:
+            archives.append((match.group(1), os.path.join(archive_dir, name)))
+    archives.sort(key=lambda item: partition.key_bounds(item[0])[0])
+    return archives
+
+
+def archives_for_range(start_str, end_str, archive_dir=None):
+    """返回与时间范围有交集的归档 [(key, path)]"""
+    selected = []
+    for key, path in list_archives(archive_dir):
+        key_start, key_end = partition.key_bounds(key)
+        if key_start <= end_str and key_end >= start_str:
+            selected.append((key, path))
+    return selected
+
+
+def write_archive(path, rows):
+    """
+    将原始数据写入归档文件 (先写临时文件再替换)，返回写入的行数。
+    rows: [(timestamp, temperature, humidity, pm25, noise, id, device_id), ...]，按时间升序
+    """
+    rows = sorted(rows, key=lambda row: row[0])
+    columns = {
+        "time": np.array([to_epoch(row[0]) for row in rows], dtype=np.int64),
+        "temperature": np.array([row[1] for row in rows], dtype=np.float64),
+        "humidity": np.array([row[2] for row in rows], dtype=np.float64),
+        "pm25": np.array([row[3] for row in rows], dtype=np.float64),
+        "noise": np.array([row[4] for row in rows], dtype=np.float64),
+        "id": np.array([row[5] or 0 for row in rows], dtype=np.int64),
+        "device": np.array([row[6] if len(row) > 6 and row[6] is not None else devices.DEFAULT_DEVICE_ID
+                            for row in rows], dtype=np.int64),
+    }
+    index = {'version': 2, 'rows': len(rows), 'columns': dict(COLUMNS), 'blocks': []}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, len(rows))
+            block = {'rows': end - start,
+                     'start': int(columns["time"][start]),
+                     'end': int(columns["time"][end - 1]),
+                     'columns': {}}
+            for name, scale in COLUMNS:
+                ints = np.round(columns[name][start:end] * scale).astype(np.int64)
+                data, dtype = encode_column(ints)
+                block['columns'][name] = [f.tell(), len(data), dtype]
+                f.write(data)
+            index['blocks'].append(block)
+        index_bytes = json.dumps(index).encode("utf-8")
+        f.write(index_bytes)
+        f.write(struct.pack("<I", len(index_bytes)))
+        f.write(MAGIC)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+class ArchiveReader:
+    """以 mmap 方式读取归档文件，按时间范围解码为 NumPy 数组"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"归档文件为空: {path}")
+        if self._mmap[:4] != MAGIC or self._mmap[-4:] != MAGIC:
+            self.close()
+            raise ValueError(f"无效的归档文件: {path}")
+        index_len = struct.unpack("<I", self._mmap[-8:-4])[0]
+        self.index = json.loads(self._mmap[-8 - index_len:-8].decode("utf-8"))
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def rows(self):
+        return self.index['rows']
+
+    def read_range(self, start_epoch=None, end_epoch=None):
+        """返回时间范围内 (闭区间) 的数据 {列名: ndarray}，time 为秒级时间戳"""
+        scales = dict(COLUMNS, **self.index['columns'])
+        parts = {name: [] for name in scales}
+        for block in self.index['blocks']:
+            if start_epoch is not None and block['end'] < start_epoch:
+                continue
+            if end_epoch is not None and block['start'] > end_epoch:
+                break
+            decoded = {}
+            for name, (offset, length, dtype) in block['columns'].items():
+                decoded[name] = decode_column(self._mmap[offset:offset + length], dtype)
+            if "device" not in decoded:
+                # 多设备支持之前生成的归档没有设备列
+                decoded["device"] = np.full(block['rows'], devices.DEFAULT_DEVICE_ID, dtype=np.int64)
+            mask = np.ones(block['rows'], dtype=bool)
+            if start_epoch is not None:
+                mask &= decoded["time"] >= start_epoch
+            if end_epoch is not None:
+                mask &= decoded["time"] <= end_epoch
+            for name, values in decoded.items():
+                parts[name].append(values[mask])
+        result = {}
+        for name, scale in scales.items():
+            values = np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=np.int64)
+            result[name] = values / scale if scale != 1 else values
+        return result
+
+    def read_rows(self, start_str=None, end_str=None, device_id=None):
+        """返回与 sensor_data 查询结果相同结构的行 [(timestamp, temperature, humidity, pm25, noise, id, device_id)]"""
+        data = self.read_range(to_epoch(start_str) if start_str else None,
+                               to_epoch(end_str) if end_str else None)
+        if device_id is not None:
+            mask = data["device"] == device_id
+            data = {name: values[mask] for name, values in data.items()}
+        return [
+            (from_epoch(t), float(temp), float(hum), int(pm25), int(noise), int(row_id), int(device))
+            for t, temp, hum, pm25, noise, row_id, device in zip(
+                data["time"].tolist(), data["temperature"].tolist(), data["humidity"].tolist(),
+                data["pm25"].tolist(), data["noise"].tolist(), data["id"].tolist(), data["device"].tolist())
+        ]
+
+
+def read_rows(start_str, end_str, descending=False, device_id=None):
+    """读取时间范围内所有归档中的数据行"""
+    rows = []
+    for _, path in archives_for_range(start_str, end_str):
+        with ArchiveReader(path) as reader:
+            rows.extend(reader.read_rows(start_str, end_str, device_id))
+    if descending:
+        rows.reverse()
+    return rows
+
+
+def seal_partition(key, path):
+    """将一个已关闭的分区转存为归档并删除分区文件，返回 (行数, 分区字节数, 归档字节数)"""
+    conn = dbconn.connect_reader(path)
+    try:
+        rows = conn.execute(
+            "SELECT timestamp, temperature, humidity, pm25, noise, id, device_id FROM sensor_data ORDER BY timestamp"
+        ).fetchall()
+    finally:
+        conn.close()
+    target = archive_path(key)
+    if os.path.exists(target):
+        # 同一分区键已有归档 (例如先归档主库数据)，合并后重写
+        with ArchiveReader(target) as reader:
+            rows = reader.read_rows() + rows
+    count = write_archive(target, rows)
+    with ArchiveReader(target) as reader:
+        if reader.rows != count:
+            raise ValueError(f"归档校验失败: {target}")
+    part_bytes = partition.remove_partition(path)
+    return count, part_bytes, os.path.getsize(target)
+
+
+def seal_closed_partitions(before=None):
+    """归档所有在 before (默认今天零点) 之前结束的分区"""
+    before = before or datetime.now().strftime("%Y-%m-%d 00:00:00")
+    total_rows = total_before = total_after = 0
+    for key, path in partition.list_partitions():
+        if partition.key_bounds(key)[1] >= before:
+            continue
+        count, part_bytes, archive_bytes = seal_partition(key, path)
+        total_rows += count
+        total_before += part_bytes
+        total_after += archive_bytes
+        print(f"已归档分区 {key}: {count} 行, {part_bytes / 1024:.0f} KB -> {archive_bytes / 1024:.0f} KB")
+    return total_rows, total_before, total_after
+
+
+def seal_main_days(db_path=DB_PATH, before_days=7):
+    """将主库中早于 before_days 天的原始数据按天转存为归档并从主库删除"""
+    cutoff = (datetime.now() - timedelta(days=before_days)).strftime("%Y-%m-%d 00:00:00")
+    conn = dbconn.connect_writer(db_path)
+    total = 0
+    try:
+        days = [row[0] for row in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 10) FROM sensor_data WHERE timestamp < ? ORDER BY 1", (cutoff,)
+        )]
+        for day in days:
+            start, end = f"{day} 00:00:00", f"{day} 23:59:59"
+            rows = conn.execute(
+                "SELECT timestamp, temperature, humidity, pm25, noise, id, device_id FROM sensor_data "
+                "WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp", (start, end)
+            ).fetchall()
+            target = archive_path(day)
+            if os.path.exists(target):
+                with ArchiveReader(target) as reader:
+                    rows = reader.read_rows() + rows
+            count = write_archive(target, rows)
+            with conn:
+                conn.execute("DELETE FROM sensor_data WHERE timestamp BETWEEN ? AND ?", (start, end))
+            total += count
+            print(f"已归档主库数据 {day}: {count} 行 -> {os.path.getsize(target) / 1024:.0f} KB")
+    finally:
+        conn.close()
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 冷数据归档工具")
+    parser.add_argument("--seal", action="store_true", help="归档所有已关闭 (今天之前) 的分区文件")
+    parser.add_argument("--seal-main-before-days", type=int, default=None,
+                        help="将主库中早于指定天数的原始数据按天归档并删除")
+    parser.add_argument("--db", default=DB_PATH, help="主数据库文件路径")
+    parser.add_argument("--info", metavar="FILE", help="显示归档文件的信息")
+    args = parser.parse_args(argv)
+    start = time.monotonic()
+    try:
+        if args.info:
+            with ArchiveReader(args.info) as reader:
+                size = os.path.getsize(args.info)
+                print(f"{args.info}: {reader.rows} 行, {len(reader.index['blocks'])} 块, "
+                      f"{size} 字节 ({size / max(reader.rows, 1):.2f} 字节/行)")
+            return 0
+        if args.seal:
+            rows, before, after = seal_closed_partitions()
+            print(f"分区归档完成: {rows} 行, {before / 1048576:.1f} MB -> {after / 1048576:.1f} MB, "
+                  f"耗时 {time.monotonic() - start:.1f} 秒")
+            return 0
+        if args.seal_main_before_days is not None:
+            rows = seal_main_days(args.db, args.seal_main_before_days)
+            print(f"主库归档完成: {rows} 行, 耗时 {time.monotonic() - start:.1f} 秒")
+            return 0
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"归档出错: {e}", file=sys.stderr)
+        return 1
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
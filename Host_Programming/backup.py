@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import archive
+import dbconn
+import log
+import metrics
+import partition
+
+# 在线备份: 使用 SQLite 备份 API 按页分步复制，不需要停止采集。
+# 每次备份生成一个快照目录 db/backups/<YYYYmmdd-HHMMSS>/，包含 sqlite.db、partitions/ 与 archive/；
+# 未变化的分区和归档文件与上一个快照 (或原文件) 硬链接，不占用额外空间。
+# 恢复时停止程序，将快照目录中的文件拷回 db/ 即可。
+DB_PATH = "db/sqlite.db"
+BACKUP_DIR = "db/backups"
+BACKUP_INTERVAL = 24 * 3600.0   # 两次备份之间的间隔 (秒)
+KEEP_BACKUPS = 7                # 保留的快照数
+PAGES_PER_STEP = 256            # 每个备份步骤复制的页数
+MAX_RESTARTS = 3                # 源库被其他连接修改导致备份重新开始的次数上限，超过后改为单步复制
+MANIFEST_NAME = "manifest.json"
+
+logger = log.get_logger("backup")
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+class _StepTimer:
+    """备份进度回调: 统计每个步骤持有源库读锁的时间，并在步骤之间执行 between_steps"""
+
+    def __init__(self, label, conn=None, between_steps=None, verbose=False):
+        self.label = label
+        self.conn = conn
+        self.between_steps = between_steps
+        self.verbose = verbose
+        self.steps = 0
+        self.restarts = 0
+        self.max_ms = 0.0
+        self.total_ms = 0.0
+        self.pages = 0
+        self.last_remaining = None
+        self.step_start = time.monotonic()
+
+    def __call__(self, status, remaining, total):
+        step_ms = (time.monotonic() - self.step_start) * 1000.0
+        metrics.histogram("backup_step").observe(step_ms)
+        self.steps += 1
+        self.total_ms += step_ms
+        self.max_ms = max(self.max_ms, step_ms)
+        self.pages = total
+        if self.verbose:
+            print(f"备份 {self.label}: 步骤 {self.steps}, 剩余 {remaining}/{total} 页, 占用 {step_ms:.2f} ms")
+        if self.last_remaining is not None and remaining > self.last_remaining:
+            self.restarts += 1
+            if self.restarts > MAX_RESTARTS:
+                raise _BackupRestarted()
+        self.last_remaining = remaining
+        if remaining and self.between_steps is not None:
+            self.between_steps(self.conn)
+        self.step_start = time.monotonic()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def list_backups(backup_dir=None):
+    """返回已完成的快照 [(名称, 路径)]，按时间先后排序"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    return [(name, os.path.join(backup_dir, name)) for name in sorted(os.listdir(backup_dir))
+            if not name.endswith(".tmp") and os.path.isfile(os.path.join(backup_dir, name, MANIFEST_NAME))]
+
+
+def _load_manifest(snapshot_path):
+    try:
+        with open(os.path.join(snapshot_path, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def backup_connection(src_conn, dest_path, label, pages=PAGES_PER_STEP, name="main",
+                      between_steps=None, verbose=False):
+    """
+    将 src_conn 中的 name 库按页分步备份到 dest_path，返回步骤统计。
+    源库在步骤之间被其他连接修改时备份会重新开始，多次重新开始后改为一次性复制
+    (WAL 模式下只持有读快照，不阻塞写入)。
+    """
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        timer = _StepTimer(label, src_conn, between_steps, verbose)
+        try:
+            src_conn.backup(dest, pages=pages, progress=timer, name=name)
+        except _BackupRestarted:
+            logger.warning("备份 %s 时源库持续被修改，改为单步复制", label)
+            timer.last_remaining = None
+            timer.step_start = time.monotonic()
+            src_conn.backup(dest, pages=-1, progress=timer, name=name)
+    finally:
+        dest.close()
+    return timer
+
+
+class BackupJob:
+    """
+    定时在线备份任务，作为入库线程的后台任务运行。
+    主库通过入库连接本身分步备份: 同一连接上的写入不会使备份重新开始，
+    步骤之间调用 between_steps (入库线程的 write_pending) 写入已到达的样本，因此备份期间入库不会停顿。
+    分区文件大小有界，从独立连接单步复制；与上一个快照相比没有变化的分区直接硬链接。
+    """
+
+    def __init__(self, db_path=DB_PATH, backup_dir=None, interval=BACKUP_INTERVAL, keep=KEEP_BACKUPS,
+                 pages_per_step=PAGES_PER_STEP, between_steps=None, verbose=False):
+        self.db_path = db_path
+        self.backup_dir = backup_dir or BACKUP_DIR
+        self.interval = interval
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.between_steps = between_steps
+        self.verbose = verbose
+        self.next_run = time.monotonic() + self._seconds_until_due()
+
+    def _seconds_until_due(self):
+        backups = list_backups(self.backup_dir)
+        if not backups:
+            return 0.0
+        age = time.time() - os.path.getmtime(os.path.join(backups[-1][1], MANIFEST_NAME))
+        return max(0.0, self.interval - age)
+
+    def step(self, conn):
+        """到达备份时间时执行一次完整备份，返回是否执行了工作"""
+        if time.monotonic() < self.next_run:
+            return False
+        try:
+            self.run_backup(conn)
+        except (sqlite3.Error, OSError) as e:
+            logger.error("数据库备份失败: %s", e)
+        self.next_run = time.monotonic() + self.interval
+        return True
+
+    def _backup_partitions(self, snapshot_tmp, previous, manifest):
+        part_dir = os.path.join(snapshot_tmp, "partitions")
+        previous_parts = _load_manifest(previous).get("partitions", {}) if previous else {}
+        timers = []
+        for key, path in partition.list_partitions():
+            name = os.path.basename(path)
+            dest_path = os.path.join(part_dir, name)
+            os.makedirs(part_dir, exist_ok=True)
+            src = dbconn.connect_reader(path)
+            try:
+                signature = list(src.execute("SELECT MAX(id), COUNT(*) FROM sensor_data").fetchone())
+                old = previous_parts.get(name)
+                if old and old["signature"] == signature and os.path.exists(os.path.join(previous, "partitions", name)):
+                    _link_or_copy(os.path.join(previous, "partitions", name), dest_path)
+                    manifest["partitions"][name] = {"signature": signature, "copied": False}
+                    continue
+                timers.append(backup_connection(src, dest_path, name, pages=-1, verbose=self.verbose))
+                manifest["partitions"][name] = {"signature": signature, "copied": True}
+            finally:
+                src.close()
+        return timers
+
+    def _link_archives(self, snapshot_tmp, manifest):
+        for key, path in archive.list_archives():
+            archive_dir = os.path.join(snapshot_tmp, "archive")
+            os.makedirs(archive_dir, exist_ok=True)
+            # 归档文件写入后不再修改，硬链接即可
+            _link_or_copy(path, os.path.join(archive_dir, os.path.basename(path)))
+            manifest["archives"].append(os.path.basename(path))
+
+    def _prune(self):
+        for name, path in list_backups(self.backup_dir)[:-self.keep] if self.keep else []:
+            shutil.rmtree(path, ignore_errors=True)
+        for name in os.listdir(self.backup_dir):
+            if name.endswith(".tmp"):
+                shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+
+    def run_backup(self, conn):
+        """立即生成一个快照，返回快照目录"""
+        start = time.monotonic()
+        os.makedirs(self.backup_dir, exist_ok=True)
+        backups = list_backups(self.backup_dir)
+        previous = backups[-1][1] if backups else None
+        name = datetime.now().strftime("%Y%m%d-%H%M%S")
+        snapshot = os.path.join(self.backup_dir, name)
+        snapshot_tmp = snapshot + ".tmp"
+        shutil.rmtree(snapshot_tmp, ignore_errors=True)
+        os.makedirs(snapshot_tmp)
+
+        manifest = {"created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "partitions": {}, "archives": []}
+        main_timer = backup_connection(conn, os.path.join(snapshot_tmp, os.path.basename(self.db_path)), "主库",
+                                       self.pages_per_step, between_steps=self.between_steps, verbose=self.verbose)
+        part_timers = self._backup_partitions(snapshot_tmp, previous, manifest)
+        self._link_archives(snapshot_tmp, manifest)
+
+        timers = [main_timer] + part_timers
+        steps = sum(t.steps for t in timers)
+        manifest.update({
+            "main_pages": main_timer.pages,
+            "steps": steps,
+            "restarts": sum(t.restarts for t in timers),
+            "max_step_ms": round(max(t.max_ms for t in timers), 3),
+            "total_step_ms": round(sum(t.total_ms for t in timers), 3),
+        })
+        with open(os.path.join(snapshot_tmp, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(snapshot_tmp, snapshot)
+        self._prune()
+
+        copied = sum(1 for p in manifest["partitions"].values() if p["copied"])
+        logger.info("数据库备份完成: %s 主库 %d 页, 分区 复制 %d 个/沿用 %d 个, 归档 %d 个; "
+                    "备份步骤 %d 次, 单步最长占用 %.2f ms, p99 %.2f ms; 耗时 %.1f 秒",
+                    snapshot, main_timer.pages, copied, len(manifest['partitions']) - copied,
+                    len(manifest['archives']), steps, manifest['max_step_ms'],
+                    metrics.histogram('backup_step').percentile(0.99), time.monotonic() - start)
+        return snapshot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 在线备份工具 (SQLite 备份 API)")
+    parser.add_argument("--db", default=DB_PATH, help="主数据库文件路径")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="快照目录")
+    parser.add_argument("--keep", type=int, default=KEEP_BACKUPS, help="保留的快照数")
+    parser.add_argument("--pages", type=int, default=PAGES_PER_STEP, help="每个备份步骤复制的页数")
+    parser.add_argument("--run", action="store_true", help="立即生成一个快照")
+    parser.add_argument("--list", action="store_true", help="列出已有快照")
+    parser.add_argument("--verbose", action="store_true", help="输出每个备份步骤的锁占用时间")
+    args = parser.parse_args(argv)
+    log.setup("backup", log_dir=None)
+    if not (args.run or args.list):
+        parser.print_help()
+        return 1
+    try:
+        if args.run:
+            conn = dbconn.connect_writer(args.db)
+            try:
+                BackupJob(args.db, args.dir, keep=args.keep, pages_per_step=args.pages,
+                          verbose=args.verbose).run_backup(conn)
+            finally:
+                conn.close()
+        if args.list:
+            for name, path in list_backups(args.dir):
+                manifest = _load_manifest(path)
+                copied = sum(1 for p in manifest.get("partitions", {}).values() if p.get("copied"))
+                print(f"{name}: 主库 {manifest.get('main_pages', '?')} 页, "
+                      f"分区 {len(manifest.get('partitions', {}))} 个 (本次复制 {copied} 个), "
+                      f"归档 {len(manifest.get('archives', []))} 个, 单步最长 {manifest.get('max_step_ms', '?')} ms")
+    except (sqlite3.Error, OSError) as e:
+        print(f"数据库备份出错: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+import api
+import benchdata
+import router
+
+# HTTP 接口负载测试: 在临时工作目录中启动接口服务 (子进程)，多个保持连接的客户端按固定比例发送
+# 最新值、近期范围、过去某天 (可缓存，一半请求带 If-None-Match)、警报状态与跨天原始数据 (流式) 请求，
+# 报告吞吐量、各类请求的延迟分布与缓存命中情况。也可以用 --url 测试已在运行的接口服务。
+READY_TIMEOUT = 30.0     # 等待接口服务启动的最长时间 (秒)
+REQUEST_MIX = (          # (请求类型, 权重)
+    ("latest", 40),
+    ("recent", 20),
+    ("past_day", 25),
+    ("alarms", 10),
+    ("stream", 5),
+)
+STREAM_DAYS = 3          # 流式请求的时间跨度 (天)
+
+
+def _server_process(work_dir, port, pool_size, verbose):
+    os.chdir(work_dir)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    api.run_api("127.0.0.1", port, api.DB_PATH, pool_size)
+
+
+async def _request(reader, writer, path, headers=None):
+    """发送一个 GET 请求并读取完整响应，返回 (状态码, 响应头, 响应体)"""
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("服务端关闭了连接")
+    status = int(status_line.split()[1])
+    response_headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    if response_headers.get("transfer-encoding") == "chunked":
+        parts = []
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                await reader.readline()
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b"".join(parts)
+    else:
+        body = await reader.readexactly(int(response_headers.get("content-length", 0)))
+    return status, response_headers, body
+
+
+async def _fetch_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        status, _, body = await _request(reader, writer, path)
+    finally:
+        writer.close()
+    if status != 200:
+        raise RuntimeError(f"{path} 返回 {status}")
+    return json.loads(body)
+
+
+def _build_paths(latest_time):
+    """按数据中的最新时间构造各类请求的路径"""
+    day = datetime.strptime(latest_time[:10], "%Y-%m-%d")
+    latest = datetime.strptime(latest_time, "%Y-%m-%d %H:%M:%S")
+    past_days = [(day - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(1, 7)]
+    return {
+        'latest': ["/api/latest"],
+        'recent': ["/api/range?" + urlencode({'start': (latest - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S"),
+                                              'end': latest_time})],
+        'past_day': ["/api/range?" + urlencode({'start': d, 'end': d, 'resolution': resolution})
+                     for d in past_days for resolution in ("1m", "1h", "raw")],
+        'alarms': ["/api/alarms"],
+        'stream': ["/api/range?" + urlencode({
+            'start': (latest - timedelta(days=STREAM_DAYS)).strftime("%Y-%m-%d %H:%M:%S"),
+            'end': latest_time, 'resolution': "raw"})],
+    }
+
+
+async def _client(host, port, paths, deadline, results, rng):
+    kinds = [kind for kind, _ in REQUEST_MIX]
+    weights = [weight for _, weight in REQUEST_MIX]
+    etags = {}
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.monotonic() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            path = rng.choice(paths[kind])
+            headers = {}
+            if kind == "past_day" and path in etags and rng.random() < 0.5:
+                headers["If-None-Match"] = etags[path]
+            start = time.perf_counter()
+            status, response_headers, body = await _request(reader, writer, path, headers)
+            elapsed = time.perf_counter() - start
+            result = results[kind]
+            result['durations'].append(elapsed)
+            result['bytes'] += len(body)
+            result['status'][status] = result['status'].get(status, 0) + 1
+            cache = response_headers.get("x-cache")
+            if cache:
+                result['cache'][cache] = result['cache'].get(cache, 0) + 1
+            if "etag" in response_headers:
+                etags[path] = response_headers["etag"]
+            if response_headers.get("connection") == "close":
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+    finally:
+        writer.close()
+
+
+async def _run_clients(host, port, concurrency, duration, seed):
+    latest = await _fetch_json(host, port, "/api/latest")
+    times = [device['latest']['timestamp'] for device in latest['devices'] if device['latest']]
+    if not times:
+        raise RuntimeError("数据库中没有数据")
+    paths = _build_paths(max(times))
+    results = {kind: {'durations': [], 'bytes': 0, 'status': {}, 'cache': {}} for kind, _ in REQUEST_MIX}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(_client(host, port, paths, deadline, results, random.Random(seed + i))
+                           for i in range(concurrency)))
+    return results, time.monotonic() - started
+
+
+def run_bench(host, port, concurrency, duration, seed=0):
+    """对 host:port 上的接口服务执行一次负载测试并返回结果字典"""
+    results, elapsed = asyncio.run(_run_clients(host, port, concurrency, duration, seed))
+    total = sum(len(result['durations']) for result in results.values())
+    return {
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'requests': total,
+        'throughput': total / elapsed if elapsed else 0.0,
+        'kinds': {kind: dict(benchdata.summary(result['durations']), bytes=result['bytes'],
+                             status=result['status'], cache=result['cache'])
+                  for kind, result in results.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP 接口负载测试: 多个客户端并发请求，统计吞吐量、延迟与缓存命中")
+    parser.add_argument("--url", default=None, help="测试已在运行的接口服务 (如 http://127.0.0.1:8080)，省略时在临时目录中启动")
+    parser.add_argument("--db", default=None, help="用作测试数据的数据库文件 (复制到临时目录)，省略时生成数据")
+    parser.add_argument("--days", type=int, default=7, help="生成数据的天数")
+    parser.add_argument("--interval", type=float, default=5.0, help="生成数据的采样间隔 (秒)")
+    parser.add_argument("--pool", type=int, default=api.POOL_SIZE, help="接口服务的查询线程数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端 (连接) 数")
+    parser.add_argument("--duration", type=float, default=20.0, help="测试时长 (秒)")
+    parser.add_argument("--out", default=None, help="将结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示接口服务的输出")
+    args = parser.parse_args(argv)
+
+    work_dir = process = None
+    if args.url:
+        host, _, port = args.url.split("://")[-1].rstrip("/").partition(":")
+        port = int(port or 80)
+    else:
+        host, port = "127.0.0.1", benchdata.free_port()
+        work_dir = tempfile.mkdtemp(prefix="fluent_bench_api_")
+        os.makedirs(os.path.join(work_dir, "db"), exist_ok=True)
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            if args.db:
+                shutil.copy(os.path.join(cwd, args.db), router.DB_PATH)
+                router.connect_to_db()
+            else:
+                print(f"生成 {args.days} 天、每 {args.interval:g} 秒一条的测试数据...")
+                benchdata.generate_database(args.days, args.interval)
+        finally:
+            os.chdir(cwd)
+        process = multiprocessing.Process(target=_server_process, args=(work_dir, port, args.pool, args.verbose),
+                                          daemon=True)
+        process.start()
+
+    try:
+        deadline = time.monotonic() + READY_TIMEOUT
+        while True:
+            try:
+                asyncio.run(_fetch_json(host, port, "/api/devices"))
+                break
+            except OSError:
+                if time.monotonic() > deadline or (process is not None and not process.is_alive()):
+                    print("接口服务未能启动", file=sys.stderr)
+                    return 1
+                time.sleep(0.2)
+        print(f"负载测试: {args.concurrency} 个连接, {args.duration:.0f} 秒")
+        result = run_bench(host, port, args.concurrency, args.duration)
+    except (RuntimeError, OSError) as e:
+        print(f"负载测试失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join(5)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"共 {result['requests']} 个请求, 吞吐量 {result['throughput']:.0f} 请求/秒")
+    print(f"{'类型':<10}{'次数':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'最大 ms':>10}{'平均大小':>12}  状态码 / 缓存")
+    for kind, stats in result['kinds'].items():
+        if not stats['n']:
+            continue
+        print(f"{kind:<10}{stats['n']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+              f"{stats['max_ms']:>10.1f}{stats['bytes'] / stats['n']:>12.0f}  {stats['status']} {stats['cache'] or ''}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
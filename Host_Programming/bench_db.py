@@ -0,0 +1,121 @@
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import dbconn
+import migrations
+import query
+import router
+
+DB_PATH = "db/sqlite.db"
+
+
+def _legacy_connect(db_path):
+    """改造前的连接方式: 默认参数，每次打开都重新设置 WAL"""
+    conn = sqlite3.connect(db_path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _make_samples(count, start):
+    return [{
+        'timestamp': (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+        'temperature': round(random.uniform(15, 30), 1),
+        'humidity': round(random.uniform(30, 80), 1),
+        'pm25': random.randint(0, 80),
+        'noise': random.randint(30, 70),
+    } for i in range(count)]
+
+
+def bench_ingest(db_path, samples, batch_size):
+    """返回 {方式: 每秒写入样本数}"""
+    results = {}
+
+    start = time.perf_counter()
+    for data in samples:
+        conn = _legacy_connect(db_path)
+        with conn:
+            router.save_samples(conn, [data])
+        conn.close()
+    results["每条新建连接 (旧)"] = len(samples) / (time.perf_counter() - start)
+
+    for name, conn in (("默认参数长连接", _legacy_connect(db_path)),
+                       ("写入配置长连接", dbconn.connect_writer(db_path))):
+        start = time.perf_counter()
+        for i in range(0, len(samples), batch_size):
+            with conn:
+                router.save_samples(conn, samples[i:i + batch_size])
+        results[f"{name} (批量 {batch_size})"] = len(samples) / (time.perf_counter() - start)
+        conn.close()
+    return results
+
+
+def bench_query(db_path, end_str, repeats):
+    """返回 {查询: {方式: 每秒查询次数}}"""
+    end = datetime.strptime(end_str, "%Y-%m-%d %H:%M:%S")
+    cases = {
+        "最近5分钟 原始数据": ((end - timedelta(minutes=5)).strftime("%Y-%m-%d %H:%M:%S"), "raw"),
+        "最近1天 原始数据": ((end - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"), "raw"),
+        "最近7天 1小时汇总": ((end - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S"), "1h"),
+    }
+    results = {}
+    for case, (start_str, resolution) in cases.items():
+        results[case] = {}
+        start = time.perf_counter()
+        for _ in range(repeats):
+            conn = _legacy_connect(db_path)
+            query.fetch_range(conn, start_str, end_str, resolution)
+            conn.close()
+        results[case]["每次新建连接 (旧)"] = repeats / (time.perf_counter() - start)
+
+        conn = dbconn.reader(db_path)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            query.fetch_range(conn, start_str, end_str, resolution)
+        results[case]["读取配置长连接"] = repeats / (time.perf_counter() - start)
+    dbconn.close_readers()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SQLite 连接配置基准测试 (在数据库副本上运行，不修改原数据库)")
+    parser.add_argument("--db", default=DB_PATH, help="用作测试数据的数据库文件")
+    parser.add_argument("--samples", type=int, default=5000, help="写入测试的样本数")
+    parser.add_argument("--batch-size", type=int, default=router.WRITE_BATCH_SIZE, help="批量写入的事务大小")
+    parser.add_argument("--repeats", type=int, default=200, help="每种查询的重复次数")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="fluent_bench_")
+    db_path = os.path.join(work_dir, "bench.db")
+    try:
+        if os.path.exists(args.db):
+            shutil.copy(args.db, db_path)
+        conn = dbconn.connect_writer(db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        migrations.migrate(conn)
+        last = conn.execute("SELECT MAX(timestamp) FROM sensor_data").fetchone()[0]
+        conn.close()
+        start = datetime.strptime(last, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=1) if last else datetime.now()
+
+        print(f"写入测试: {args.samples} 个样本")
+        for name, rate in bench_ingest(db_path, _make_samples(args.samples, start), args.batch_size).items():
+            print(f"  {name:<28} {rate:>10.0f} 样本/秒")
+
+        end_str = (start + timedelta(seconds=args.samples)).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"查询测试: 每种查询 {args.repeats} 次")
+        for case, rates in bench_query(db_path, end_str, args.repeats).items():
+            for name, rate in rates.items():
+                print(f"  {case:<16} {name:<20} {rate:>10.0f} 次/秒")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
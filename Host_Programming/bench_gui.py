@@ -0,0 +1,319 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 界面渲染基准测试: 在 QT_QPA_PLATFORM=offscreen 下运行 (无需显示器)，使用临时目录中生成的数据库，
+# 测量启动 (含在新进程中导入界面模块的冷启动耗时与第一次打开图表页的耗时)、各时间范围下每次刷新
+# (MainWindow.update_all_data)、图表更新、历史表格填充与主题切换的耗时。
+# 结果写入 JSON，--compare 与另一次提交的结果比较并列出变慢的项目。
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtCore import QT_VERSION_STR, QEvent
+from PyQt5.QtWidgets import QApplication
+
+import benchdata
+import dbconn
+import router
+
+OUT_PATH = "bench_gui.json"
+TIME_RANGES = (1, 5, 15, 30, 60, 180, 720, 1440)  # 与设置页的时间范围选项一致 (分钟)
+PLOT_POINTS = (1000, 10000, 100000, 500000)
+TABLE_RESOLUTIONS = ("1h", "1m", "raw")           # 历史页按天查询的分辨率，行数由生成数据的间隔决定
+TABLE_MAX_ROWS = 2000                             # 历史表格每行创建状态标签，耗时随行数线性增长，测试时截断
+RESOURCE_DIRS = ("qss", "asset")                  # 界面按相对路径加载的资源，复制到临时工作目录
+CASE_TIME_BUDGET = 10.0                           # 单个测试项累计超过该时长 (秒) 后不再重复，大数据量时至少执行一次
+REGRESSION_THRESHOLD = 0.2                        # 比较时 p50 变慢超过该比例视为退化
+
+
+def _settle(app):
+    """处理完事件队列 (包括重绘)；没有运行事件循环时 deleteLater 不会生效，这里显式执行延迟删除"""
+    app.processEvents()
+    app.sendPostedEvents(None, QEvent.DeferredDelete)
+
+
+def _timed(app, func, repeats, budget=CASE_TIME_BUDGET):
+    """重复执行 func 并处理完事件队列 (包括重绘)，返回每次的耗时 (秒)；累计超过 budget 秒后提前结束"""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        _settle(app)
+        durations.append(time.perf_counter() - start)
+        if sum(durations) >= budget:
+            break
+    return durations
+
+
+def _open_page(window, page):
+    """切换到延迟创建的页面 (lazy_page.LazyPage) 并返回真正的页面控件"""
+    window.switchTo(page)
+    return page.ensure()
+
+
+def _cold_import(repo_dir, repeats):
+    """在新的解释器中导入界面模块 (fluent) 的耗时 (秒)，包括 PyQt 与界面库，与实际启动时一致"""
+    code = "import time; t = time.perf_counter(); import fluent; print('IMPORT', time.perf_counter() - t)"
+    durations = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", code], cwd=repo_dir, capture_output=True, text=True,
+                                timeout=60).stdout
+        for line in output.splitlines():
+            if line.startswith("IMPORT "):
+                durations.append(float(line.split()[1]))
+    return durations
+
+
+def bench_startup(app, repeats, repo_dir):
+    cold_import = _cold_import(repo_dir, repeats)
+    start = time.perf_counter()
+    import fluent
+    import_seconds = time.perf_counter() - start
+
+    construct, first_paint, first_update, first_page = [], [], [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        window = fluent.MainWindow(start_router=False)
+        window.timer.stop()
+        window.device_timer.stop()
+        constructed = time.perf_counter()
+        window.show()
+        app.processEvents()
+        shown = time.perf_counter()
+        window.update_all_data()
+        app.processEvents()
+        updated = time.perf_counter()
+        _open_page(window, window.plotsPage)
+        _settle(app)
+        opened = time.perf_counter()
+        construct.append(constructed - start)
+        first_paint.append(shown - constructed)
+        first_update.append(updated - shown)
+        first_page.append(opened - updated)
+        window.hide()
+        window.deleteLater()
+        _settle(app)
+    result = {
+        'import_ms': import_seconds * 1000,
+        'construct': benchdata.summary(construct),
+        'first_paint': benchdata.summary(first_paint),
+        'first_update': benchdata.summary(first_update),
+        'first_plots_page': benchdata.summary(first_page),
+    }
+    if cold_import:
+        result['import_cold'] = benchdata.summary(cold_import)
+    return result
+
+
+def bench_update_ticks(app, window, ticks):
+    """各时间范围下的每次刷新耗时 (图表页可见，包含查询、渲染与警报检查)"""
+    _open_page(window, window.plotsPage)
+    default_minutes = window.time_range_minutes
+    results = {}
+    for minutes in TIME_RANGES:
+        window.time_range_minutes = minutes
+        window.update_all_data()  # 预热: 首次查询会打开连接并加载页缓存
+        app.processEvents()
+        result = benchdata.summary(_timed(app, window.update_all_data, ticks))
+        result['points'] = len(window.data_cache['times'])
+        results[f"{minutes}m"] = result
+    window.time_range_minutes = default_minutes
+    return results
+
+
+def bench_plots(app, window, point_counts, repeats):
+    """PlotsWidget.update_data 在不同点数下的耗时 (四条曲线)"""
+    _open_page(window, window.plotsPage)
+    rng = random.Random(1)
+    end = time.time()
+    results = {}
+    for count in point_counts:
+        times = [end - (count - i) for i in range(count)]
+        series = [[rng.uniform(low, high) for _ in range(count)] for low, high in ((15, 30), (30, 80), (0, 150), (30, 80))]
+        results[str(count)] = benchdata.summary(_timed(
+            app, lambda: window.plotsWidget.update_data(times, *series), repeats))
+    window.update_all_data()  # 恢复为数据库中的数据，避免大量点影响后续测试
+    _settle(app)
+    return results
+
+
+def bench_history_table(app, window, day, repeats, max_rows=TABLE_MAX_ROWS):
+    """HistoryWidget.update_table 填充一天数据的耗时 (按分辨率，行数与历史页查询一致，超过 max_rows 时截断)"""
+    import query
+    _open_page(window, window.historyPage)
+    conn = dbconn.reader(router.DB_PATH)
+    results = {}
+    for resolution in TABLE_RESOLUTIONS:
+        rows = query.fetch_range(conn, f"{day} 00:00:00", f"{day} 23:59:59", resolution, descending=True,
+                                 device_id=window.current_device_id)
+        day_rows = len(rows)
+        rows = rows[:max_rows]
+        result = benchdata.summary(_timed(app, lambda: window.historyWidget.update_table(rows), repeats))
+        result['rows'] = len(rows)
+        result['day_rows'] = day_rows
+        results[resolution] = result
+    window.historyWidget.update_table([])  # 清空表格，避免影响后续的主题切换测试
+    _settle(app)
+    return results
+
+
+def bench_theme(app, window, repeats):
+    """深浅主题来回切换的耗时"""
+    _open_page(window, window.plotsPage)
+    durations = _timed(app, lambda: window.on_theme_changed(not window.dark_mode), repeats * 2)
+    window.on_theme_changed(False)
+    app.processEvents()
+    return {'switch': benchdata.summary(durations)}
+
+
+def _git_commit(repo_dir):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _flatten(results, prefix=""):
+    """{组: {项目: {p50_ms: ...}}} -> {'组/项目': (p50_ms, 表格行数)}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict) and 'p50_ms' in value:
+            flat[name] = (value['p50_ms'], value.get('rows'))
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, name))
+    return flat
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """逐项比较 p50，返回变慢超过 threshold 的项目 [(名称, 基线, 当前)]；数据量不同的项目不参与比较"""
+    old, new = _flatten(baseline['results']), _flatten(current['results'])
+    regressions = []
+    print(f"与 {baseline['meta'].get('commit') or '基线'} 比较 (p50, 毫秒):")
+    for name in sorted(set(old) & set(new)):
+        (old_ms, old_size), (new_ms, new_size) = old[name], new[name]
+        if old_size != new_size:
+            print(f"  {name:<32} 数据量不同 ({old_size} / {new_size})，跳过")
+            continue
+        ratio = new_ms / old_ms if old_ms else 1.0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  变慢"
+            regressions.append((name, old_ms, new_ms))
+        elif ratio < 1 - threshold:
+            flag = "  变快"
+        print(f"  {name:<32} {old_ms:>10.2f} -> {new_ms:>10.2f} ({ratio:>5.2f}×){flag}")
+    return regressions
+
+
+def run(args, repo_dir):
+    meta = {
+        'commit': _git_commit(repo_dir),
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'platform': platform.platform(),
+        'qpa': os.environ.get("QT_QPA_PLATFORM"),
+        'days': args.days,
+        'interval': args.interval,
+    }
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+
+    print(f"生成 {args.days} 天、每 {args.interval} 秒一条的测试数据...")
+    start = time.perf_counter()
+    meta['rows'] = benchdata.generate_database(args.days, args.interval)
+    print(f"  {meta['rows']} 行, 用时 {time.perf_counter() - start:.1f} 秒")
+
+    results = {}
+    print("启动...")
+    results['startup'] = bench_startup(app, args.startup_repeats, repo_dir)
+
+    import fluent
+    window = fluent.MainWindow(start_router=False)
+    window.timer.stop()
+    window.device_timer.stop()
+    window.show()
+    app.processEvents()
+    try:
+        print("刷新 (update_all_data)...")
+        results['update_tick'] = bench_update_ticks(app, window, args.ticks)
+        print("图表 (PlotsWidget.update_data)...")
+        results['plot_update'] = bench_plots(app, window, args.points, args.repeats)
+        print("历史表格 (HistoryWidget.update_table)...")
+        day = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        results['history_table'] = bench_history_table(app, window, day, args.table_repeats, args.table_max_rows)
+        print("主题切换...")
+        results['theme'] = bench_theme(app, window, args.repeats)
+    finally:
+        window.close()
+        dbconn.close_readers()
+    return {'meta': meta, 'results': results}
+
+
+def _print_results(report):
+    startup = report['results']['startup']
+    cold = f"冷启动导入 {startup['import_cold']['p50_ms']:.0f} 毫秒, " if 'import_cold' in startup else ""
+    print(f"启动: {cold}导入 {startup['import_ms']:.0f} 毫秒, 构造 {startup['construct']['p50_ms']:.0f} 毫秒, "
+          f"首次显示 {startup['first_paint']['p50_ms']:.0f} 毫秒, 首次刷新 {startup['first_update']['p50_ms']:.0f} 毫秒, "
+          f"首次打开图表页 {startup['first_plots_page']['p50_ms']:.0f} 毫秒")
+    for group in ('update_tick', 'plot_update', 'history_table', 'theme'):
+        for case, stats in report['results'][group].items():
+            size = f" ({stats['points']} 点)" if 'points' in stats else f" ({stats['rows']} 行)" if 'rows' in stats else ""
+            print(f"  {group:<14} {case + size:<20} p50 {stats['p50_ms']:>9.2f}  p95 {stats['p95_ms']:>9.2f}  "
+                  f"最大 {stats['max_ms']:>9.2f} 毫秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="界面渲染基准测试 (offscreen，使用生成的数据库，不修改正式数据)")
+    parser.add_argument("--out", default=OUT_PATH, help="结果 JSON 文件")
+    parser.add_argument("--compare", metavar="BASELINE", default=None, help="与之前保存的结果比较，发现退化时返回非零退出码")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="p50 变慢超过该比例视为退化")
+    parser.add_argument("--days", type=int, default=2, help="生成数据的天数")
+    parser.add_argument("--interval", type=float, default=5.0, help="生成数据的采样间隔 (秒)")
+    parser.add_argument("--ticks", type=int, default=20, help="每个时间范围测量的刷新次数")
+    parser.add_argument("--repeats", type=int, default=5, help="图表与主题切换的重复次数")
+    parser.add_argument("--table-repeats", type=int, default=2, help="历史表格的重复次数 (每次填充较慢)")
+    parser.add_argument("--table-max-rows", type=int, default=TABLE_MAX_ROWS, help="历史表格最多填充的行数")
+    parser.add_argument("--startup-repeats", type=int, default=3, help="构造主窗口的次数")
+    parser.add_argument("--points", type=int, nargs="+", default=list(PLOT_POINTS), help="图表测试的点数")
+    args = parser.parse_args(argv)
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    out_path = os.path.abspath(args.out)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    work_dir = tempfile.mkdtemp(prefix="fluent_bench_gui_")
+    previous_dir = os.getcwd()
+    try:
+        for name in RESOURCE_DIRS:
+            if os.path.isdir(os.path.join(repo_dir, name)):
+                shutil.copytree(os.path.join(repo_dir, name), os.path.join(work_dir, name))
+        os.chdir(work_dir)
+        report = run(args, repo_dir)
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    _print_results(report)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {out_path}")
+
+    if baseline is not None and compare(baseline, report, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import api
+import benchdata
+import service
+import simulator
+
+# 实时推送基准测试: 在临时工作目录中启动后台服务 (UDP 采集，子进程) 与 HTTP 接口，模拟下位机按指定速率发送，
+# 大量 SSE 客户端同时订阅 /api/stream。统计每个客户端收到的样本数与缺失数、同一样本到达各客户端的时间差
+# (分发延迟)、慢速客户端的丢弃数与服务进程的 CPU 占用。
+# --feed ingest: 接口与采集在同一进程，由入库线程直接推送；--feed tail: 接口单独运行，跟踪数据库中的新数据。
+READY_TIMEOUT = 30.0      # 等待服务启动与客户端全部订阅的最长时间 (秒)
+SETTLE_SECONDS = 1.0      # 全部客户端订阅后等待该时长再开始统计，测量窗口结束前同样留出该时长
+SLOW_READ_DELAY = 1.0     # 慢速客户端每次读取之间的停顿 (秒)
+SLOW_READ_SIZE = 1024     # 慢速客户端每次读取的字节数
+CLIENT_WORKERS = min(4, os.cpu_count() or 1)  # 运行订阅者的进程数
+
+
+def _service_process(work_dir, udp_port, api_port, feed, verbose):
+    os.chdir(work_dir)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    argv = ["--udp", str(udp_port), "--bind", "127.0.0.1", "--no-alarms"]
+    if feed == "ingest":
+        argv += ["--api", str(api_port)]
+    service.main(argv)
+
+
+def _api_process(work_dir, api_port, verbose):
+    os.chdir(work_dir)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    api.run_api("127.0.0.1", api_port)
+
+
+def _cpu_seconds(pid):
+    """进程 (含所有线程) 累计占用的 CPU 时间 (秒)，非 Linux 平台返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Subscriber:
+    """一个 SSE 客户端 (HTTP/1.0 请求，响应以关闭连接结束，无需分块解码)"""
+
+    def __init__(self, path, slow=False):
+        self.path = path
+        self.slow = slow
+        self.received = {}     # {事件id: 收到的时间}
+        self.dropped = 0       # 服务端通知的丢弃数
+        self.subscribed = asyncio.Event()
+
+    async def run(self, host, port, stop):
+        reader, writer = await asyncio.open_connection(host, port)
+        stopped = asyncio.ensure_future(stop.wait())
+        try:
+            writer.write(f"GET {self.path} HTTP/1.0\r\nAccept: text/event-stream\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            header, _, buffer = (await reader.readuntil(b"\r\n\r\n")).partition(b"\r\n\r\n")
+            if b" 200 " not in header.split(b"\r\n", 1)[0]:
+                raise RuntimeError(f"订阅失败: {header.splitlines()[0].decode('latin-1')}")
+            while not stop.is_set():
+                read = asyncio.ensure_future(reader.read(SLOW_READ_SIZE if self.slow else 65536))
+                done, _ = await asyncio.wait({read, stopped}, return_when=asyncio.FIRST_COMPLETED)
+                if read not in done:
+                    read.cancel()
+                    break
+                data = read.result()
+                if not data:
+                    break
+                now = time.monotonic()
+                buffer += data
+                *events, buffer = buffer.split(b"\n\n")
+                for event in events:
+                    self._handle(event, now)
+                if self.slow:
+                    await asyncio.sleep(SLOW_READ_DELAY)
+        finally:
+            stopped.cancel()
+            writer.close()
+
+    def _handle(self, event, now):
+        if event.startswith(b"id: "):
+            self.received[int(event[4:event.index(b"\n")])] = now
+        elif event.startswith(b"event: dropped"):
+            self.dropped += json.loads(event.split(b"data: ", 1)[1])['count']
+        elif event.startswith(b"retry: "):
+            self.subscribed.set()
+
+
+async def _run_subscribers(host, port, count, slow_count, path, ready_queue, stop_at):
+    subscribers = [Subscriber(path, slow=i < slow_count) for i in range(count)]
+    stop = asyncio.Event()
+    tasks = [asyncio.ensure_future(s.run(host, port, stop)) for s in subscribers]
+    waiting = asyncio.ensure_future(asyncio.gather(*(s.subscribed.wait() for s in subscribers)))
+    done, _ = await asyncio.wait([waiting, *tasks], timeout=READY_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+    if waiting not in done:
+        stop.set()
+        waiting.cancel()
+        errors = [t.exception() for t in tasks if t.done() and t.exception()]
+        ready_queue.put(f"客户端未能全部订阅: {errors[0] if errors else '超时'}")
+        return []
+    ready_queue.put(None)
+    while not stop_at.value or time.monotonic() < stop_at.value:
+        await asyncio.sleep(0.1)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return [(s.slow, s.dropped, s.received) for s in subscribers]
+
+
+def _client_process(host, port, count, slow_count, path, ready_queue, stop_at, result_queue):
+    """一个客户端进程运行一组订阅者 (单个事件循环解析大量事件时会成为瓶颈，因此分散到多个进程)"""
+    result_queue.put(asyncio.run(_run_subscribers(host, port, count, slow_count, path, ready_queue, stop_at)))
+
+
+def run_clients(host, port, count, slow_count, path, duration, workers):
+    """
+    在 workers 个进程中运行订阅者，全部订阅后开始计时，返回 ([(慢速, 丢弃数, {事件id: 收到时间})], 窗口起点, 窗口终点)。
+    各进程记录的 time.monotonic() 在同一台机器上可直接比较。
+    """
+    ready_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    stop_at = multiprocessing.Value("d", 0.0)
+    processes = []
+    for i in range(workers):
+        share = count // workers + (1 if i < count % workers else 0)
+        slow_share = slow_count // workers + (1 if i < slow_count % workers else 0)
+        processes.append(multiprocessing.Process(
+            target=_client_process, args=(host, port, share, slow_share, path, ready_queue, stop_at, result_queue),
+            daemon=True))
+    for process in processes:
+        process.start()
+    try:
+        errors = [ready_queue.get(timeout=READY_TIMEOUT * 2) for _ in processes]
+        window_start = time.monotonic() + SETTLE_SECONDS
+        window_end = window_start + duration
+        stop_at.value = window_end + SETTLE_SECONDS
+        results = [result_queue.get(timeout=duration + READY_TIMEOUT * 2) for _ in processes]
+    finally:
+        stop_at.value = stop_at.value or time.monotonic()
+        for process in processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+    errors = [error for error in errors if error]
+    if errors:
+        raise RuntimeError(errors[0])
+    return [client for result in results for client in result], window_start, window_end
+
+
+def _percentiles(values):
+    ordered = sorted(values)
+    n = len(ordered)
+    if not n:
+        return {'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+    return {
+        'p50_ms': ordered[n // 2] * 1000,
+        'p99_ms': ordered[min(int(n * 0.99), n - 1)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def analyze(clients, window_start, window_end):
+    """以测量窗口内任一客户端收到的事件为应收集合，统计各正常客户端的缺失数与分发延迟"""
+    first_seen = {}
+    for _, _, received in clients:
+        for event_id, t in received.items():
+            if event_id not in first_seen or t < first_seen[event_id]:
+                first_seen[event_id] = t
+    expected = {event_id for event_id, t in first_seen.items() if window_start <= t <= window_end}
+    normal = [(dropped, received) for slow, dropped, received in clients if not slow]
+    slow = [(dropped, received) for is_slow, dropped, received in clients if is_slow]
+    missing = [len(expected - received.keys()) for _, received in normal]
+    spread = [received[event_id] - first_seen[event_id] for _, received in normal for event_id in expected
+              if event_id in received]
+    return {
+        'events': len(expected),
+        'event_rate': len(expected) / (window_end - window_start),
+        'delivered': sum(len(expected & received.keys()) for _, received in normal),
+        'missing_total': sum(missing),
+        'missing_max': max(missing) if missing else 0,
+        'fanout_spread': _percentiles(spread),
+        'slow_clients': len(slow),
+        'slow_received': sum(len(received) for _, received in slow),
+        'slow_dropped': sum(dropped for dropped, _ in slow),
+        'normal_dropped': sum(dropped for dropped, _ in normal),
+    }
+
+
+def run_bench(subscribers, rate, duration, device_count=1, feed="ingest", slow=0, interval=0.0, queue_size=None,
+              workers=CLIENT_WORKERS, verbose=False):
+    """执行一次测试并返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix="fluent_bench_live_")
+    os.makedirs(os.path.join(work_dir, "db"), exist_ok=True)
+    udp_port, api_port = benchdata.free_port(socket.SOCK_DGRAM), benchdata.free_port()
+    processes = [multiprocessing.Process(target=_service_process,
+                                         args=(work_dir, udp_port, api_port, feed, verbose), daemon=True)]
+    if feed == "tail":
+        processes.append(multiprocessing.Process(target=_api_process, args=(work_dir, api_port, verbose),
+                                                 daemon=True))
+    device_list = []
+    try:
+        processes[0].start()
+        deadline = time.monotonic() + READY_TIMEOUT
+        while service.read_service(os.path.join(work_dir, service.SERVICE_FILE)) is None:
+            if time.monotonic() > deadline or not processes[0].is_alive():
+                raise RuntimeError("后台服务未能启动")
+            time.sleep(0.2)
+        for process in processes[1:]:
+            process.start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", api_port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("HTTP 接口未能启动")
+                time.sleep(0.2)
+
+        device_list = simulator.start_devices(device_count, rate / device_count,
+                                              udp_target=("127.0.0.1", udp_port))
+        params = [f"interval={interval:g}"] if interval else []
+        if queue_size:
+            params.append(f"queue={queue_size}")
+        path = "/api/stream" + ("?" + "&".join(params) if params else "")
+
+        cpu_before = [_cpu_seconds(p.pid) for p in processes]
+        wall_before = time.monotonic()
+        clients, window_start, window_end = run_clients("127.0.0.1", api_port, subscribers, slow, path, duration,
+                                                        workers)
+        wall = time.monotonic() - wall_before
+        cpu_after = [_cpu_seconds(p.pid) for p in processes]
+    finally:
+        for device in device_list:
+            device.stop()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join(5)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result = analyze(clients, window_start, window_end)
+    if None not in cpu_before + cpu_after:
+        result['server_cpu'] = (sum(cpu_after) - sum(cpu_before)) / wall
+    result.update({'feed': feed, 'subscribers': subscribers, 'rate': rate, 'interval': interval,
+                   'sent': simulator.total_stats(device_list).get('samples', 0)})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="实时推送基准测试: 大量 SSE 客户端订阅新数据，统计送达率、分发延迟与丢弃")
+    parser.add_argument("--subscribers", type=int, default=200, help="订阅客户端数")
+    parser.add_argument("--slow", type=int, default=0, help="其中读取缓慢的客户端数 (用于观察丢弃最旧数据的背压处理)")
+    parser.add_argument("--rate", type=float, default=50.0, help="所有模拟设备合计每秒发送的样本数")
+    parser.add_argument("--devices", type=int, default=1, help="模拟设备数 (UDP)")
+    parser.add_argument("--duration", type=float, default=20.0, help="测量时长 (秒)")
+    parser.add_argument("--feed", choices=("ingest", "tail"), default="ingest",
+                        help="推送来源: ingest 为入库线程直接推送，tail 为单独运行的接口跟踪数据库")
+    parser.add_argument("--interval", type=float, default=0.0, help="客户端请求的降采样间隔 (秒)")
+    parser.add_argument("--queue", type=int, default=None, help="客户端请求的队列长度")
+    parser.add_argument("--workers", type=int, default=CLIENT_WORKERS, help="运行订阅者的客户端进程数")
+    parser.add_argument("--out", default=None, help="将结果写入 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示服务进程的输出")
+    args = parser.parse_args(argv)
+
+    print(f"实时推送测试: {args.subscribers} 个订阅者 (慢速 {args.slow}), {args.rate:.0f} 样本/秒, "
+          f"来源 {args.feed}, {args.duration:.0f} 秒")
+    try:
+        result = run_bench(args.subscribers, args.rate, args.duration, args.devices, args.feed, args.slow,
+                           args.interval, args.queue, args.workers, args.verbose)
+    except (RuntimeError, OSError) as e:
+        print(f"测试失败: {e}", file=sys.stderr)
+        return 1
+
+    normal = args.subscribers - args.slow
+    print(f"测量窗口内推送 {result['events']} 个样本 ({result['event_rate']:.1f}/秒), "
+          f"正常客户端共收到 {result['delivered']} 个 (应收 {result['events'] * normal}), "
+          f"缺失 {result['missing_total']} 个 (单个客户端最多 {result['missing_max']})")
+    spread = result['fanout_spread']
+    if spread['p50_ms'] is not None:
+        print(f"分发延迟 (相对最早收到的客户端): p50 {spread['p50_ms']:.1f} ms, p99 {spread['p99_ms']:.1f} ms, "
+              f"最大 {spread['max_ms']:.1f} ms")
+    if args.slow:
+        print(f"慢速客户端收到 {result['slow_received']} 个, 服务端丢弃 {result['slow_dropped']} 个")
+    if result['normal_dropped']:
+        print(f"正常客户端被丢弃 {result['normal_dropped']} 个")
+    if 'server_cpu' in result:
+        print(f"服务进程 CPU 占用: {result['server_cpu'] * 100:.0f}%")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import argparse
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import protocol
+import router
+
+V2_BATCH_SIZES = (10, 100, 500)
+
+
+def _make_samples(count):
+    return [{
+        'temperature': round(random.uniform(15, 30), 1),
+        'humidity': round(random.uniform(30, 80), 1),
+        'pm25': random.randint(0, 80),
+        'noise': random.randint(30, 70),
+    } for _ in range(count)]
+
+
+def encode_stream(samples, fmt, batch_size=1):
+    """用模拟下位机编码器把样本编码为连续的字节流"""
+    start_time = int(time.time())
+    if fmt == "v1":
+        return b''.join(protocol.encode_v1(s) for s in samples)
+    if fmt == "seq":
+        return b''.join(protocol.encode_seq(s, i, start_time + i) for i, s in enumerate(samples))
+    frames = []
+    for i in range(0, len(samples), batch_size):
+        batch = samples[i:i + batch_size]
+        frames.append(protocol.encode_v2(batch, i, [start_time + i + j for j in range(len(batch))]))
+    return b''.join(frames)
+
+
+def _decode_v2_struct(frame):
+    """对照: 逐个样本用 struct 解析 v2 帧 (输出与 protocol.decode_v2 相同)"""
+    count = (len(frame) - protocol.V2_PREFIX_SIZE - 4) // protocol.V2_RECORD_SIZE
+    if zlib.crc32(frame[4:-4]) != struct.unpack('>I', frame[-4:])[0]:
+        raise ValueError("CRC 校验失败")
+    record = struct.Struct('>IIhHHB')
+    samples = []
+    for i in range(count):
+        seq, device_time, t, h, pm25, noise = record.unpack_from(frame, protocol.V2_PREFIX_SIZE + i * record.size)
+        data = {"temperature": t / 10.0, "humidity": h / 10.0, "pm25": pm25, "noise": noise,
+                "seq": seq, "device_time": device_time}
+        if device_time >= protocol.MIN_DEVICE_TIME:
+            data['timestamp'] = datetime.fromtimestamp(device_time).strftime("%Y-%m-%d %H:%M:%S")
+        samples.append(data)
+    return samples
+
+
+def check_resync():
+    """
+    自检: v2 帧的样本数字段损坏 (CRC 校验失败) 时，分帧只丢弃坏帧的字节，紧随其后的完好帧仍能取出。
+    返回错误描述，通过时返回 None。
+    """
+    start_time = int(time.time())
+    samples = _make_samples(6)
+    good = [protocol.encode_v2(samples[:2], 0, [start_time, start_time + 1]),
+            protocol.encode_v2(samples[2:4], 2, [start_time + 2, start_time + 3]),
+            protocol.encode_v2(samples[4:], 4, [start_time + 4, start_time + 5])]
+    damaged = bytearray(protocol.encode_v2(samples[:1], 100, [start_time]))
+    # 样本数 1 -> 3: 声明的长度覆盖到下一帧，整帧 CRC 不再匹配
+    struct.pack_into('>H', damaged, 6, 3)
+    reader = router.FrameReader()
+    reader.feed(good[0] + bytes(damaged) + good[1] + good[2])
+    frames = []
+    while (frame := reader.pop_frame()) is not None:
+        frames.append(frame)
+    if frames != good:
+        missing = [i for i, frame in enumerate(good) if frame not in frames]
+        return f"取出 {len(frames)} 个帧，其中缺少第 {missing} 个完好的帧"
+    if [s['seq'] for frame in frames for s in protocol.decode_v2(frame)] != [0, 1, 2, 3, 4, 5]:
+        return "取出的帧解析结果与编码的样本不一致"
+    return None
+
+
+def bench_receive(stream, sample_count):
+    """经本机 socketpair 发送字节流，用接收线程相同的分帧与解析逻辑读取，返回每秒样本数"""
+    sender, receiver = socket.socketpair()
+    receiver.settimeout(router.CLIENT_RECV_TIMEOUT)
+    thread = threading.Thread(target=sender.sendall, args=(stream,), daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    reader = router.FrameReader(receiver)
+    received = 0
+    while received < sample_count:
+        received += len(protocol.decode_frames(reader.next_frame()))
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return sample_count / elapsed
+
+
+def bench_decode(frames, decoder, repeats):
+    count = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for frame in frames:
+            count += len(decoder(frame))
+    return count / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下位机帧格式吞吐量对比 (v1 / 序号帧 / v2 多样本帧)")
+    parser.add_argument("--samples", type=int, default=200000, help="每种格式发送的样本数")
+    parser.add_argument("--repeats", type=int, default=3, help="纯解析测试的重复次数")
+    args = parser.parse_args(argv)
+
+    error = check_resync()
+    if error is not None:
+        print(f"分帧自检失败: {error}", file=sys.stderr)
+        return 1
+    print("分帧自检通过: v2 帧 CRC 校验失败后重新对齐到下一帧")
+
+    samples = _make_samples(args.samples)
+    cases = [("v1", "v1", 1), ("序号帧", "seq", 1)] + [(f"v2 ×{n}", "v2", n) for n in V2_BATCH_SIZES]
+    print(f"接收测试: 每种格式 {args.samples} 个样本 (分帧 + 解析，经本机 socket)")
+    for name, fmt, batch_size in cases:
+        stream = encode_stream(samples, fmt, batch_size)
+        rate = bench_receive(stream, args.samples)
+        print(f"  {name:<8} {len(stream) / args.samples:>6.2f} 字节/样本 {rate:>12.0f} 样本/秒")
+
+    print(f"v2 解析对比: 每种批量重复 {args.repeats} 次")
+    start_time = int(time.time())
+    for batch_size in V2_BATCH_SIZES:
+        frames = [protocol.encode_v2(samples[i:i + batch_size], i,
+                                     [start_time + i + j for j in range(len(samples[i:i + batch_size]))])
+                  for i in range(0, args.samples, batch_size)]
+        for name, decoder in (("struct 逐条", _decode_v2_struct), ("numpy 整批", protocol.decode_v2)):
+            rate = bench_decode(frames, decoder, args.repeats)
+            print(f"  v2 ×{batch_size:<4} {name:<10} {rate:>12.0f} 样本/秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
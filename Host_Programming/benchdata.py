@@ -0,0 +1,60 @@
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+
+import dbconn
+import router
+
+# 基准测试脚本 (bench_gui / bench_api / bench_live) 共用的工具: 生成测试数据库、汇总耗时、分配本机端口。
+# 不导入 Qt，接口与推送测试的子进程也可以使用。
+GENERATE_BATCH = 5000
+
+
+def generate_database(days, interval, end=None):
+    """在当前目录的 db/ 下生成 days 天、每 interval 秒一条的数据 (截止到 end)，返回行数"""
+    os.makedirs("db", exist_ok=True)
+    router.connect_to_db()
+    end = end or datetime.now()
+    t = end - timedelta(days=days)
+    rng = random.Random(0)
+    conn = dbconn.connect_writer(router.DB_PATH)
+    count = 0
+    batch = []
+    try:
+        while t <= end:
+            batch.append({'timestamp': t.strftime("%Y-%m-%d %H:%M:%S"),
+                          'temperature': round(22 + rng.gauss(0, 2), 1), 'humidity': round(50 + rng.gauss(0, 8), 1),
+                          'pm25': rng.randint(5, 120), 'noise': rng.randint(30, 80)})
+            t += timedelta(seconds=interval)
+            if len(batch) >= GENERATE_BATCH or t > end:
+                with conn:
+                    router.save_samples(conn, batch)
+                count += len(batch)
+                batch = []
+    finally:
+        conn.close()
+    return count
+
+
+def summary(durations):
+    """将一组耗时 (秒) 汇总为毫秒统计"""
+    ordered = sorted(durations)
+    n = len(ordered)
+    if not n:
+        return {'n': 0}
+    return {
+        'n': n,
+        'mean_ms': sum(ordered) / n * 1000,
+        'p50_ms': ordered[n // 2] * 1000,
+        'p95_ms': ordered[min(int(n * 0.95), n - 1)] * 1000,
+        'p99_ms': ordered[min(int(n * 0.99), n - 1)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    """返回本机上一个空闲的端口 (kind 为 SOCK_STREAM 或 SOCK_DGRAM)"""
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
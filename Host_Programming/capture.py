@@ -0,0 +1,138 @@
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+
+import log
+
+# 原始字节流录制文件格式 (小端):
+#   文件头: b'FSCAP' | 版本 uint8 | JSON 头长度 uint32 | JSON 头 {"started": 录制开始的 Unix 时间, ...}
+#   记录:   类型 uint8 | 来源编号 uint16 | 距录制开始的微秒数 uint64 | 负载长度 uint32 | 负载
+# 类型 SOURCE 的负载为来源地址 (UTF-8)，此后的记录用编号引用该来源；
+# OPEN / CLOSE 标记一次 TCP 连接的开始与结束 (回放时据此重置分帧缓冲区)，DATA 为一次 recv 得到的字节，
+# DATAGRAM 为一个完整的 UDP 数据报。文件名以 .gz 结尾时使用 gzip 压缩。
+MAGIC = b'FSCAP'
+VERSION = 1
+SOURCE, OPEN, DATA, CLOSE, DATAGRAM = range(5)
+KIND_NAMES = {SOURCE: "source", OPEN: "open", DATA: "data", CLOSE: "close", DATAGRAM: "datagram"}
+MAX_CAPTURE_BYTES = 1024 ** 3  # 录制文件达到该大小后停止录制
+FLUSH_INTERVAL = 1.0           # 缓冲数据写入磁盘的最长间隔 (秒)
+
+_HEADER = struct.Struct('<5sBI')
+_RECORD = struct.Struct('<BHQI')
+
+logger = log.get_logger("capture")
+
+
+def _open_file(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode)
+
+
+class CaptureWriter:
+    """录制接收线程收到的原始字节及到达时间，多个接收线程可共用 (内部加锁)"""
+
+    def __init__(self, path, max_bytes=MAX_CAPTURE_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = _open_file(path, "wb")
+        self._lock = threading.Lock()
+        self._sources = {}
+        self._start = time.monotonic()
+        self._last_flush = self._start
+        self.bytes_written = 0
+        self.stopped = False
+        header = json.dumps({'started': time.time(), 'version': VERSION}).encode("utf-8")
+        self._write(_HEADER.pack(MAGIC, VERSION, len(header)) + header)
+        logger.info("开始录制原始数据到 %s", path)
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _record(self, kind, source, payload=b''):
+        with self._lock:
+            if self.stopped:
+                return
+            if self.bytes_written + len(payload) > self.max_bytes:
+                self.stopped = True
+                self._file.flush()
+                logger.warning("录制文件已达到 %d 字节上限，停止录制", self.max_bytes)
+                return
+            source_id = self._sources.get(source)
+            if source_id is None:
+                source_id = len(self._sources)
+                self._sources[source] = source_id
+                address = source.encode("utf-8")
+                self._write(_RECORD.pack(SOURCE, source_id, 0, len(address)) + address)
+            now = time.monotonic()
+            offset = int((now - self._start) * 1e6)
+            self._write(_RECORD.pack(kind, source_id, offset, len(payload)))
+            if payload:
+                self._write(payload)
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def open(self, source):
+        self._record(OPEN, source)
+
+    def data(self, source, chunk):
+        self._record(DATA, source, chunk)
+
+    def close(self, source):
+        self._record(CLOSE, source)
+
+    def datagram(self, source, data):
+        self._record(DATAGRAM, source, data)
+
+    def finish(self):
+        with self._lock:
+            self.stopped = True
+            self._file.close()
+
+
+def read_capture(path):
+    """
+    读取录制文件，返回 (文件头, 记录迭代器)。
+    每条记录为 (类型, 来源地址, 距录制开始的秒数, 负载)，不返回 SOURCE 记录。
+    文件末尾不完整的记录 (录制进程被强制结束) 会被忽略。
+    """
+    f = _open_file(path, "rb")
+    prefix = f.read(_HEADER.size)
+    if len(prefix) < _HEADER.size:
+        f.close()
+        raise ValueError(f"{path} 不是有效的录制文件")
+    magic, version, header_len = _HEADER.unpack(prefix)
+    if magic != MAGIC or version != VERSION:
+        f.close()
+        raise ValueError(f"{path} 不是有效的录制文件 (标识 {magic!r}, 版本 {version})")
+    header = json.loads(f.read(header_len).decode("utf-8"))
+
+    def records():
+        sources = {}
+        try:
+            while True:
+                raw = f.read(_RECORD.size)
+                if len(raw) < _RECORD.size:
+                    return
+                kind, source_id, offset, length = _RECORD.unpack(raw)
+                payload = f.read(length) if length else b''
+                if len(payload) < length:
+                    return
+                if kind == SOURCE:
+                    sources[source_id] = payload.decode("utf-8")
+                    continue
+                yield kind, sources.get(source_id, str(source_id)), offset / 1e6, payload
+        except EOFError:
+            return  # gzip 文件被截断
+        finally:
+            f.close()
+
+    return header, records()
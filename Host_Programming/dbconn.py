@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+
+DB_PATH = "db/sqlite.db"
+CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数 (sqlite3 默认 128)
+
+# 写入端: 入库线程、保留清理、批量导入等
+# WAL 模式下 synchronous=NORMAL 只在检查点时同步，断电最多丢失最近提交的事务，不会损坏数据库
+WRITER_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -32768,       # 负数表示 KiB，即 32 MiB 页缓存
+    "mmap_size": 268435456,     # 256 MiB 内存映射读取
+    "temp_store": "MEMORY",
+    "busy_timeout": 10000,      # 毫秒
+}
+
+# 读取端: 界面刷新、历史查询、导出。query_only 防止误写，忙等待时间较短以免阻塞界面
+READER_PRAGMAS = {
+    "cache_size": -16384,       # 16 MiB
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    "query_only": "ON",
+}
+
+_local = threading.local()
+
+
+def _connect(db_path, pragmas):
+    conn = sqlite3.connect(db_path, timeout=pragmas["busy_timeout"] / 1000,
+                           cached_statements=CACHED_STATEMENTS)
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def connect_writer(db_path=DB_PATH):
+    """
+    打开写入连接。journal_mode=WAL 是持久化在数据库文件中的设置，
+    只需在 router.connect_to_db 初始化时设置一次，这里不再重复设置。
+    """
+    return _connect(db_path, WRITER_PRAGMAS)
+
+
+def connect_reader(db_path=DB_PATH):
+    """打开只读配置的连接，调用方负责关闭"""
+    return _connect(db_path, READER_PRAGMAS)
+
+
+def reader(db_path=DB_PATH):
+    """
+    返回当前线程的长连接读取端 (首次调用时创建)。
+    连接在多次查询间复用，预编译语句缓存因此生效；不要关闭返回的连接，需要释放时调用 close_readers()。
+    """
+    readers = getattr(_local, "readers", None)
+    if readers is None:
+        readers = _local.readers = {}
+    conn = readers.get(db_path)
+    if conn is None:
+        conn = readers[db_path] = connect_reader(db_path)
+    return conn
+
+
+def close_readers():
+    """关闭当前线程的所有长连接读取端"""
+    readers = getattr(_local, "readers", None) or {}
+    for conn in readers.values():
+        conn.close()
+    readers.clear()
@@ -0,0 +1,57 @@
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QWidget, QHBoxLayout
+from qfluentwidgets import BodyLabel, ComboBox
+
+
+class DeviceSelector(QWidget):
+    """设备选择下拉框 (主页、图表与历史页面共用)，只有一个设备时自动隐藏"""
+    deviceChanged = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.devices = []
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(8)
+        layout.addWidget(BodyLabel("设备", self))
+        self.combo = ComboBox(self)
+        self.combo.setMinimumWidth(180)
+        self.combo.currentIndexChanged.connect(self._on_index_changed)
+        layout.addWidget(self.combo)
+        layout.addStretch()
+        self.setVisible(False)
+
+    def set_devices(self, devices):
+        """devices: [(id, name, address)]，保持当前选择不变"""
+        devices = list(devices)
+        if devices == self.devices:
+            return
+        current = self.current_device()
+        self.devices = devices
+        self.combo.blockSignals(True)
+        self.combo.clear()
+        self.combo.addItems([name if not address or name == address else f"{name} ({address})"
+                             for _, name, address in devices])
+        self.combo.blockSignals(False)
+        if current is not None:
+            self.set_current_device(current)
+        self.setVisible(len(devices) > 1)
+
+    def current_device(self):
+        index = self.combo.currentIndex()
+        if 0 <= index < len(self.devices):
+            return self.devices[index][0]
+        return None
+
+    def set_current_device(self, device_id):
+        """切换显示的设备 (不发出 deviceChanged 信号)"""
+        for index, (item_id, _, _) in enumerate(self.devices):
+            if item_id == device_id:
+                self.combo.blockSignals(True)
+                self.combo.setCurrentIndex(index)
+                self.combo.blockSignals(False)
+                return
+
+    def _on_index_changed(self, index):
+        if 0 <= index < len(self.devices):
+            self.deviceChanged.emit(self.devices[index][0])
@@ -0,0 +1,33 @@
+import sqlite3
+
+DEFAULT_DEVICE_ID = 1  # 多设备支持之前的数据以及未指定设备的样本都归属该设备
+DEFAULT_DEVICE_NAME = "默认设备"
+
+
+def create_devices_table(conn):
+    conn.execute("""
+                 CREATE TABLE IF NOT EXISTS devices
+                 (
+                     id INTEGER PRIMARY KEY,
+                     name TEXT NOT NULL,
+                     address TEXT NOT NULL UNIQUE,
+                     created DATETIME NOT NULL DEFAULT (datetime('now', 'localtime'))
+                 )
+                 """)
+
+
+def register_device(conn, address, name=None):
+    """按地址 ('IP:端口') 查找设备，不存在时创建，返回设备id (调用方负责提交事务)"""
+    row = conn.execute("SELECT id FROM devices WHERE address = ?", (address,)).fetchone()
+    if row:
+        return row[0]
+    cursor = conn.execute("INSERT INTO devices (name, address) VALUES (?, ?)", (name or address, address))
+    return cursor.lastrowid
+
+
+def list_devices(conn):
+    """返回 [(id, name, address)]，按id排序；旧数据库没有设备表时返回默认设备"""
+    try:
+        return conn.execute("SELECT id, name, address FROM devices ORDER BY id").fetchall()
+    except sqlite3.OperationalError:
+        return [(DEFAULT_DEVICE_ID, DEFAULT_DEVICE_NAME, "")]
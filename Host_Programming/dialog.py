@@ -9,7 +9,7 @@ from qfluentwidgets import (HeaderCardWidget, BodyLabel, PrimaryPushButton, Radi
                             SpinBox, DoubleSpinBox, MessageBoxBase, ComboBox,
                             SwitchButton, StrongBodyLabel, SubtitleLabel, CaptionLabel)
 
-from alarm import (AlarmRule, AlarmManager, save_rules_to_json,
+from alarm import (AlarmRule, AlarmManager, DeviceAlarms, save_rules_to_json,
                    load_rules_from_json, get_project_root)
 
 
@@ -430,6 +430,7 @@ class AlarmWidget(QWidget):
         self.setObjectName("alarmWidget")
         self.alarm_rules = []
         self.alarm_manager = AlarmManager()
+        self.device_alarms = DeviceAlarms(self.alarm_manager)  # 各设备独立的规则副本与触发状态
         self.setup_ui()
 
         # 加载保存的规则
@@ -510,6 +511,7 @@ class AlarmWidget(QWidget):
         rule_item.deleteClicked.connect(self.remove_rule)
         rule_item.switchChanged.connect(self.toggle_rule_active)
         self.rules_layout.addWidget(rule_item)
+        self.device_alarms.set_rules(self.alarm_rules)
 
         if len(self.alarm_rules) == 1:
             self.empty_hint.hide()
@@ -536,10 +538,9 @@ class AlarmWidget(QWidget):
         for rule in self.alarm_rules:
             if rule.id == rule_id:
                 rule.is_active = is_active
-                # 如果规则正在触发警报且被禁用，停止警报
-                if not is_active and rule.is_triggered:
-                    self.alarm_manager.recover_alarm(rule)
                 break
+        # 规则被禁用时停止它在各设备上的警报
+        self.device_alarms.set_rules(self.alarm_rules)
 
         # 保存规则到文件
         save_rules_to_json(self.alarm_rules)
@@ -558,11 +559,10 @@ class AlarmWidget(QWidget):
 
         if to_remove_index >= 0:
             # 从规则列表中移除规则
-            removed_rule = self.alarm_rules.pop(to_remove_index)
+            self.alarm_rules.pop(to_remove_index)
 
-            # 如果规则正在触发警报，停止警报
-            if removed_rule.is_triggered:
-                self.alarm_manager.recover_alarm(removed_rule)
+            # 停止该规则在各设备上正在触发的警报
+            self.device_alarms.set_rules(self.alarm_rules)
 
             # 找到并删除对应的UI项
             for i in range(self.rules_layout.count()):
@@ -608,19 +608,11 @@ class AlarmWidget(QWidget):
                 parent=self.window()
             )
 
-    def check_all_rules(self, data):
-        """检查所有规则是否触发"""
+    def check_all_rules(self, data, device_id, device_name=None):
+        """用一台设备的数据检查所有规则是否触发，返回状态变化的规则副本"""
         if not data:
-            return
-
-        # 检查每个规则是否触发
-        for rule in self.alarm_rules:
-            if not rule.is_active:
-                continue
-
-            sensor_value = data.get(rule.sensor_type)
-            if sensor_value is not None:
-                self.alarm_manager.check_rule(rule, sensor_value)
+            return []
+        return self.device_alarms.check(device_id, data, device_name)
 
     def stop_all_alarms(self):
         """停止所有活动的警报"""
@@ -0,0 +1,178 @@
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import dbconn
+import query
+import rollup
+
+DB_PATH = "db/sqlite.db"
+BATCH_ROWS = 65536  # 汇总数据每批读取的行数
+FORMATS = ("parquet", "arrow")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError("批量导出需要安装 pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def raw_schema(pa):
+    return pa.schema([
+        ("time", pa.timestamp("s")),
+        ("temperature", pa.float64()),
+        ("humidity", pa.float64()),
+        ("pm25", pa.int32()),
+        ("noise", pa.int32()),
+        ("id", pa.int64()),
+        ("device_id", pa.int32()),
+    ])
+
+
+def rollup_schema(pa):
+    fields = [("device_id", pa.int32()), ("time", pa.timestamp("s")), ("count", pa.int64()),
+              ("last_time", pa.timestamp("s"))]
+    for c in rollup.CHANNELS:
+        fields += [(f"{c}_{stat}", pa.float64()) for stat in ("min", "max", "mean", "last")]
+    return pa.schema(fields)
+
+
+def _parse_times(values):
+    # 'YYYY-MM-DD HH:MM:SS' 为本地时间，按无时区时间戳导出
+    return np.array(values, dtype="datetime64[s]")
+
+
+def _day_windows(start_str, end_str):
+    """将时间范围拆分为按天的窗口，原始数据逐天读取以控制内存占用"""
+    day = datetime.strptime(start_str[:10], "%Y-%m-%d")
+    windows = []
+    while day.strftime("%Y-%m-%d") <= end_str[:10]:
+        day_str = day.strftime("%Y-%m-%d")
+        windows.append((max(start_str, f"{day_str} 00:00:00"), min(end_str, f"{day_str} 23:59:59")))
+        day += timedelta(days=1)
+    return windows
+
+
+def iter_record_batches(conn, start_str, end_str, resolution="raw", progress=None, device_id=None):
+    """按批生成 pyarrow.RecordBatch；progress(已完成, 总数) 用于报告进度，device_id 为 None 时导出所有设备"""
+    pa = _require_pyarrow()
+    if resolution == "raw":
+        schema = raw_schema(pa)
+        windows = _day_windows(start_str, end_str)
+        for i, (window_start, window_end) in enumerate(windows):
+            rows = query.fetch_raw(conn, window_start, window_end, device_id=device_id)
+            if rows:
+                columns = list(zip(*rows))
+                yield pa.RecordBatch.from_arrays([
+                    pa.array(_parse_times(columns[0])),
+                    pa.array(columns[1], type=pa.float64()),
+                    pa.array(columns[2], type=pa.float64()),
+                    pa.array(columns[3], type=pa.int32()),
+                    pa.array(columns[4], type=pa.int32()),
+                    pa.array(columns[5], type=pa.int64()),
+                    pa.array(columns[6], type=pa.int32()),
+                ], schema=schema)
+            if progress:
+                progress(i + 1, len(windows))
+        return
+
+    table = rollup.ROLLUP_TABLES.get(resolution)
+    if table is None:
+        raise ValueError(f"未知的数据分辨率: {resolution}")
+    schema = rollup_schema(pa)
+    stat_columns = [f"{c}_{stat}" for c in rollup.CHANNELS for stat in ("min", "max", "mean", "last")]
+    where = "bucket BETWEEN ? AND ?"
+    params = (rollup.bucket_of(start_str, resolution), end_str)
+    if device_id is not None:
+        where = "device_id = ? AND " + where
+        params = (device_id,) + params
+    cursor = conn.execute(
+        f"SELECT device_id, bucket, count, last_timestamp, {', '.join(stat_columns)} FROM {table} "
+        f"WHERE {where} ORDER BY bucket, device_id", params
+    )
+    total = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+    done = 0
+    while True:
+        rows = cursor.fetchmany(BATCH_ROWS)
+        if not rows:
+            break
+        columns = list(zip(*rows))
+        arrays = [pa.array(columns[0], type=pa.int32()),
+                  pa.array(_parse_times(columns[1])),
+                  pa.array(columns[2], type=pa.int64()),
+                  pa.array(_parse_times(columns[3]))]
+        arrays += [pa.array(values, type=pa.float64()) for values in columns[4:]]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+        done += len(rows)
+        if progress:
+            progress(done, total)
+
+
+def export_range(out_path, start_str, end_str, fmt="parquet", resolution="raw", db_path=DB_PATH, progress=None,
+                 device_id=None):
+    """将时间范围内的数据流式写入 Parquet 或 Arrow IPC 文件，返回导出的行数"""
+    pa = _require_pyarrow()
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    schema = raw_schema(pa) if resolution == "raw" else rollup_schema(pa)
+    conn = dbconn.connect_reader(db_path)
+    rows = 0
+    try:
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(out_path, schema, compression="zstd")
+        else:
+            import pyarrow.ipc as ipc
+            writer = ipc.new_file(out_path, schema)
+        try:
+            for batch in iter_record_batches(conn, start_str, end_str, resolution, progress, device_id):
+                if fmt == "parquet":
+                    writer.write_batch(batch)
+                else:
+                    writer.write(batch)
+                rows += batch.num_rows
+        finally:
+            writer.close()
+    finally:
+        conn.close()
+    return rows
+
+
+def _normalize_time(value, end=False):
+    """接受 'YYYY-MM-DD' 或 'YYYY-MM-DD HH:MM:SS'"""
+    if len(value) == 10:
+        return f"{value} {'23:59:59' if end else '00:00:00'}"
+    datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 批量数据导出 (Parquet / Arrow IPC)")
+    parser.add_argument("--start", required=True, help="起始时间, 如 2025-05-01 或 '2025-05-01 08:00:00'")
+    parser.add_argument("--end", required=True, help="结束时间 (日期表示当天结束)")
+    parser.add_argument("--format", choices=FORMATS, default="parquet", help="导出格式")
+    parser.add_argument("--resolution", choices=query.RESOLUTIONS, default="raw", help="数据分辨率")
+    parser.add_argument("--out", required=True, help="输出文件路径")
+    parser.add_argument("--db", default=DB_PATH, help="主数据库文件路径")
+    parser.add_argument("--device-id", type=int, default=None, help="只导出指定设备的数据 (默认导出所有设备)")
+    args = parser.parse_args(argv)
+    start = time.monotonic()
+    try:
+        rows = export_range(args.out, _normalize_time(args.start), _normalize_time(args.end, end=True),
+                            args.format, args.resolution, args.db, device_id=args.device_id)
+    except (RuntimeError, ValueError, OSError, sqlite3.Error) as e:
+        print(f"导出失败: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.monotonic() - start
+    print(f"导出完成: {rows} 行 -> {args.out}, 耗时 {elapsed:.1f} 秒 ({rows / max(elapsed, 1e-6):.0f} 行/秒)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import log
+import metrics
+
+# 以 Prometheus 文本格式 (0.0.4) 导出本进程的计数器、瞬时值与直方图，供现有监控系统抓取 (GET /metrics)。
+# 采集进程 (router.py / service.py) 与界面进程各自维护一份指标，分别在不同的本机端口上导出。
+# 计数器名加 _total 后缀；延迟直方图换算为秒并加 _seconds 后缀，数量类直方图 (如批量大小) 保持原值。
+PREFIX = "fluentsensor_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BIND_IP = "127.0.0.1"        # 只在本机监听，需要远程抓取时改为 0.0.0.0
+ROUTER_PORT = 9108           # 采集进程的导出端口，None 表示不导出
+GUI_PORT = 9109              # 界面进程的导出端口，None 表示不导出
+
+# 指标说明 (# HELP)，未列出的指标只输出类型
+HELP = {
+    'frames_received': "收到的帧数 (TCP、UDP 与回放)",
+    'frames_decoded': "解析成功的帧数",
+    'frames_invalid': "解析失败被丢弃的帧数",
+    'samples_decoded': "解析出的样本数",
+    'samples_written': "写入数据库的样本数",
+    'samples_write_failed': "写入数据库失败 (重试后仍失败) 而丢弃的样本数",
+    'ingest_write_retries': "入库事务因数据库忙或被锁定而重试的次数",
+    'tcp_reconnects': "与下位机的 TCP 连接断开后重新连接成功的次数",
+    'ingest_batch_size': "入库线程每个事务写入的样本数",
+    'ingest_commit': "入库事务 (写入与提交) 耗时",
+    'ingest_backlog': "入库队列中等待写入的样本数",
+    'ingest_last_commit_time': "最近一次入库提交的 Unix 时间 (秒)，长时间不变说明采集停滞",
+    'fetch_recent_data': "界面读取近期数据的查询耗时",
+    'alarm_triggers': "警报触发次数",
+    'alarm_recoveries': "警报恢复次数",
+    'email_send': "发送警报与恢复邮件的耗时",
+    'email_failures': "发送邮件失败的次数",
+    'log_records_dropped': "日志队列已满而丢弃的记录数",
+    'log_records_suppressed': "因重复过多而省略的日志记录数",
+}
+
+_started = time.time()
+
+logger = log.get_logger("exporter")
+
+
+def _name(name):
+    return PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(lines, name, metric, kind):
+    if name in HELP:
+        lines.append(f"# HELP {metric} {HELP[name]}")
+    lines.append(f"# TYPE {metric} {kind}")
+
+
+def render():
+    """返回本进程全部指标的 Prometheus 文本格式"""
+    lines = []
+    for name, value in sorted(metrics.counters().items()):
+        metric = _name(name) + "_total"
+        _header(lines, name, metric, "counter")
+        lines.append(f"{metric} {_value(value)}")
+    for name, value in sorted(metrics.gauges().items()):
+        if not isinstance(value, (int, float)) and value is not None:
+            continue
+        metric = _name(name)
+        _header(lines, name, metric, "gauge")
+        lines.append(f"{metric} {_value(value)}")
+    for name, hist in sorted(metrics.histograms().items()):
+        buckets, count, total = hist.cumulative()
+        scale = 1000.0 if hist.is_latency else 1
+        metric = _name(name) + ("_seconds" if hist.is_latency else "")
+        _header(lines, name, metric, "histogram")
+        for bound, seen in buckets:
+            lines.append(f'{metric}_bucket{{le="{bound / scale:g}"}} {seen}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{metric}_sum {_value(total / scale)}")
+        lines.append(f"{metric}_count {count}")
+    metric = _name("process_start_time_seconds")
+    lines.append(f"# TYPE {metric} gauge")
+    lines.append(f"{metric} {_started:.3f}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取很频繁，不逐条打印
+
+
+def start(port, bind_ip=BIND_IP):
+    """在后台线程中导出指标 (http://bind_ip:port/metrics)，端口被占用时只记录警告，返回服务器对象或 None"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((bind_ip, port), MetricsHandler)
+    except OSError as e:
+        logger.warning("无法在 %s:%s 导出监控指标: %s", bind_ip, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsExporter", daemon=True).start()
+    logger.info("监控指标已导出: http://%s:%s/metrics", bind_ip, port)
+    return server
@@ -1,94 +1,230 @@
+import time
+_IMPORT_START = time.perf_counter()  # 启动耗时的起点，在导入其余模块之前记录
+
 import multiprocessing
-import sqlite3
 import sys
-import time
 from datetime import datetime, timedelta
 
 from PyQt5.QtCore import QTimer, Qt, QCoreApplication
 from PyQt5.QtWidgets import QApplication
 from qfluentwidgets import FluentWindow, Theme, setTheme, isDarkTheme, FluentIcon, NavigationItemPosition
 
-import router as router_module
+import alarm
+import dbconn
+import devices
+import ingest_lock
+import log
+import metrics
+import playback
+import query
 from dialog import AlarmWidget
-from history import HistoryWidget
 from home import HomeWidget
-from plot import PlotsWidget
+from lazy_page import LazyPage
 from setting import TimeRangeSettings, StyleSheet
 
+# 启动时只导入主页与警报页 (警报规则在后台持续检查) 需要的模块；图表页 (pyqtgraph、NumPy)、历史页与设置页
+# 在第一次打开时创建，采集进程 (router、service) 与指标导出 (exporter) 在窗口显示之后才导入与启动。
 DB_PATH = "db/sqlite.db"
+DEVICE_REFRESH_INTERVAL = 30  # 重新读取设备列表的间隔 (秒)，采集进程可能在运行中登记新设备
+ALARM_FRESHNESS_SECONDS = 3   # 最新数据距今不超过该时长才检查警报 (回放时按倍速放大)
+ROUTER_CHECK_DELAY = 200      # 启动采集进程后隔多久检查它是否仍在运行 (毫秒)，不阻塞界面
+INGEST_CHECK_INTERVAL = 10    # 重新检查采集进程 (自己启动的、后台服务或单独运行的 router.py) 的间隔 (秒)
+WINDOW_TITLE = "Fluent Sensor"
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 
 class MainWindow(FluentWindow):
-    def __init__(self):
+    def __init__(self, start_router: bool = True):
+        self.init_start = time.perf_counter()
+        self.first_paint_time = None
         super().__init__()
         StyleSheet.MAIN_WINDOW.apply(self)
-        self.setWindowTitle("Fluent Sensor")
+        self.setWindowTitle(WINDOW_TITLE)
         self.resize(960, 600)
         self.setMinimumSize(800, 500)
 
         # 初始化成员变量
         self.time_range_minutes = 5
         self.dark_mode = isDarkTheme()
+        self.current_device_id = devices.DEFAULT_DEVICE_ID
         self.data_cache = {'times': [], 'temp': [], 'humidity': [], 'pm25': [], 'noise': []}
         self.last_known_data = None
-
-        # 初始化各个子界面
+        self.alarm_checked = {}  # {设备id: 最近检查过警报的记录id}，同一条记录不重复检查
+        self.latency_queue = multiprocessing.Queue(maxsize=10000)  # 接收采集进程发来的样本阶段时间戳
+        self.latency_tracker = metrics.LatencyTracker()
+        self.refresh_seconds = 2
+        self.replay_clock = None  # 历史回放时的虚拟时钟 (playback.ReplayClock)，None 表示实时模式
+        self.replay_alarms = None  # 回放时检查历史数据的独立规则副本 (不播放音频、不发邮件)
+        self.replay_alarm_checked = {}
+        self.device_list = []
+
+        # 初始化各个子界面: 主页与警报页立即创建，其余页面第一次打开时创建 (创建前对应属性为 None)
         self.homeWidget = HomeWidget(self)
-        self.plotsWidget = PlotsWidget(self)
-        self.historyWidget = HistoryWidget(self)
         self.alarmWidget = AlarmWidget(self)
-        self.settingsWidget = TimeRangeSettings(self)
+        self.plotsWidget = None
+        self.historyWidget = None
+        self.settingsWidget = None
+        self.plotsPage = LazyPage("plotsPage", self._create_plots, self)
+        self.historyPage = LazyPage("historyPage", self._create_history, self)
+        self.settingsPage = LazyPage("settingsPage", self._create_settings, self)
 
         # 初始化导航栏
         self.init_navigation()
 
         # 连接信号与槽
-        self.settingsWidget.timeRangeChanged.connect(self.on_time_range_changed)
-        self.settingsWidget.refreshRateChanged.connect(self.set_refresh_rate)
-        self.settingsWidget.themeChanged.connect(self.on_theme_changed)
+        self.plotsPage.created.connect(self.on_plots_created)
+        self.historyPage.created.connect(self.on_history_created)
+        self.settingsPage.created.connect(self.on_settings_created)
+        self.device_selectors = []
+        self.add_device_selector(self.homeWidget.device_selector)
+        self.refresh_devices()
+        self.device_timer = QTimer(self)
+        self.device_timer.timeout.connect(self.refresh_devices)
+        self.device_timer.start(DEVICE_REFRESH_INTERVAL * 1000)
 
         # 初始化定时器用于数据刷新
         self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_all_data)
+        self.timer.timeout.connect(self.on_refresh_timer)
         self.set_refresh_rate(2)
 
-        # --- 启动 ROUTER 进程 ---
+        # --- 启动 ROUTER 进程 (窗口显示之后) ---
         self.router_process = None
-        self.start_router_service()
+        self.ingest_owner = None  # 其他采集进程 (后台服务或单独运行的 router.py) 的说明，界面未自行采集时设置
+        if start_router:
+            QTimer.singleShot(0, self.start_router_service)
+            # 后台服务可能在界面运行期间启动或退出，定期检查，始终只有一个采集进程且总有一个在运行
+            self.ingest_timer = QTimer(self)
+            self.ingest_timer.timeout.connect(self.check_ingest)
+            self.ingest_timer.start(INGEST_CHECK_INTERVAL * 1000)
         # --- 结束 ROUTER 进程 ---
 
         # 延迟100ms后首次更新数据，确保UI加载完成
         QTimer.singleShot(100, self.update_all_data)
+        self.init_done = time.perf_counter()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.first_paint_time is None:
+            self.first_paint_time = time.perf_counter()
+            QTimer.singleShot(0, self.report_startup)
+
+    def report_startup(self):
+        """记录启动各阶段的耗时 (毫秒)，写入日志并作为瞬时值导出，便于跟踪启动速度的变化"""
+        import_ms = IMPORT_SECONDS * 1000.0
+        window_ms = (self.init_done - self.init_start) * 1000.0
+        paint_ms = (self.first_paint_time - _IMPORT_START) * 1000.0
+        metrics.set_gauge("startup_import_ms", import_ms)
+        metrics.set_gauge("startup_window_ms", window_ms)
+        metrics.set_gauge("startup_first_paint_ms", paint_ms)
+        log.get_logger("fluent").info("启动耗时: 导入模块 %.0f ms, 创建窗口 %.0f ms, 首次绘制 %.0f ms (自导入开始)",
+                                      import_ms, window_ms, paint_ms)
+
+    def _create_plots(self):
+        from plot import PlotsWidget  # 导入 pyqtgraph 与 NumPy
+        return PlotsWidget(self.plotsPage)
+
+    def _create_history(self):
+        from history import HistoryWidget
+        return HistoryWidget(self.historyPage)
+
+    def _create_settings(self):
+        return TimeRangeSettings(self.settingsPage)
+
+    def on_plots_created(self, widget):
+        self.plotsWidget = widget
+        self.add_device_selector(widget.device_selector)
+        if self.dark_mode:
+            widget.update_theme(self.dark_mode)
+        if self.data_cache['times']:
+            widget.update_data(times=self.data_cache['times'], temp_history=self.data_cache['temp'],
+                               humidity_history=self.data_cache['humidity'], pm25_history=self.data_cache['pm25'],
+                               noise_history=self.data_cache['noise'])
+
+    def on_history_created(self, widget):
+        self.historyWidget = widget
+        widget.replayRequested.connect(self.on_replay_requested)
+        widget.replayStopRequested.connect(self.stop_replay)
+        self.add_device_selector(widget.device_selector)
+        if self.dark_mode:
+            widget.update_theme(self.dark_mode)
+        if self.replay_clock is not None:
+            widget.set_replay_active(True)
+
+    def on_settings_created(self, widget):
+        self.settingsWidget = widget
+        widget.timeRangeChanged.connect(self.on_time_range_changed)
+        widget.refreshRateChanged.connect(self.set_refresh_rate)
+        widget.themeChanged.connect(self.on_theme_changed)
+
+    def add_device_selector(self, selector):
+        """登记一个页面的设备选择框并同步当前的设备列表"""
+        self.device_selectors.append(selector)
+        selector.deviceChanged.connect(self.set_current_device)
+        if self.device_list:
+            selector.set_devices(self.device_list)
+            selector.set_current_device(self.current_device_id)
 
     def start_router_service(self):
-        """在单独的进程中启动 router.py 脚本。"""
+        """
+        在单独的进程中启动 router.py 脚本；后台服务 (service.py) 或其他采集进程已在运行时只作为查看端连接。
+        不等待采集进程初始化，ROUTER_CHECK_DELAY 毫秒后再检查它是否仍在运行。
+        """
+        import router as router_module
+        import service
+        running = service.read_service()
+        # 后台服务运行时邮件通知由服务负责，界面只读取数据库、显示并播放声音警报
+        self.alarmWidget.alarm_manager.email_enabled = running is None
+        owner = None
+        if running is not None:
+            owner = f"后台服务 (PID: {running['pid']}, {running['mode']})"
+        else:
+            info = ingest_lock.holder()
+            if info is not None:
+                owner = f"采集进程 (PID: {info['pid']}, {info['role']})"
+        if owner is not None:
+            if owner != self.ingest_owner:  # 定期检查时只在变化后提示
+                print(f"INFO: Fluent - 检测到已在运行的{owner}，不再启动数据服务。")
+            self.ingest_owner = owner
+            return
+        self.ingest_owner = None
         print("INFO: Fluent - 尝试启动数据服务...")
         try:
             self.router_process = multiprocessing.Process(
                 target=router_module.run_tcp_client,  # 直接调用 router 模块的函数
-                args=(router_module.ESP_TARGET_IP, router_module.ESP_TARGET_PORT),
+                args=(router_module.ESP_TARGET_IP, router_module.ESP_TARGET_PORT, self.latency_queue),
                 daemon=True  # 设置为守护进程，如果 fluent.py 崩溃，它可能会退出
             )
             self.router_process.start()
-            time.sleep(0.2)  # 给它一点时间初始化或失败
-            if self.router_process.is_alive():
-                print(f"INFO: Fluent - 数据服务已成功启动 (PID: {self.router_process.pid}).")
-            else:
-                print("ERROR: Fluent - 数据服务启动失败或过早退出。", file=sys.stderr)
-                self.router_process = None  # 如果失败，确保它是 None
+            QTimer.singleShot(ROUTER_CHECK_DELAY, self.check_router_service)
         except Exception as e:
             print(f"ERROR: Fluent - 启动数据服务时发生异常: {e}", file=sys.stderr)
             self.router_process = None
 
+    def check_router_service(self):
+        if self.router_process is None:
+            return
+        if self.router_process.is_alive():
+            print(f"INFO: Fluent - 数据服务已成功启动 (PID: {self.router_process.pid}).")
+        else:
+            print("ERROR: Fluent - 数据服务启动失败或过早退出。", file=sys.stderr)
+            self.router_process = None  # 如果失败，确保它是 None
+
+    def check_ingest(self):
+        """自己启动的采集进程不在运行时重新检查: 后台服务或其他采集进程退出后由界面接管采集"""
+        if self.router_process is not None and self.router_process.is_alive():
+            return
+        self.router_process = None
+        self.start_router_service()
+
     def init_navigation(self):
         """
         初始化导航栏，添加各个子界面到导航菜单。
         """
         self.addSubInterface(self.homeWidget, FluentIcon.HOME, "主页")
-        self.addSubInterface(self.plotsWidget, FluentIcon.IOT, "数据图表")
-        self.addSubInterface(self.historyWidget, FluentIcon.HISTORY, "历史记录")
+        self.addSubInterface(self.plotsPage, FluentIcon.IOT, "数据图表")
+        self.addSubInterface(self.historyPage, FluentIcon.HISTORY, "历史记录")
         self.addSubInterface(self.alarmWidget, FluentIcon.RINGER, "警报规则")
-        self.addSubInterface(self.settingsWidget, FluentIcon.SETTING, "设置", NavigationItemPosition.BOTTOM)
+        self.addSubInterface(self.settingsPage, FluentIcon.SETTING, "设置", NavigationItemPosition.BOTTOM)
 
     def on_time_range_changed(self, minutes: int):
         """
@@ -101,8 +237,19 @@ class MainWindow(FluentWindow):
         """
         设置数据刷新频率。
         """
-        seconds = max(1, seconds)
-        self.timer.start(seconds * 1000)
+        self.refresh_seconds = max(1, seconds)
+        self.timer.start(self.refresh_seconds * 1000)
+
+    def on_refresh_timer(self):
+        """实时刷新: 回放期间界面由虚拟时钟驱动，这里只继续按实时数据检查警报"""
+        if self.replay_clock is None:
+            self.update_all_data()
+            return
+        try:
+            self.check_live_alarms()
+        except Exception as e:
+            print(f"检查警报规则时发生错误: {e}", file=sys.stderr)
+            self.alarmWidget.stop_all_alarms()
 
     def on_theme_changed(self, dark_mode: bool):
         """
@@ -110,30 +257,118 @@ class MainWindow(FluentWindow):
         """
         self.dark_mode = dark_mode
         setTheme(Theme.DARK if dark_mode else Theme.LIGHT)
-        self.plotsWidget.update_theme(dark_mode)
-        self.historyWidget.update_theme(dark_mode)
+        if self.plotsWidget is not None:
+            self.plotsWidget.update_theme(dark_mode)
+        if self.historyWidget is not None:
+            self.historyWidget.update_theme(dark_mode)
         StyleSheet.MAIN_WINDOW.apply(self)
 
+    def now(self) -> datetime:
+        """界面的"当前时间": 实时模式为系统时间，回放时为虚拟时钟的时间"""
+        if self.replay_clock is not None:
+            return self.replay_clock.now()
+        return datetime.now()
+
+    def start_replay(self, start: datetime, end: datetime, speed: int = 1,
+                     frame_interval_ms: int = playback.FRAME_INTERVAL_MS):
+        """
+        以 speed 倍速回放 [start, end] 内的历史数据: 由虚拟时钟驱动 update_all_data，主页与图表按回放时间显示。
+        历史数据用开始回放时的规则副本单独检查，只打印触发与恢复，不播放音频、不发邮件、不计入警报指标；
+        实时数据的警报检查照常进行。
+        """
+        self.stop_replay(refresh=False)
+        self.replay_clock = playback.ReplayClock(start, end, speed, frame_interval_ms, self)
+        self.replay_clock.advanced.connect(self.on_replay_advanced)
+        self.replay_clock.finished.connect(self.on_replay_finished)
+        self.replay_alarms = alarm.DeviceAlarms(
+            alarm.AlarmManager(sound_enabled=False, email_enabled=False, metrics_enabled=False))
+        self.replay_alarms.set_rules(self.alarmWidget.device_alarms.rules)
+        self.replay_alarm_checked = {}
+        self._reset_caches()
+        if self.historyWidget is not None:
+            self.historyWidget.set_replay_active(True)
+        print(f"开始回放 {start} ~ {end} ({self.replay_clock.speed}×)")
+        self.replay_clock.resume()
+        self.switchTo(self.homeWidget)
+
+    def stop_replay(self, refresh: bool = True):
+        """结束回放并恢复实时刷新"""
+        if self.replay_clock is None:
+            return
+        self.replay_clock.pause()
+        self.replay_clock.deleteLater()
+        self.replay_clock = None
+        self.replay_alarms = None
+        self._reset_caches()
+        if self.historyWidget is not None:
+            self.historyWidget.set_replay_active(False)
+        self.setWindowTitle(WINDOW_TITLE)
+        if refresh:
+            self.update_all_data()
+
+    def on_replay_requested(self, start_str: str, end_str: str, speed: int):
+        self.start_replay(datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S"),
+                          datetime.strptime(end_str, "%Y-%m-%d %H:%M:%S"), speed)
+
+    def on_replay_advanced(self):
+        clock = self.replay_clock
+        self.setWindowTitle(f"{WINDOW_TITLE} - 回放 {clock.now().strftime('%Y-%m-%d %H:%M:%S')} "
+                            f"({clock.speed}×, {clock.progress() * 100:.0f}%)")
+        self.update_all_data()
+
+    def on_replay_finished(self):
+        print(f"回放结束，共刷新 {self.replay_clock.frames} 次")
+        self.stop_replay()
+
+    def _reset_caches(self):
+        """切换实时与回放模式时丢弃已缓存的数据，避免两种模式的数据混在一起"""
+        self.data_cache = {'times': [], 'temp': [], 'humidity': [], 'pm25': [], 'noise': []}
+        self.last_known_data = None
+
+    def refresh_devices(self):
+        """
+        重新读取设备列表并同步到各页面的设备选择框。
+        """
+        try:
+            device_list = devices.list_devices(dbconn.reader(DB_PATH))
+        except Exception as e:
+            print(f"读取设备列表时出错: {e}", file=sys.stderr)
+            return
+        self.device_list = device_list
+        if device_list and self.current_device_id not in [row[0] for row in device_list]:
+            self.current_device_id = device_list[0][0]
+        for selector in self.device_selectors:
+            selector.set_devices(device_list)
+            selector.set_current_device(self.current_device_id)
+
+    def set_current_device(self, device_id: int):
+        """
+        切换主页、图表和警报所显示的设备。
+        """
+        if device_id == self.current_device_id:
+            return
+        self.current_device_id = device_id
+        self.data_cache = {'times': [], 'temp': [], 'humidity': [], 'pm25': [], 'noise': []}
+        self.last_known_data = None
+        for selector in self.device_selectors:
+            selector.set_current_device(device_id)
+        self.update_all_data()
+
     def get_last_record_from_db(self) -> dict | None:
         """
-        从数据库获取最新的单条传感器数据记录。
+        从数据库获取当前设备最新的单条传感器数据记录。
         """
         try:
-            conn = sqlite3.connect(DB_PATH, timeout=5)
-            conn.execute("PRAGMA journal_mode=WAL")
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT timestamp, temperature, humidity, pm25, noise FROM sensor_data ORDER BY timestamp DESC LIMIT 1"
-            )
-            result = cursor.fetchone()
-            conn.close()
+            before = self.now().strftime("%Y-%m-%d %H:%M:%S") if self.replay_clock is not None else None
+            result = query.fetch_latest(dbconn.reader(DB_PATH), device_id=self.current_device_id, before=before)
             if result:
                 return {
                     'timestamp': result[0],
                     'temperature': result[1],
                     'humidity': result[2],
                     'pm25': result[3],
-                    'noise': result[4]
+                    'noise': result[4],
+                    'id': result[5]
                 }
             return None
         except Exception as e:
@@ -142,25 +377,20 @@ class MainWindow(FluentWindow):
 
     def fetch_recent_data(self, minutes: int = 5) -> dict | None:
         """
-        从数据库获取指定时间范围内的传感器数据。
+        从数据库获取当前设备指定时间范围内的传感器数据。
+        时间范围较长时自动改为读取汇总表，曲线上的每个点为一个时间桶的均值。
         """
         try:
-            conn = sqlite3.connect(DB_PATH, timeout=5)
-            conn.execute("PRAGMA journal_mode=WAL")
-            cursor = conn.cursor()
-
-            end_time = datetime.now()
+            end_time = self.now()
             start_time = end_time - timedelta(minutes=minutes)
             start_time_str = start_time.strftime("%Y-%m-%d %H:%M:%S")
             end_time_str = end_time.strftime("%Y-%m-%d %H:%M:%S")
 
-            cursor.execute(
-                "SELECT timestamp, temperature, humidity, pm25, noise FROM sensor_data "
-                "WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp ASC",
-                (start_time_str, end_time_str)
-            )
-            results = cursor.fetchall()
-            conn.close()
+            resolution = query.pick_resolution(minutes * 60)
+            query_start = time.perf_counter()
+            results = query.fetch_range(dbconn.reader(DB_PATH), start_time_str, end_time_str, resolution,
+                                        device_id=self.current_device_id)
+            metrics.histogram("fetch_recent_data").observe((time.perf_counter() - query_start) * 1000.0)
 
             self.data_cache = {'times': [], 'temp': [], 'humidity': [], 'pm25': [], 'noise': []}
 
@@ -182,13 +412,19 @@ class MainWindow(FluentWindow):
             if not self.data_cache['times']:
                 return None
 
+            if resolution != "raw":
+                # 汇总数据只有时间桶均值，主页显示的最新值仍取最后一条原始记录
+                self.last_known_data = self.get_last_record_from_db()
+                return self.last_known_data
+
             original_last_record = results[-1]
             self.last_known_data = {
                 'timestamp': original_last_record[0],
                 'temperature': original_last_record[1],
                 'humidity': original_last_record[2],
                 'pm25': original_last_record[3],
-                'noise': original_last_record[4]
+                'noise': original_last_record[4],
+                'id': original_last_record[5]
             }
             return self.last_known_data
 
@@ -200,7 +436,9 @@ class MainWindow(FluentWindow):
         """
         核心数据更新函数，由定时器周期性调用。
         """
+        self.latency_tracker.drain(self.latency_queue)
         latest_data_in_range = self.fetch_recent_data(self.time_range_minutes)
+        fetch_t = time.monotonic()
 
         if not latest_data_in_range and self.last_known_data:
             current_data_to_display = self.last_known_data
@@ -218,7 +456,7 @@ class MainWindow(FluentWindow):
                 timestamp=current_data_to_display['timestamp']
             )
 
-            if self.data_cache['times']:
+            if self.data_cache['times'] and self.plotsWidget is not None:
                 self.plotsWidget.update_data(
                     times=self.data_cache['times'],
                     temp_history=self.data_cache['temp'],
@@ -226,32 +464,67 @@ class MainWindow(FluentWindow):
                     pm25_history=self.data_cache['pm25'],
                     noise_history=self.data_cache['noise']
                 )
-
-            try:
-                current_time = datetime.now()
-                data_time = datetime.strptime(current_data_to_display['timestamp'], "%Y-%m-%d %H:%M:%S")
-                time_diff_seconds = (current_time - data_time).total_seconds()
-
-                if time_diff_seconds <= 3:
-                    self.alarmWidget.check_all_rules({
-                        'temperature': current_data_to_display['temperature'],
-                        'humidity': current_data_to_display['humidity'],
-                        'pm25': current_data_to_display['pm25'],
-                        'noise': current_data_to_display['noise'],
-                        'timestamp': current_data_to_display['timestamp']
-                    })
-                else:
-                    self.alarmWidget.stop_all_alarms()
-            except ValueError:
-                print(f"警报检查时时间戳格式错误: {current_data_to_display['timestamp']}", file=sys.stderr)
-                self.alarmWidget.stop_all_alarms()
-            except Exception as e:
-                print(f"检查警报规则时发生错误: {e}", file=sys.stderr)
-                self.alarmWidget.stop_all_alarms()
+            render_t = time.monotonic()
         else:
-            self.alarmWidget.stop_all_alarms()
             print("未能获取到任何数据进行更新。", file=sys.stderr)
 
+        # 警报规则对所有设备生效，不只是当前显示的设备
+        alarm_t = None
+        try:
+            checked = self.check_live_alarms() if self.replay_clock is None else self.check_replay_alarms()
+            if self.current_device_id in checked:
+                alarm_t = time.monotonic()
+        except Exception as e:
+            print(f"检查警报规则时发生错误: {e}", file=sys.stderr)
+            if self.replay_clock is None:
+                self.alarmWidget.stop_all_alarms()
+
+        if current_data_to_display and self.replay_clock is None:
+            # 回放的是历史数据，不能用来标记采集进程刚发来的样本已渲染
+            self.latency_tracker.complete(current_data_to_display.get('id'), fetch_t, render_t, alarm_t,
+                                          self.current_device_id)
+
+    def check_live_alarms(self):
+        """按实时数据检查警报 (警报页的规则)，返回本次检查了新数据的设备id"""
+        return set(self.check_alarms(self.alarmWidget.device_alarms, self.alarm_checked, datetime.now()))
+
+    def check_replay_alarms(self):
+        """按回放时间检查历史数据的警报 (开始回放时的规则副本)，打印触发与恢复，返回本次检查了新数据的设备id"""
+        now = self.replay_clock.now()
+        changes = self.check_alarms(self.replay_alarms, self.replay_alarm_checked, now,
+                                    now.strftime("%Y-%m-%d %H:%M:%S"),
+                                    ALARM_FRESHNESS_SECONDS * self.replay_clock.speed)
+        for device_id, rules in changes.items():
+            for rule in rules:
+                print(f"回放 {now:%Y-%m-%d %H:%M:%S}: {rule.device_name or f'设备 {device_id}'} "
+                      f"{rule.sensor_type} {rule.condition_type} {rule.threshold} "
+                      f"{'触发' if rule.is_triggered else '恢复'}")
+        return set(changes)
+
+    def check_alarms(self, alarms, checked_records, now, before=None, freshness=ALARM_FRESHNESS_SECONDS):
+        """
+        按每台设备截至 before 的最新数据检查警报规则，各设备使用独立的规则副本 (alarm.DeviceAlarms)。
+        checked_records: {设备id: 最近检查过的记录id}，同一条记录不重复检查；
+        数据超过 freshness 秒未更新的设备停止播放音频警报。
+        返回 {本次检查了新数据的设备id: 状态变化的规则副本}。
+        """
+        conn = dbconn.reader(DB_PATH)
+        checked = {}
+        for device_id, name, _ in self.device_list or [(self.current_device_id, None, None)]:
+            latest = query.fetch_latest(conn, device_id=device_id, before=before)
+            if latest is None:
+                continue
+            data_time = datetime.strptime(latest[0], "%Y-%m-%d %H:%M:%S")
+            if (now - data_time).total_seconds() > freshness:
+                alarms.silence(device_id)
+                continue
+            if latest[5] == checked_records.get(device_id):
+                continue
+            checked_records[device_id] = latest[5]
+            data = {'temperature': latest[1], 'humidity': latest[2], 'pm25': latest[3], 'noise': latest[4]}
+            checked[device_id] = alarms.check(device_id, data, name)
+        return checked
+
     def closeEvent(self, event):
         """
         处理窗口关闭事件。
@@ -259,6 +532,8 @@ class MainWindow(FluentWindow):
         print("主窗口关闭事件触发。")
         if hasattr(self, 'timer') and self.timer:
             self.timer.stop()
+        if self.replay_clock is not None:
+            self.replay_clock.pause()
         if hasattr(self, 'alarmWidget') and self.alarmWidget:
             self.alarmWidget.stop_all_alarms()
 
@@ -281,6 +556,7 @@ class MainWindow(FluentWindow):
             except Exception as e:
                 print(f"ERROR: Fluent - 终止数据服务进程时发生异常: {e}", file=sys.stderr)
         # --- 结束终止 ROUTER 进程 ---
+        dbconn.close_readers()
 
         super().closeEvent(event)
         app_instance = QCoreApplication.instance()
@@ -289,12 +565,19 @@ class MainWindow(FluentWindow):
         print("应用程序已请求退出。")
 
 
+def start_exporter():
+    """导出界面进程的指标 (查询耗时、警报、启动耗时、各阶段延迟)，采集进程的指标见 exporter.ROUTER_PORT"""
+    import exporter  # 导入 http.server，在窗口显示之后进行
+    exporter.start(exporter.GUI_PORT)
+
+
 def start_fluent_application():
     """
     启动 Fluent UI 应用程序的入口函数。
     """
     import signal
     signal.signal(signal.SIGINT, signal.SIG_DFL)
+    log.setup("fluent")
 
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
@@ -312,6 +595,7 @@ def start_fluent_application():
 
     window = MainWindow()
     window.show()
+    QTimer.singleShot(0, start_exporter)
 
     try:
         desktop = QApplication.desktop().availableGeometry()
@@ -1,12 +1,45 @@
-import sqlite3
-
-from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtCore import Qt, QDate, QThread, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QFileDialog, QTableWidgetItem
-from qfluentwidgets import (HeaderCardWidget, BodyLabel, PrimaryPushButton, PushButton,
-                            ZhDatePicker, TableWidget,InfoBar, InfoBarPosition, StrongBodyLabel)
+from qfluentwidgets import (HeaderCardWidget, BodyLabel, PrimaryPushButton, PushButton, ComboBox,
+                            ZhDatePicker, TableWidget,InfoBar, InfoBarPosition, StrongBodyLabel, ProgressBar)
+
+import dbconn
+import export
+import playback
+import query
+from device_selector import DeviceSelector
 
 DB_PATH = "db/sqlite.db"
 
+# 分辨率下拉框选项 -> query 模块中的分辨率。单日表格默认显示原始数据，汇总分辨率下每行是区间均值
+RESOLUTION_OPTIONS = [("原始数据", "raw"), ("1 分钟均值", "1m"), ("1 小时均值", "1h")]
+# 批量导出选项
+EXPORT_FORMAT_OPTIONS = [("Parquet", "parquet", "Parquet 文件 (*.parquet)"), ("Arrow IPC", "arrow", "Arrow 文件 (*.arrow)")]
+EXPORT_RESOLUTION_OPTIONS = [("原始数据", "raw"), ("1 分钟", "1m"), ("1 小时", "1h"), ("1 天", "1d")]
+
+
+class ExportWorker(QThread):
+    """在后台线程中执行批量导出"""
+    progressChanged = pyqtSignal(int, int)
+    exportFinished = pyqtSignal(str, int)
+    exportFailed = pyqtSignal(str)
+
+    def __init__(self, out_path, start_str, end_str, fmt, resolution, parent=None):
+        super().__init__(parent)
+        self.out_path = out_path
+        self.start_str = start_str
+        self.end_str = end_str
+        self.fmt = fmt
+        self.resolution = resolution
+
+    def run(self):
+        try:
+            rows = export.export_range(self.out_path, self.start_str, self.end_str, self.fmt, self.resolution,
+                                       DB_PATH, progress=self.progressChanged.emit)
+            self.exportFinished.emit(self.out_path, rows)
+        except Exception as e:
+            self.exportFailed.emit(str(e))
+
 class EnvironmentStatusWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -56,10 +89,16 @@ class EnvironmentStatusWidget(QWidget):
         self.noise_status.setStyleSheet(f"StrongBodyLabel#noiseLabel {{background-color: {'#16a34a' if noise_status == '安静' else '#eab308' if noise_status == '一般' else '#e11d48'}; border-radius: 4px; padding: 2px 8px; color: white; font-weight: bold;}}")
 
 class HistoryWidget(QWidget):
+    replayRequested = pyqtSignal(str, str, int)  # 回放开始时间, 结束时间, 倍速
+    replayStopRequested = pyqtSignal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setObjectName("historyWidget")
         self.dark_mode = False
+        self.export_worker = None
+        self.replay_active = False
+        self.table_resolution = "raw"  # 表格当前数据的分辨率，导出CSV时标明汇总数据
         self.setup_ui()
 
     def setup_ui(self):
@@ -73,9 +112,15 @@ class HistoryWidget(QWidget):
         self.date_card.setTitle("选择日期")
         self.date_card.setBorderRadius(8)
         picker_layout = QHBoxLayout()
+        self.device_selector = DeviceSelector(self.date_card)
+        picker_layout.addWidget(self.device_selector)
         self.date_picker = ZhDatePicker(self.date_card)
         self.date_picker.setDate(QDate.currentDate())
         picker_layout.addWidget(self.date_picker)
+        self.resolution_combo = ComboBox(self.date_card)
+        self.resolution_combo.addItems([name for name, _ in RESOLUTION_OPTIONS])
+        self.resolution_combo.setCurrentIndex(0)
+        picker_layout.addWidget(self.resolution_combo)
         self.query_button = PrimaryPushButton("查询", self.date_card)
         self.query_button.clicked.connect(self.query_data)
         picker_layout.addWidget(self.query_button)
@@ -85,6 +130,54 @@ class HistoryWidget(QWidget):
         picker_layout.addStretch()
         self.date_card.viewLayout.addLayout(picker_layout)
         layout.addWidget(self.date_card)
+        self.bulk_card = HeaderCardWidget(self)
+        self.bulk_card.setTitle("批量导出")
+        self.bulk_card.setBorderRadius(8)
+        bulk_layout = QHBoxLayout()
+        self.bulk_start_picker = ZhDatePicker(self.bulk_card)
+        self.bulk_start_picker.setDate(QDate.currentDate().addDays(-6))
+        bulk_layout.addWidget(self.bulk_start_picker)
+        bulk_layout.addWidget(BodyLabel("至", self.bulk_card))
+        self.bulk_end_picker = ZhDatePicker(self.bulk_card)
+        self.bulk_end_picker.setDate(QDate.currentDate())
+        bulk_layout.addWidget(self.bulk_end_picker)
+        self.bulk_format_combo = ComboBox(self.bulk_card)
+        self.bulk_format_combo.addItems([name for name, _, _ in EXPORT_FORMAT_OPTIONS])
+        bulk_layout.addWidget(self.bulk_format_combo)
+        self.bulk_resolution_combo = ComboBox(self.bulk_card)
+        self.bulk_resolution_combo.addItems([name for name, _ in EXPORT_RESOLUTION_OPTIONS])
+        bulk_layout.addWidget(self.bulk_resolution_combo)
+        self.bulk_export_button = PushButton("导出", self.bulk_card)
+        self.bulk_export_button.clicked.connect(self.bulk_export)
+        bulk_layout.addWidget(self.bulk_export_button)
+        bulk_layout.addStretch()
+        self.bulk_card.viewLayout.addLayout(bulk_layout)
+        self.bulk_progress = ProgressBar(self.bulk_card)
+        self.bulk_progress.setRange(0, 100)
+        self.bulk_progress.setValue(0)
+        self.bulk_progress.hide()
+        self.bulk_card.viewLayout.addWidget(self.bulk_progress)
+        layout.addWidget(self.bulk_card)
+        self.replay_card = HeaderCardWidget(self)
+        self.replay_card.setTitle("历史回放")
+        self.replay_card.setBorderRadius(8)
+        replay_layout = QHBoxLayout()
+        self.replay_start_picker = ZhDatePicker(self.replay_card)
+        self.replay_start_picker.setDate(QDate.currentDate().addDays(-1))
+        replay_layout.addWidget(self.replay_start_picker)
+        replay_layout.addWidget(BodyLabel("至", self.replay_card))
+        self.replay_end_picker = ZhDatePicker(self.replay_card)
+        self.replay_end_picker.setDate(QDate.currentDate().addDays(-1))
+        replay_layout.addWidget(self.replay_end_picker)
+        self.replay_speed_combo = ComboBox(self.replay_card)
+        self.replay_speed_combo.addItems([f"{speed}×" for speed in playback.SPEED_OPTIONS])
+        replay_layout.addWidget(self.replay_speed_combo)
+        self.replay_button = PushButton("开始回放", self.replay_card)
+        self.replay_button.clicked.connect(self.toggle_replay)
+        replay_layout.addWidget(self.replay_button)
+        replay_layout.addStretch()
+        self.replay_card.viewLayout.addLayout(replay_layout)
+        layout.addWidget(self.replay_card)
         self.results_card = HeaderCardWidget(self)
         self.results_card.setTitle("查询结果")
         self.results_card.setBorderRadius(8)
@@ -104,15 +197,14 @@ class HistoryWidget(QWidget):
     def query_data(self):
         selected_date = self.date_picker.getDate()
         date_str = selected_date.toString("yyyy-MM-dd")
+        resolution = RESOLUTION_OPTIONS[self.resolution_combo.currentIndex()][1]
         try:
-            conn = sqlite3.connect(DB_PATH, timeout=5)
-            cursor = conn.cursor()
             start_date = f"{date_str} 00:00:00"
             end_date = f"{date_str} 23:59:59"
-            cursor.execute("SELECT timestamp, temperature, humidity, pm25, noise FROM sensor_data WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp DESC", (start_date, end_date))
-            results = cursor.fetchall()
-            conn.close()
+            results = query.fetch_range(dbconn.reader(DB_PATH), start_date, end_date, resolution, descending=True,
+                                        device_id=self.device_selector.current_device())
             self.update_table(results)
+            self.table_resolution = resolution
             if results:
                 InfoBar.success(title='查询成功', content=f'找到 {len(results)} 条记录', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
             else:
@@ -130,8 +222,8 @@ class HistoryWidget(QWidget):
             self.table.setItem(row_idx, 0, QTableWidgetItem(row_data[0]))
             self.table.setItem(row_idx, 1, QTableWidgetItem(f"{row_data[1]:.1f}"))
             self.table.setItem(row_idx, 2, QTableWidgetItem(f"{row_data[2]:.1f}"))
-            self.table.setItem(row_idx, 3, QTableWidgetItem(f"{row_data[3]}"))
-            self.table.setItem(row_idx, 4, QTableWidgetItem(f"{row_data[4]}"))
+            self.table.setItem(row_idx, 3, QTableWidgetItem(f"{row_data[3]:.0f}"))
+            self.table.setItem(row_idx, 4, QTableWidgetItem(f"{row_data[4]:.0f}"))
             temp_status = self._evaluate_temp(row_data[1], thresholds['temp'])
             humidity_status = self._evaluate_humidity(row_data[2], thresholds['humidity'])
             pm25_status = self._evaluate_pm25(row_data[3], thresholds['pm25'])
@@ -175,13 +267,20 @@ class HistoryWidget(QWidget):
             InfoBar.warning(title='导出失败', content='没有数据可导出', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
             return
         selected_date = self.date_picker.getDate().toString("yyyy-MM-dd")
-        default_name = f"环境数据_{selected_date}.csv"
+        resolution_name = dict((value, name) for name, value in RESOLUTION_OPTIONS)[self.table_resolution]
+        if self.table_resolution == "raw":
+            default_name = f"环境数据_{selected_date}.csv"
+        else:
+            default_name = f"环境数据_{selected_date}_{resolution_name}.csv"
         file_path, _ = QFileDialog.getSaveFileName(self, "保存CSV文件", default_name, "CSV 文件 (*.csv)")
         if not file_path:
             return
         try:
             with open(file_path, 'w', newline='', encoding='utf-8-sig') as f:
                 headers = [self.table.horizontalHeaderItem(i).text() for i in range(self.table.columnCount())]
+                if self.table_resolution != "raw":
+                    # 汇总数据在时间列标明分辨率，导入工具据此拒绝把均值当作原始数据导入
+                    headers[0] = f"{headers[0]}({resolution_name})"
                 f.write(','.join(headers) + '\n')
                 for row in range(self.table.rowCount()):
                     row_data = []
@@ -197,5 +296,73 @@ class HistoryWidget(QWidget):
         except Exception as e:
             InfoBar.error(title='导出失败', content=f'发生错误: {str(e)}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
 
+    def bulk_export(self):
+        if self.export_worker and self.export_worker.isRunning():
+            InfoBar.warning(title='正在导出', content='请等待当前导出完成', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
+            return
+        start_date = self.bulk_start_picker.getDate().toString("yyyy-MM-dd")
+        end_date = self.bulk_end_picker.getDate().toString("yyyy-MM-dd")
+        if start_date > end_date:
+            InfoBar.warning(title='导出失败', content='起始日期不能晚于结束日期', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
+            return
+        _, fmt, file_filter = EXPORT_FORMAT_OPTIONS[self.bulk_format_combo.currentIndex()]
+        resolution = EXPORT_RESOLUTION_OPTIONS[self.bulk_resolution_combo.currentIndex()][1]
+        default_name = f"环境数据_{start_date}_{end_date}_{resolution}.{fmt}"
+        file_path, _ = QFileDialog.getSaveFileName(self, "保存导出文件", default_name, file_filter)
+        if not file_path:
+            return
+        self.bulk_export_button.setEnabled(False)
+        self.bulk_progress.setValue(0)
+        self.bulk_progress.show()
+        self.export_worker = ExportWorker(file_path, f"{start_date} 00:00:00", f"{end_date} 23:59:59", fmt, resolution, self)
+        self.export_worker.progressChanged.connect(self.on_bulk_export_progress)
+        self.export_worker.exportFinished.connect(self.on_bulk_export_finished)
+        self.export_worker.exportFailed.connect(self.on_bulk_export_failed)
+        self.export_worker.start()
+
+    def on_bulk_export_progress(self, done, total):
+        self.bulk_progress.setValue(int(done * 100 / total) if total else 100)
+
+    def on_bulk_export_finished(self, file_path, rows):
+        self.bulk_export_button.setEnabled(True)
+        self.bulk_progress.hide()
+        InfoBar.success(title='导出成功', content=f'{rows} 条记录已保存至 {file_path}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
+
+    def on_bulk_export_failed(self, message):
+        self.bulk_export_button.setEnabled(True)
+        self.bulk_progress.hide()
+        InfoBar.error(title='导出失败', content=f'发生错误: {message}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
+
+    def toggle_replay(self):
+        """在主页、图表与警报上按倍速回放所选日期范围内当前设备的数据"""
+        if self.replay_active:
+            self.replayStopRequested.emit()
+            return
+        start_date = self.replay_start_picker.getDate().toString("yyyy-MM-dd")
+        end_date = self.replay_end_picker.getDate().toString("yyyy-MM-dd")
+        if start_date > end_date:
+            InfoBar.warning(title='无法回放', content='起始日期不能晚于结束日期', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
+            return
+        start_str, end_str = f"{start_date} 00:00:00", f"{end_date} 23:59:59"
+        try:
+            # 从范围内第一条数据开始回放，跳过开头没有数据的时段
+            buckets = query.fetch_range(dbconn.reader(DB_PATH), start_str, end_str, "1h",
+                                        device_id=self.device_selector.current_device())
+        except Exception as e:
+            InfoBar.error(title='回放错误', content=f'发生错误: {str(e)}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
+            return
+        if not buckets:
+            InfoBar.info(title='无数据', content=f'{start_date} 至 {end_date} 没有记录', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
+            return
+        speed = playback.SPEED_OPTIONS[self.replay_speed_combo.currentIndex()]
+        self.replayRequested.emit(max(buckets[0][0], start_str), end_str, speed)
+
+    def set_replay_active(self, active):
+        self.replay_active = active
+        self.replay_button.setText("停止回放" if active else "开始回放")
+        self.replay_start_picker.setEnabled(not active)
+        self.replay_end_picker.setEnabled(not active)
+        self.replay_speed_combo.setEnabled(not active)
+
     def update_theme(self, dark_mode):
         self.dark_mode = dark_mode
\ No newline at end of file
@@ -2,6 +2,8 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QGridLayout, QHBoxLayout
 from qfluentwidgets import HeaderCardWidget, BodyLabel, ElevatedCardWidget, FluentIcon, IconWidget, CaptionLabel
 
+from device_selector import DeviceSelector
+
 class RealtimeDataCard(HeaderCardWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -79,6 +81,8 @@ class HomeWidget(QWidget):
         layout = QVBoxLayout(self)
         layout.setContentsMargins(20, 20, 20, 20)
         layout.setSpacing(16)
+        self.device_selector = DeviceSelector(self)
+        layout.addWidget(self.device_selector)
         self.data_card = RealtimeDataCard(self)
         layout.addWidget(self.data_card)
         layout.addStretch()
@@ -0,0 +1,306 @@
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import archive
+import dbconn
+import devices
+import ingest_lock
+import migrations
+import partition
+import rollup
+
+DB_PATH = "db/sqlite.db"
+CHUNK_ROWS = 100000            # 每次从文件读取并写入暂存表的行数
+COMMIT_ROWS = 500000           # 独占导入 (没有采集进程在运行) 时每个写入事务的最大行数
+SHARED_COMMIT_ROWS = 20000     # 采集进程在运行时每个写入事务的最大行数，避免长时间占用写锁使其写入超时
+DEFER_INDEX_MIN_ROWS = 200000  # 导入量超过该值且超过已有数据的 1/4 时，先删除时间索引，导入后重建
+PROGRESS_INTERVAL = 2.0        # 进度输出间隔 (秒)
+ROLLUP_TIME_HEADER = "时间("   # 历史页导出汇总数据时时间列的表头前缀，如 "时间(1 分钟均值)"
+
+_TIMESTAMP_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+# 重复记录按 (设备, 时间戳, 各项数值) 判断: 高于 1 Hz 的设备同一秒内有多条不同的样本，不能只比较时间戳。
+# 温湿度按下位机的 0.1 精度比较，避免导出与导入的文本转换带来的浮点误差
+_SAME_VALUES = ("ROUND({a}.temperature, 1) IS ROUND({b}.temperature, 1) "
+                "AND ROUND({a}.humidity, 1) IS ROUND({b}.humidity, 1) "
+                "AND {a}.pm25 IS {b}.pm25 AND {a}.noise IS {b}.noise")
+# 删除暂存表中在 {table} 里已存在的记录，由已有数据的 (device_id, timestamp) 索引逐行查找
+_EXISTING_SQL = ("DELETE FROM import_staging WHERE EXISTS (SELECT 1 FROM {table} s "
+                 "WHERE s.device_id = import_staging.device_id AND s.timestamp = import_staging.timestamp AND "
+                 + _SAME_VALUES.format(a="s", b="import_staging") + ")")
+
+
+def iter_csv_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    读取 HistoryWidget.export_data 格式的CSV (时间,温度,湿度,PM2.5,噪声,状态...)，
+    只取前5列；表头与格式错误的行会被跳过。导出的是汇总数据 (时间列表头标明了分辨率) 时抛出 ValueError。
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        chunk = []
+        for fields in csv.reader(f):
+            if fields and fields[0].startswith(ROLLUP_TIME_HEADER):
+                raise ValueError(f"{path} 是汇总数据 ({fields[0]})，不能作为原始数据导入")
+            if len(fields) < 5 or not _TIMESTAMP_PATTERN.match(fields[0]):
+                continue
+            try:
+                chunk.append((fields[0], float(fields[1]), float(fields[2]),
+                              int(float(fields[3])), int(float(fields[4])), None))
+            except ValueError:
+                continue
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _rows_from_arrow_batch(batch):
+    data = batch.to_pydict()
+    times = [t.strftime("%Y-%m-%d %H:%M:%S") for t in data["time"]]
+    device_ids = data.get("device_id") or [None] * len(times)
+    return list(zip(times, data["temperature"], data["humidity"], data["pm25"], data["noise"], device_ids))
+
+
+def _arrow_columns(schema):
+    # 多设备支持之前导出的文件没有 device_id 列
+    columns = ["time", "temperature", "humidity", "pm25", "noise"]
+    return columns + ["device_id"] if "device_id" in schema.names else columns
+
+
+def iter_parquet_chunks(path, chunk_rows=CHUNK_ROWS):
+    """读取 export.py 导出的原始数据 Parquet 文件"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("导入 Parquet 文件需要安装 pyarrow (pip install pyarrow)")
+    parquet_file = pq.ParquetFile(path)
+    columns = _arrow_columns(parquet_file.schema_arrow)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+        yield _rows_from_arrow_batch(batch)
+
+
+def iter_arrow_chunks(path, chunk_rows=CHUNK_ROWS):
+    """读取 export.py 导出的原始数据 Arrow IPC 文件"""
+    try:
+        import pyarrow.ipc as ipc
+    except ImportError:
+        raise RuntimeError("导入 Arrow 文件需要安装 pyarrow (pip install pyarrow)")
+    with open(path, "rb") as f:
+        reader = ipc.open_file(f)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield _rows_from_arrow_batch(batch.slice(offset, chunk_rows))
+
+
+def iter_archive_chunks(path, chunk_rows=CHUNK_ROWS):
+    """读取 archive.py 生成的 .fsa 归档文件 (例如从其他站点拷贝来的归档)"""
+    with archive.ArchiveReader(path) as reader:
+        rows = [row[:5] + row[6:7] for row in reader.read_rows()]
+    for offset in range(0, len(rows), chunk_rows):
+        yield rows[offset:offset + chunk_rows]
+
+
+READERS = {
+    ".csv": iter_csv_chunks,
+    ".parquet": iter_parquet_chunks,
+    ".arrow": iter_arrow_chunks,
+    ".fsa": iter_archive_chunks,
+}
+
+
+class Progress:
+    """按固定间隔输出导入进度"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self, done, total=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.last < PROGRESS_INTERVAL:
+            return
+        self.last = now
+        rate = done / max(now - self.start, 1e-6)
+        total_text = f"/{total}" if total else ""
+        print(f"{self.stage}: {done}{total_text} 行, {rate * 60 / 1e6:.2f} 百万行/分钟")
+
+
+def _stage_files(conn, paths, device_id):
+    """将所有文件读入暂存表 import_staging，返回读取的行数；文件中没有设备信息的行归属 device_id"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_staging "
+                 "(timestamp TEXT NOT NULL, temperature REAL, humidity REAL, pm25 INTEGER, noise INTEGER, "
+                 "device_id INTEGER)")
+    conn.execute("DELETE FROM import_staging")
+    progress = Progress("读取")
+    staged = 0
+    for path in paths:
+        reader = READERS.get(os.path.splitext(path)[1].lower())
+        if reader is None:
+            raise ValueError(f"不支持的文件类型: {path}")
+        for chunk in reader(path):
+            with conn:
+                conn.executemany("INSERT INTO import_staging VALUES (?, ?, ?, ?, ?, ?)", chunk)
+            staged += len(chunk)
+            progress.update(staged)
+    with conn:
+        conn.execute("UPDATE import_staging SET device_id = ? WHERE device_id IS NULL", (device_id,))
+    progress.update(staged, force=True)
+    return staged
+
+
+def _deduplicate(conn):
+    """去除暂存表内部的重复记录，以及数据库 (含分区和归档) 中已存在的记录，返回剩余行数"""
+    with conn:
+        conn.execute("DELETE FROM import_staging WHERE rowid NOT IN "
+                     "(SELECT MIN(rowid) FROM import_staging GROUP BY device_id, timestamp, "
+                     "ROUND(temperature, 1), ROUND(humidity, 1), pm25, noise)")
+        conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_staging_timestamp ON import_staging(timestamp, device_id)")
+    start_str, end_str = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM import_staging").fetchone()
+    if start_str is None:
+        return 0
+    # 主库与分区各一条 DELETE，已有数据不读入内存
+    with conn:
+        conn.execute(_EXISTING_SQL.format(table="main.sensor_data"))
+    for _, path in partition.partitions_for_range(start_str, end_str):
+        conn.execute("ATTACH DATABASE ? AS part", (path,))
+        try:
+            with conn:
+                conn.execute(_EXISTING_SQL.format(table="part.sensor_data"))
+        finally:
+            conn.execute("DETACH DATABASE part")
+    # 归档是压缩的列式文件，先把时间范围内的记录读入临时表，再同样一条 DELETE
+    archives = archive.archives_for_range(start_str, end_str)
+    if archives:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS import_archived "
+                     "(device_id INTEGER, timestamp TEXT, temperature REAL, humidity REAL, pm25 INTEGER, "
+                     "noise INTEGER)")
+        conn.execute("CREATE INDEX IF NOT EXISTS temp.idx_archived ON import_archived(device_id, timestamp)")
+        for _, path in archives:
+            with archive.ArchiveReader(path) as reader:
+                rows = reader.read_rows(start_str, end_str)
+            with conn:
+                conn.executemany("INSERT INTO import_archived VALUES (?, ?, ?, ?, ?, ?)",
+                                 ((row[6], row[0]) + row[1:5] for row in rows))
+        with conn:
+            conn.execute(_EXISTING_SQL.format(table="temp.import_archived"))
+        conn.execute("DROP TABLE temp.import_archived")
+    return conn.execute("SELECT COUNT(*) FROM import_staging").fetchone()[0]
+
+
+def import_files(paths, db_path=DB_PATH, defer_index=None, device_id=devices.DEFAULT_DEVICE_ID):
+    """
+    批量导入文件中的数据，返回 (读取行数, 新写入行数)。
+    defer_index: True/False 强制是否在导入期间删除时间索引，None 时按导入量自动决定。
+    导入期间尽量持有采集锁 (见 ingest_lock)；采集进程在运行时不删除索引 (强制删除时抛出 RuntimeError)，
+    并以较小的事务写入，不让采集进程的写入等待超时。
+    device_id: 文件中没有设备信息 (如CSV) 时数据归属的设备。
+    """
+    start = time.monotonic()
+    conn = dbconn.connect_writer(db_path)
+    try:
+        conn.execute("PRAGMA temp_store=FILE")
+        exclusive = ingest_lock.acquire("importer")
+        if not migrations.indexes_ready(conn):
+            # 上次导入在重建索引前被中断；采集进程在运行时由它下次启动时补建 (分批重建期间查询结果不完整)
+            if exclusive:
+                print("原始数据表缺少时间索引，先补建")
+                migrations.ensure_indexes(conn)
+            else:
+                print("原始数据表缺少时间索引，将在采集进程下次启动时补建")
+        staged = _stage_files(conn, paths, device_id)
+        pending = _deduplicate(conn)
+        print(f"去重完成: 读取 {staged} 行, 待写入 {pending} 行")
+        if pending == 0:
+            return staged, 0
+
+        existing_rows = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+        forced = defer_index
+        if defer_index is None:
+            defer_index = pending >= DEFER_INDEX_MIN_ROWS and pending * 4 >= existing_rows
+        if defer_index and not exclusive:
+            # 采集进程与界面正在查询，删除索引会让它们退化为全表扫描
+            owner = ingest_lock.holder() or {}
+            if forced:
+                raise RuntimeError(f"采集进程 (PID {owner.get('pid')}, {owner.get('role')}) 正在运行，"
+                                   f"不能在导入期间删除时间索引，请先停止采集或使用 --keep-index")
+            print(f"采集进程 (PID {owner.get('pid')}) 正在运行，导入期间保留时间索引")
+            defer_index = False
+        if defer_index:
+            print("导入期间暂时删除时间索引，完成后重建")
+            with conn:
+                conn.execute("DROP INDEX IF EXISTS idx_timestamp")
+                conn.execute("DROP INDEX IF EXISTS idx_device_timestamp")
+
+        commit_rows = COMMIT_ROWS
+        if not exclusive:
+            owner = ingest_lock.holder() or {}
+            print(f"采集进程 (PID {owner.get('pid')}) 正在运行，每个事务最多写入 {SHARED_COMMIT_ROWS} 行")
+            commit_rows = SHARED_COMMIT_ROWS
+
+        progress = Progress("写入")
+        written = 0
+        last_key = ("", 0, 0)
+        rollup.create_rollup_tables(conn)
+        try:
+            while True:
+                # 按 (时间戳, 设备, rowid) 分页读取暂存表，按时间顺序写入
+                rows = conn.execute("SELECT timestamp, temperature, humidity, pm25, noise, device_id, rowid "
+                                    "FROM import_staging WHERE (timestamp, device_id, rowid) > (?, ?, ?) "
+                                    "ORDER BY timestamp, device_id, rowid LIMIT ?",
+                                    last_key + (commit_rows,)).fetchall()
+                if not rows:
+                    break
+                last_key = (rows[-1][0], rows[-1][5], rows[-1][6])
+                rows = [row[:6] for row in rows]
+                with conn:
+                    conn.executemany("INSERT INTO sensor_data (timestamp, temperature, humidity, pm25, noise, "
+                                     "device_id) VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    rollup.apply_rows(conn, rows)
+                written += len(rows)
+                progress.update(written, pending)
+        finally:
+            if defer_index:
+                index_start = time.monotonic()
+                with conn:
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON sensor_data(timestamp)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_device_timestamp ON sensor_data(device_id, timestamp)")
+                print(f"时间索引重建完成, 耗时 {time.monotonic() - index_start:.1f} 秒")
+        progress.update(written, pending, force=True)
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS temp.import_staging")
+        elapsed = time.monotonic() - start
+        print(f"导入完成: 新写入 {written} 行, 跳过重复 {staged - written} 行, 耗时 {elapsed:.1f} 秒 "
+              f"({staged * 60 / max(elapsed, 1e-6) / 1e6:.2f} 百万行/分钟)")
+        return staged, written
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 批量数据导入 (CSV / Parquet / Arrow / 归档)")
+    parser.add_argument("files", nargs="+", help="要导入的文件 (.csv, .parquet, .arrow, .fsa)")
+    parser.add_argument("--db", default=DB_PATH, help="主数据库文件路径")
+    index_group = parser.add_mutually_exclusive_group()
+    index_group.add_argument("--defer-index", dest="defer_index", action="store_true", default=None,
+                             help="导入期间删除时间索引并在完成后重建")
+    index_group.add_argument("--keep-index", dest="defer_index", action="store_false",
+                             help="导入期间保留时间索引")
+    parser.add_argument("--device-id", type=int, default=devices.DEFAULT_DEVICE_ID,
+                        help="文件中没有设备信息时数据归属的设备id")
+    args = parser.parse_args(argv)
+    try:
+        import_files(args.files, args.db, args.defer_index, args.device_id)
+    except (RuntimeError, ValueError, OSError, sqlite3.Error) as e:
+        print(f"导入失败: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
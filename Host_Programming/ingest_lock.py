@@ -0,0 +1,82 @@
+import json
+import os
+from datetime import datetime
+
+# 同一数据库只允许一个采集进程 (界面启动的 router、单独运行的 router.py 或 service.py)，
+# 否则同一台下位机会被连接两次，没有序号的 v1 帧会重复写入。
+# 采集进程启动时对锁文件加操作系统文件锁并一直持有，进程退出 (包括崩溃) 时由系统释放，不会残留过期的锁。
+# 锁文件第一个字节用于加锁 (Windows 的字节范围锁)，之后是持有者信息 (JSON)。
+LOCK_PATH = "db/ingest.lock"
+
+_held = None  # 本进程持有的 (文件对象, pid, 信息)
+
+
+def _lock(f):
+    f.seek(0)
+    if os.name == "nt":
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(f):
+    f.seek(0)
+    if os.name == "nt":
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _open(path):
+    return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), "r+", encoding="utf-8")
+
+
+def acquire(role, path=LOCK_PATH):
+    """
+    取得采集锁并在锁文件中记录本进程的信息，其他进程持有锁时返回 False。
+    锁保持到进程退出；本进程已持有时直接返回 True (以 fork 方式创建的子进程不继承)。
+    """
+    global _held
+    if _held is not None and _held[1] == os.getpid():
+        return True
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    f = _open(path)
+    try:
+        _lock(f)
+    except OSError:
+        f.close()
+        return False
+    info = {'pid': os.getpid(), 'role': role, 'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    f.seek(0)
+    f.write("\n" + json.dumps(info, ensure_ascii=False))
+    f.truncate()
+    f.flush()
+    _held = (f, os.getpid(), info)
+    return True
+
+
+def holder(path=LOCK_PATH):
+    """返回持有采集锁的进程信息 {'pid', 'role', 'started'}，没有采集进程在运行时返回 None"""
+    if _held is not None and _held[1] == os.getpid():
+        return _held[2]
+    try:
+        f = _open(path)
+    except OSError:
+        return None
+    with f:
+        try:
+            _lock(f)
+        except OSError:
+            f.seek(1)
+            try:
+                return json.loads(f.read())
+            except ValueError:
+                return {'pid': None, 'role': "unknown", 'started': None}
+        _unlock(f)
+        return None
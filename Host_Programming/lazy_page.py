@@ -0,0 +1,31 @@
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+
+
+class LazyPage(QWidget):
+    """
+    导航页的占位控件: 第一次显示 (或调用 ensure) 时才调用 factory 创建真正的页面并放入布局，
+    页面模块及其依赖 (如 pyqtgraph) 也在 factory 中导入，不用的页面不拖慢启动。
+    创建后发出 created 信号，主窗口在这里连接信号、同步设备列表与数据。
+    """
+    created = pyqtSignal(QWidget)
+
+    def __init__(self, object_name, factory, parent=None):
+        super().__init__(parent)
+        self.setObjectName(object_name)  # 导航栏以 objectName 区分页面
+        self.factory = factory
+        self.widget = None
+        self.page_layout = QVBoxLayout(self)
+        self.page_layout.setContentsMargins(0, 0, 0, 0)
+
+    def ensure(self):
+        """返回真正的页面，尚未创建时立即创建"""
+        if self.widget is None:
+            self.widget = self.factory()
+            self.page_layout.addWidget(self.widget)
+            self.created.emit(self.widget)
+        return self.widget
+
+    def showEvent(self, event):
+        self.ensure()
+        super().showEvent(event)
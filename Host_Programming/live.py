@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import json
+import sqlite3
+import time
+
+import dbconn
+import log
+import metrics
+import query
+
+# 实时推送: 将新入库的样本分发给所有订阅者 (HTTP 接口的 /api/stream，Server-Sent Events)。
+# 每个样本只编码一次；每个订阅者有一个有界队列，队列满时丢弃最旧的样本，慢速客户端不会拖慢其他订阅者，
+# 也不会使服务端内存无限增长。订阅者可按设备过滤，并在服务端降采样 (每台设备每隔 interval 秒最多推送一个样本)。
+# 样本来源: 接口与采集运行在同一进程时由入库线程在提交后直接推送 (router.SAMPLE_LISTENERS)；
+# 否则由一个后台任务按id跟踪数据库中新写入的数据，查询次数与订阅者数量无关。
+QUEUE_SIZE = 1000            # 每个订阅者默认的队列长度 (样本数)
+MAX_QUEUE_SIZE = 10000
+TAIL_INTERVAL = 0.2          # 跟踪数据库的查询间隔 (秒)
+TAIL_BATCH = 5000            # 每次最多读取的新样本数，积压更多时立即继续读取
+KEEPALIVE_INTERVAL = 15.0    # 没有数据时发送注释行的间隔 (秒)，便于客户端与代理发现断开的连接
+RECONNECT_MS = 3000          # 告知客户端 (EventSource) 断线后重连前的等待时间 (毫秒)
+COLUMNS = tuple(query.RAW_COLUMNS.split(", "))
+CONTENT_TYPE = "text/event-stream; charset=utf-8"
+
+logger = log.get_logger("live")
+
+
+def _event(row):
+    """将一行数据编码为 SSE 事件，事件id为记录id"""
+    data = json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False, separators=(",", ":"))
+    return f"id: {row[5]}\ndata: {data}\n\n".encode("utf-8")
+
+
+class Subscription:
+    """一个订阅者: 有界事件队列 (满时丢弃最旧的事件) 与降采样状态，只在事件循环线程中访问"""
+
+    def __init__(self, device_id=None, interval=0.0, queue_size=QUEUE_SIZE):
+        self.device_id = device_id
+        self.interval = interval
+        self.events = collections.deque(maxlen=queue_size)
+        self.dropped = 0          # 尚未通知客户端的丢弃数
+        self.last_sent = {}       # {设备id: 上次入队的时间}
+        self.ready = asyncio.Event()
+
+    def offer(self, events, now):
+        """events 为 [(设备id, 已编码的事件)]"""
+        queued = False
+        for device_id, event in events:
+            if self.device_id is not None and device_id != self.device_id:
+                continue
+            if self.interval:
+                if now - self.last_sent.get(device_id, float("-inf")) < self.interval:
+                    continue
+                self.last_sent[device_id] = now
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            queued = True
+        if queued:
+            self.ready.set()
+
+    def take(self):
+        """取出队列中的所有事件，拼接为一次写入的数据；有丢弃时先发送 dropped 事件告知客户端"""
+        chunks = []
+        if self.dropped:
+            metrics.increment("live_events_dropped", self.dropped)
+            chunks.append(f'event: dropped\ndata: {{"count":{self.dropped}}}\n\n'.encode("utf-8"))
+            self.dropped = 0
+        chunks.extend(self.events)
+        self.events.clear()
+        self.ready.clear()
+        return b"".join(chunks)
+
+
+class LiveHub:
+    """样本分发中心: publish (任意线程) 或 dispatch (事件循环线程) 送入的样本分发给所有订阅者"""
+
+    def __init__(self):
+        self.loop = None
+        self.subscribers = set()
+
+    def start(self, loop):
+        self.loop = loop
+
+    def publish(self, rows):
+        """由入库线程调用 (见 router.SAMPLE_LISTENERS)，转交给事件循环线程分发"""
+        loop = self.loop
+        if loop is None or not self.subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(self.dispatch, rows)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def dispatch(self, rows):
+        if not self.subscribers:
+            return
+        events = [(row[6], _event(row)) for row in rows]
+        now = time.monotonic()
+        for subscription in self.subscribers:
+            subscription.offer(events, now)
+        metrics.increment("live_samples", len(rows))
+
+    async def stream(self, subscription):
+        """订阅者的 SSE 数据流 (异步生成器)，结束 (客户端断开) 时自动退订"""
+        self.subscribers.add(subscription)
+        metrics.set_gauge("live_subscribers", len(self.subscribers))
+        try:
+            yield f"retry: {RECONNECT_MS}\n\n".encode("utf-8")
+            while True:
+                try:
+                    await asyncio.wait_for(subscription.ready.wait(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                yield subscription.take()
+        finally:
+            self.subscribers.discard(subscription)
+            metrics.set_gauge("live_subscribers", len(self.subscribers))
+
+    async def tail(self, db_path, executor):
+        """跟踪数据库中新写入的数据并分发 (接口与采集不在同一进程时使用)，查询在 executor 中执行"""
+        loop = asyncio.get_running_loop()
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    last_id = await loop.run_in_executor(executor, _max_row_id, db_path)
+                rows = await loop.run_in_executor(executor, _fetch_after, db_path, last_id)
+            except sqlite3.Error as e:
+                logger.warning("跟踪新数据失败: %s", e)
+                rows = []
+            if rows:
+                last_id = rows[-1][5]
+                self.dispatch(rows)
+            if len(rows) < TAIL_BATCH:
+                await asyncio.sleep(TAIL_INTERVAL)
+
+
+def _max_row_id(db_path):
+    return query.max_row_id(dbconn.reader(db_path))
+
+
+def _fetch_after(db_path, last_id):
+    return query.fetch_after(dbconn.reader(db_path), last_id, TAIL_BATCH)
@@ -0,0 +1,202 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import migrations
+import partition
+import router
+import simulator
+
+# 采集负载测试: 在临时工作目录中启动采集引擎 (子进程)，由模拟下位机按指定速率发送数据，
+# 每秒统计已发送与已入库的样本数，报告持续吞吐量、丢失率与入库延迟。
+# 子进程切换到临时目录运行，数据库、分区与备份均使用相对路径，不会影响 db/ 下的正式数据。
+UDP_PORT = 17600
+READY_TIMEOUT = 30.0     # 等待采集引擎完成数据库初始化的最长时间 (秒)
+DRAIN_TIMEOUT = 30.0     # 停止发送后等待积压写完的最长时间 (秒)
+DRAIN_IDLE = 2.0         # 入库数连续该时长不变即视为写完
+
+
+def _tcp_engine(targets, udp_port):
+    router.EXTRA_DEVICE_TARGETS = targets[1:]
+    router.run_tcp_client(*targets[0])
+
+
+def _udp_engine(targets, udp_port):
+    router.run_udp_listener("127.0.0.1", udp_port)
+
+
+# 可测试的采集引擎 {名称: (入口函数, 模拟设备是否使用 UDP)}，新增的采集方式在这里登记即可
+ENGINES = {
+    "tcp": (_tcp_engine, False),
+    "udp": (_udp_engine, True),
+}
+
+
+def _engine_process(engine, work_dir, targets, udp_port, verbose):
+    os.chdir(work_dir)
+    if not verbose:
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    ENGINES[engine][0](targets, udp_port)
+
+
+def written_rows(work_dir):
+    """已写入的原始数据行数 (主库与各分区 AUTOINCREMENT 计数器中的最大值，不随清理减少)"""
+    paths = [os.path.join(work_dir, router.DB_PATH)]
+    paths += [path for _, path in partition.list_partitions(os.path.join(work_dir, partition.PARTITION_DIR))]
+    latest = 0
+    for path in paths:
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=1)
+            try:
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sensor_data'").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            continue
+        if row and row[0]:
+            latest = max(latest, row[0])
+    return latest
+
+
+def _wait_ready(work_dir, process):
+    deadline = time.monotonic() + READY_TIMEOUT
+    db_path = os.path.join(work_dir, router.DB_PATH)
+    while time.monotonic() < deadline and process.is_alive():
+        try:
+            if os.path.exists(db_path) and migrations.current_version(db_path) >= migrations.LATEST_VERSION:
+                time.sleep(0.5)  # 数据库就绪后采集线程还需片刻启动
+                return True
+        except sqlite3.Error:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run_load(engine, rate, duration, device_count=1, fmt="v1", batch=50, faults=None, seed_db=None,
+             work_dir=None, verbose=False, base_port=simulator.DEFAULT_PORT):
+    """执行一次负载测试并返回结果字典"""
+    work_dir = work_dir or tempfile.mkdtemp(prefix="fluent_loadgen_")
+    os.makedirs(os.path.join(work_dir, "db"), exist_ok=True)
+    if seed_db:
+        shutil.copy(seed_db, os.path.join(work_dir, router.DB_PATH))
+
+    uses_udp = ENGINES[engine][1]
+    per_device = rate / device_count
+    targets = [(simulator.DEFAULT_HOST, base_port + i) for i in range(device_count)]
+    device_list = []
+    if not uses_udp:
+        # TCP 模式由上位机主动连接，模拟设备需先开始监听
+        device_list = simulator.start_devices(device_count, per_device, simulator.DEFAULT_HOST, base_port,
+                                              fmt, batch, faults)
+    # 发送数与入库数都从引擎启动前开始累计 (TCP 设备在引擎就绪前已可能开始发送)，两者才能对应
+    base_rows = written_rows(work_dir)
+    process = multiprocessing.Process(target=_engine_process,
+                                      args=(engine, work_dir, targets, UDP_PORT, verbose), daemon=True)
+    process.start()
+    try:
+        if not _wait_ready(work_dir, process):
+            raise RuntimeError("采集引擎未能在限定时间内完成数据库初始化")
+        if uses_udp:
+            device_list = simulator.start_devices(device_count, per_device, fmt=fmt, batch=batch, faults=faults,
+                                                  udp_target=("127.0.0.1", UDP_PORT))
+
+        timeline = []
+        written_at_start = written_rows(work_dir) - base_rows
+        started = time.monotonic()
+        while time.monotonic() - started < duration:
+            time.sleep(1.0)
+            sent = simulator.total_stats(device_list)['samples']
+            written = written_rows(work_dir) - base_rows
+            backlog = max(sent - written, 0)
+            timeline.append((time.monotonic() - started, sent, written, backlog))
+            print(f"  {timeline[-1][0]:>5.1f}s 已发送 {sent:>9} 已入库 {written:>9} "
+                  f"积压 {backlog:>7} ({backlog / rate if rate else 0:.2f} 秒)")
+        elapsed = time.monotonic() - started
+
+        for device in device_list:
+            device.stop()
+        stats = simulator.total_stats(device_list)
+        sent = stats['samples']
+        written_at_end = timeline[-1][2] if timeline else written_at_start
+
+        drain_start = time.monotonic()
+        last_written, last_change = written_rows(work_dir) - base_rows, time.monotonic()
+        while time.monotonic() - drain_start < DRAIN_TIMEOUT and time.monotonic() - last_change < DRAIN_IDLE:
+            time.sleep(0.2)
+            written = written_rows(work_dir) - base_rows
+            if written != last_written:
+                last_written, last_change = written, time.monotonic()
+        drain_seconds = max(last_change - drain_start, 0.0)
+    finally:
+        for device in device_list:
+            device.stop()
+        process.terminate()
+        process.join(5)
+
+    lags = sorted(backlog / rate for _, _, _, backlog in timeline) if rate else [0.0]
+    return {
+        'engine': engine,
+        'format': fmt,
+        'devices': device_count,
+        'offered_rate': rate,
+        'duration': elapsed,
+        'sent': sent,
+        'written': last_written,
+        'sustained_rate': (written_at_end - written_at_start) / elapsed if elapsed else 0.0,
+        'drop_rate': max(sent - last_written, 0) / sent if sent else 0.0,
+        # v1 与序号帧没有校验，注入不完整帧或乱码后可能错位解析出额外的样本
+        'excess': max(last_written - sent, 0),
+        'lag_p50': lags[len(lags) // 2] if lags else 0.0,
+        'lag_p95': lags[min(int(len(lags) * 0.95), len(lags) - 1)] if lags else 0.0,
+        'lag_max': lags[-1] if lags else 0.0,
+        'drain_seconds': drain_seconds,
+        'faults': {key: stats[key] for key in ('partial', 'garbage', 'disconnect', 'stall', 'resent')},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="采集负载测试: 模拟下位机以固定速率发送，统计吞吐量、丢失率与入库延迟")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="tcp", help="被测的采集引擎")
+    parser.add_argument("--rate", type=float, default=1000.0, help="所有设备合计每秒发送的样本数")
+    parser.add_argument("--duration", type=float, default=20.0, help="发送时长 (秒)")
+    parser.add_argument("--port", type=int, default=simulator.DEFAULT_PORT, help="第一台模拟设备的 TCP 端口")
+    parser.add_argument("--db", default=None, help="用作初始数据的数据库文件 (复制到临时目录)，默认从空库开始")
+    parser.add_argument("--keep", action="store_true", help="保留临时工作目录")
+    parser.add_argument("--verbose", action="store_true", help="显示采集引擎的输出")
+    simulator.add_device_arguments(parser)
+    args = parser.parse_args(argv)
+
+    print(f"负载测试: {args.engine} 引擎, {args.devices} 台设备, {args.format} 帧, 合计 {args.rate:.0f} 样本/秒, {args.duration:.0f} 秒")
+    work_dir = tempfile.mkdtemp(prefix="fluent_loadgen_")
+    try:
+        result = run_load(args.engine, args.rate, args.duration, args.devices, args.format, args.batch,
+                          simulator.faults_from_args(args), args.db, work_dir, args.verbose, args.port)
+    except (RuntimeError, OSError) as e:
+        print(f"负载测试失败: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.keep:
+            print(f"工作目录: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"发送 {result['sent']} 个样本, 入库 {result['written']} 个")
+    print(f"持续吞吐量: {result['sustained_rate']:.0f} 样本/秒 (目标 {args.rate:.0f})")
+    print(f"丢失率: {result['drop_rate'] * 100:.2f}%")
+    if result['excess']:
+        print(f"多写入 {result['excess']} 个样本 (错位帧被当作数据写入，v1 与序号帧没有校验)")
+    print(f"入库延迟 (积压/速率): p50 {result['lag_p50']:.2f} 秒, p95 {result['lag_p95']:.2f} 秒, "
+          f"最大 {result['lag_max']:.2f} 秒; 停止发送后 {result['drain_seconds']:.1f} 秒写完")
+    faults = result['faults']
+    if any(faults.values()):
+        print(f"注入故障: 不完整 {faults['partial']}, 乱码 {faults['garbage']}, 断开 {faults['disconnect']}, "
+              f"停顿 {faults['stall']}, 重发 {faults['resent']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
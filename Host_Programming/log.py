@@ -0,0 +1,196 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+# 日志: 各模块通过 get_logger 取得 fluentsensor.<模块名> 日志器，记录只在调用线程中放入有界队列，
+# 格式化与控制台、文件输出都在后台线程 (QueueListener) 中进行，控制台输出缓慢 (如 Windows 控制台) 时不会拖慢采集。
+# 队列满时丢弃新记录 (计入 log_records_dropped)；同一位置的相同消息在时间窗内超过限额后不再输出，
+# 窗口结束后的下一条记录附带省略的条数 (计入 log_records_suppressed)。DEBUG 记录只在排查问题时开启，不限流。
+# 文件日志每行一个 JSON 对象，按大小轮转。
+# 级别配置格式为 "INFO" 或 "router=DEBUG,alarm=WARNING" (未指定模块时设置默认级别)，
+# 可通过环境变量 FLUENT_LOG 或各程序的 --log-level 参数设置，环境变量同样作用于界面启动的采集进程。
+ROOT = "fluentsensor"
+DEFAULT_LEVEL = "INFO"
+LEVELS_ENV = "FLUENT_LOG"
+LOG_DIR = "logs"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 单个日志文件的大小上限
+LOG_BACKUP_COUNT = 5              # 保留的轮转文件数
+QUEUE_SIZE = 10000                # 等待输出的记录数上限
+RATE_LIMIT_WINDOW = 60.0          # 限流时间窗 (秒)
+RATE_LIMIT_BURST = 10             # 同一条消息在时间窗内最多输出的次数
+CONSOLE_FORMAT = "%(asctime)s %(levelname)s [%(module_name)s] %(message)s"
+
+_listener = None
+_queue_handler = None
+_pid = None
+_lock = threading.Lock()
+
+
+def get_logger(name):
+    """模块的日志器，name 为模块名 (不使用 __name__，直接运行脚本时它是 __main__)"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+def parse_levels(text):
+    """解析级别配置，返回 {模块名或 None (默认): 级别}，格式错误时抛出 ValueError"""
+    levels = {}
+    for item in (text or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, level = item.rpartition("=")
+        level = level.strip().upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"未知的日志级别: {level}")
+        levels[name.strip() or None] = level
+    return levels
+
+
+class RateLimitFilter(logging.Filter):
+    """同一位置 (日志器、消息模板) 的记录在 window 秒内最多通过 burst 条，可在多个线程中使用"""
+
+    def __init__(self, window=RATE_LIMIT_WINDOW, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.state = {}  # {(日志器, 模板): [窗口开始时间, 已通过数, 已省略数]}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno <= logging.DEBUG:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self.state.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                self.state[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+        metrics.increment("log_records_suppressed")
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    队列满时丢弃记录而不阻塞调用线程。
+    不在调用线程中格式化消息 (标准 QueueHandler 会)，参数在输出线程中才合并，调用方在记录后不应再修改参数对象。
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        record.module_name = record.name.rpartition(".")[2]
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (此前省略了 {suppressed} 条相同消息)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            'level': record.levelname,
+            'module': record.name.rpartition(".")[2],
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data['suppressed'] = suppressed
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def set_levels(levels):
+    """应用级别配置 ({模块名或 None: 级别}，见 parse_levels)"""
+    for name, level in levels.items():
+        logger = logging.getLogger(ROOT if name is None else f"{ROOT}.{name}")
+        logger.setLevel(level)
+
+
+def setup(name, levels=None, log_dir=LOG_DIR, console=True):
+    """
+    配置本进程的日志输出，文件为 log_dir/<name>.log (JSON 行)。已配置过时只应用 levels。
+    以 fork 方式创建的子进程继承了父进程的配置但没有输出线程，在子进程中调用时重新配置。
+    """
+    global _listener, _queue_handler, _pid
+    with _lock:
+        root = logging.getLogger(ROOT)
+        if _pid == os.getpid():
+            set_levels(levels or {})
+            return
+        if _queue_handler is not None:
+            root.removeHandler(_queue_handler)
+        handlers = []
+        if console and sys.stdout is not None:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(ConsoleFormatter(CONSOLE_FORMAT, "%H:%M:%S"))
+            handlers.append(handler)
+        if log_dir:
+            try:
+                os.makedirs(log_dir, exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    os.path.join(log_dir, f"{name}.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                    encoding="utf-8", delay=True)
+                handler.setFormatter(JsonFormatter())
+                handlers.append(handler)
+            except OSError as e:
+                print(f"无法创建日志目录 {log_dir}: {e}", file=sys.stderr)
+        record_queue = queue.Queue(QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(record_queue)
+        _queue_handler.addFilter(RateLimitFilter())
+        root.addHandler(_queue_handler)
+        root.propagate = False
+        root.setLevel(DEFAULT_LEVEL)
+        _listener = logging.handlers.QueueListener(record_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _pid = os.getpid()
+        try:
+            set_levels(parse_levels(os.environ.get(LEVELS_ENV, "")))
+        except ValueError as e:
+            print(f"环境变量 {LEVELS_ENV} 无效: {e}", file=sys.stderr)
+        set_levels(levels or {})
+    atexit.register(shutdown)
+    # multiprocessing 子进程退出时不执行 atexit，改由其退出清理输出剩余的记录
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=0)
+
+
+def shutdown():
+    """输出队列中剩余的记录并停止输出线程"""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None and _pid == os.getpid():
+        listener.stop()
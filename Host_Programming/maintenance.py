@@ -0,0 +1,174 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import dbconn
+import log
+import metrics
+import retention
+
+DB_PATH = "db/sqlite.db"
+
+CHECK_INTERVAL = 5.0                    # 检查 WAL 大小的间隔 (秒)
+PASSIVE_CHECKPOINT_BYTES = 4 * 1048576  # WAL 超过该大小时执行 PASSIVE 检查点
+TRUNCATE_CHECKPOINT_BYTES = 64 * 1048576  # WAL 超过该大小时尝试 TRUNCATE 检查点，将文件截断为 0
+TRUNCATE_BUSY_TIMEOUT_MS = 200          # TRUNCATE 等待读取端的最长时间，等不到就下次再试，不阻塞入库
+OPTIMIZE_INTERVAL = 6 * 3600.0          # PRAGMA optimize 的间隔 (秒)
+ANALYZE_INTERVAL = 24 * 3600.0          # ANALYZE 的间隔 (秒)
+ANALYSIS_LIMIT = 1000                   # ANALYZE 每个索引最多扫描的行数，限制单次耗时
+VACUUM_MIN_FREE_PAGES = 1024            # 空闲页超过该数量时执行增量回收
+QUIET_SECONDS = 2.0                     # 入库有积压或刚处理完积压后，等待这么久再执行维护
+
+logger = log.get_logger("maintenance")
+
+
+class MaintenanceJob:
+    """
+    数据库维护任务，作为入库线程的后台任务运行 (与入库共用连接，不会与写入争锁)。
+    - 按 WAL 文件大小执行 PASSIVE / TRUNCATE 检查点，防止界面持续轮询时 WAL 无限增长；
+    - 定期执行 PRAGMA optimize 与 ANALYZE (限制扫描行数)；
+    - 空闲页较多时执行增量回收。
+    backlog 为返回入库队列积压样本数的函数 (由 run_tcp_client 设置)，有积压时推迟维护，避开突发写入。
+    每次 step() 最多执行一项操作。
+    """
+
+    def __init__(self, db_path=DB_PATH, check_interval=CHECK_INTERVAL, backlog=None):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.backlog = backlog
+        now = time.monotonic()
+        self.next_check = now
+        self.next_optimize = now + OPTIMIZE_INTERVAL
+        self.next_analyze = now + ANALYZE_INTERVAL
+        self.quiet_since = now
+
+    def _wal_files(self, conn):
+        """返回 [(schema, WAL 文件路径)]，包括附加的分区库"""
+        files = []
+        for _, schema, path in conn.execute("PRAGMA database_list"):
+            if schema != "temp" and path:
+                files.append((schema, path + "-wal"))
+        return files
+
+    def _checkpoint(self, conn, schema, mode):
+        start = time.monotonic()
+        if mode == "TRUNCATE":
+            conn.execute(f"PRAGMA busy_timeout={TRUNCATE_BUSY_TIMEOUT_MS}")
+        try:
+            busy, log_pages, checkpointed = conn.execute(f"PRAGMA {schema}.wal_checkpoint({mode})").fetchone()
+        finally:
+            if mode == "TRUNCATE":
+                conn.execute(f"PRAGMA busy_timeout={dbconn.WRITER_PRAGMAS['busy_timeout']}")
+        elapsed_ms = (time.monotonic() - start) * 1000.0
+        metrics.histogram("checkpoint_" + mode.lower()).observe(elapsed_ms)
+        if busy:
+            logger.warning("WAL 检查点 (%s, %s) 未能完成: 有读取端占用, 已写回 %d/%d 页", schema, mode,
+                           checkpointed, log_pages)
+        return not busy
+
+    def _check_wal(self, conn):
+        for schema, wal_path in self._wal_files(conn):
+            try:
+                size = os.path.getsize(wal_path)
+            except OSError:
+                size = 0
+            metrics.set_gauge(f"wal_bytes_{schema}", size)
+            if size >= TRUNCATE_CHECKPOINT_BYTES:
+                self._checkpoint(conn, schema, "TRUNCATE")
+                return True
+            if size >= PASSIVE_CHECKPOINT_BYTES:
+                self._checkpoint(conn, schema, "PASSIVE")
+                return True
+        return False
+
+    def _optimize(self, conn):
+        start = time.monotonic()
+        conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        conn.execute("PRAGMA optimize")
+        metrics.histogram("optimize").observe((time.monotonic() - start) * 1000.0)
+
+    def _analyze(self, conn):
+        start = time.monotonic()
+        conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE main")
+        conn.commit()
+        metrics.histogram("analyze").observe((time.monotonic() - start) * 1000.0)
+
+    def _vacuum(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return False
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        metrics.set_gauge("freelist_pages", free_pages)
+        if free_pages < VACUUM_MIN_FREE_PAGES:
+            return False
+        start = time.monotonic()
+        # 需要通过 executescript 执行才会一次回收多页，见 RetentionJob._vacuum_chunk
+        conn.executescript(f"PRAGMA incremental_vacuum({retention.VACUUM_PAGES_PER_STEP});")
+        metrics.histogram("incremental_vacuum").observe((time.monotonic() - start) * 1000.0)
+        return True
+
+    def step(self, conn):
+        """执行到期的一项维护操作，返回是否执行了工作"""
+        now = time.monotonic()
+        if self.backlog is not None and self.backlog() > 0:
+            self.quiet_since = now
+            return False
+        if now - self.quiet_since < QUIET_SECONDS:
+            return False
+        try:
+            if now >= self.next_check:
+                self.next_check = now + self.check_interval
+                if self._check_wal(conn):
+                    return True
+                return self._vacuum(conn)
+            if now >= self.next_optimize:
+                self.next_optimize = now + OPTIMIZE_INTERVAL
+                self._optimize(conn)
+                return True
+            if now >= self.next_analyze:
+                self.next_analyze = now + ANALYZE_INTERVAL
+                self._analyze(conn)
+                return True
+        except sqlite3.Error as e:
+            logger.error("数据库维护出错: %s", e)
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 数据库维护工具")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件路径")
+    parser.add_argument("--checkpoint", choices=("PASSIVE", "TRUNCATE"), help="立即执行一次 WAL 检查点")
+    parser.add_argument("--optimize", action="store_true", help="执行 PRAGMA optimize 与 ANALYZE")
+    args = parser.parse_args(argv)
+    log.setup("maintenance", log_dir=None)
+    if not (args.checkpoint or args.optimize):
+        parser.print_help()
+        return 1
+    job = MaintenanceJob(args.db)
+    conn = dbconn.connect_writer(args.db)
+    try:
+        if args.checkpoint:
+            wal_path = args.db + "-wal"
+            before = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+            done = job._checkpoint(conn, "main", args.checkpoint)
+            after = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+            print(f"WAL 检查点 ({args.checkpoint}) {'完成' if done else '未完成'}: "
+                  f"{before / 1048576:.1f} MB -> {after / 1048576:.1f} MB")
+        if args.optimize:
+            job._optimize(conn)
+            job._analyze(conn)
+            print("已执行 PRAGMA optimize 与 ANALYZE")
+        for name, summary in metrics.snapshot().items():
+            print(f"  {name}: {summary['max']:.2f} ms")
+    except sqlite3.Error as e:
+        print(f"数据库维护出错: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
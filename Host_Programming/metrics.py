@@ -0,0 +1,243 @@
+import json
+import queue
+import threading
+import time
+
+# 样本从到达到告警经过的各个阶段 (时间戳均取自 time.monotonic(), 同一台机器上的进程间可直接比较)
+STAGES = ("recv", "decode", "commit", "fetch", "render", "alarm")
+
+# 直方图名称: 相邻阶段之间的耗时, 以及从接收到最后一个阶段的端到端耗时
+STAGE_SPANS = (
+    ("recv_decode", "recv", "decode"),
+    ("decode_commit", "decode", "commit"),
+    ("commit_fetch", "commit", "fetch"),
+    ("fetch_render", "fetch", "render"),
+    ("render_alarm", "render", "alarm"),
+)
+
+
+class Histogram:
+    """对数分桶的直方图，默认记录延迟 (单位为毫秒)；指定 bounds 时记录其他数值 (如批量大小)"""
+
+    BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                 1000, 2500, 5000, 10000, 30000, 60000)
+
+    def __init__(self, name, bounds=None):
+        self.name = name
+        self.is_latency = bounds is None
+        self.bounds = self.BOUNDS_MS if bounds is None else tuple(bounds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.buckets = [0] * (len(self.bounds) + 1)  # 最后一个桶为溢出桶
+            self.count = 0
+            self.total = 0.0
+            self.min = None
+            self.max = None
+
+    def observe(self, value_ms):
+        """记录一次耗时 (或一个数值)"""
+        index = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += value_ms
+            self.min = value_ms if self.min is None else min(self.min, value_ms)
+            self.max = value_ms if self.max is None else max(self.max, value_ms)
+
+    def percentile(self, q):
+        """按桶估算分位数 (返回所在桶的上界，且不超过实测最大值)"""
+        with self._lock:
+            if self.count == 0:
+                return None
+            target = q * self.count
+            seen = 0
+            for i, n in enumerate(self.buckets):
+                seen += n
+                if seen >= target and n:
+                    return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+            return self.max
+
+    def summary(self):
+        """返回用于显示的统计摘要"""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+    def to_dict(self):
+        """返回包含完整分桶的字典，用于导出"""
+        data = self.summary()
+        with self._lock:
+            data['bounds_ms' if self.is_latency else 'bounds'] = list(self.bounds)
+            data['buckets'] = list(self.buckets)
+        return data
+
+    def cumulative(self):
+        """返回 ([(上界, 累计次数)], 总次数, 总和)，与 Prometheus 直方图的 le 分桶对应，溢出桶不含在列表中"""
+        with self._lock:
+            buckets = []
+            seen = 0
+            for bound, n in zip(self.bounds, self.buckets):
+                seen += n
+                buckets.append((bound, seen))
+            return buckets, self.count, self.total
+
+
+# 数量类直方图 (如每批写入的样本数) 的默认分桶
+COUNT_BOUNDS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_registry = {}
+_gauges = {}
+_counters = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name, bounds=None):
+    """获取 (或创建) 指定名称的直方图，bounds 只在首次创建时生效 (省略时为延迟直方图)"""
+    with _registry_lock:
+        hist = _registry.get(name)
+        if hist is None:
+            hist = Histogram(name, bounds)
+            _registry[name] = hist
+        return hist
+
+
+def set_gauge(name, value):
+    """记录一个瞬时值 (如 WAL 文件大小)，只保留最新值"""
+    with _registry_lock:
+        _gauges[name] = value
+
+
+def gauges():
+    """返回所有瞬时值 {名称: 值}"""
+    with _registry_lock:
+        return dict(_gauges)
+
+
+def increment(name, value=1):
+    """累加一个计数器 (如丢包数)，只增不减"""
+    with _registry_lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def counters():
+    """返回所有计数器 {名称: 累计值}"""
+    with _registry_lock:
+        return dict(_counters)
+
+
+def histograms():
+    """返回所有直方图 {名称: Histogram}"""
+    with _registry_lock:
+        return dict(_registry)
+
+
+def snapshot():
+    """返回所有直方图的统计摘要 {名称: 摘要}"""
+    with _registry_lock:
+        items = list(_registry.items())
+    return {name: hist.summary() for name, hist in items}
+
+
+def reset_all():
+    """清空所有直方图"""
+    with _registry_lock:
+        items = list(_registry.values())
+    for hist in items:
+        hist.reset()
+
+
+def dump_metrics(path):
+    """将所有直方图 (含分桶) 导出为JSON文件"""
+    with _registry_lock:
+        items = list(_registry.items())
+    data = {
+        'generated_at': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'histograms': {name: hist.to_dict() for name, hist in items},
+        'gauges': gauges(),
+        'counters': counters(),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def publish_stamps(stamp_queue, row_id, stamps, device_id=None):
+    """由采集进程调用: 将已入库样本 (所属设备 device_id) 的时间戳发送给界面进程，队列满时直接丢弃"""
+    if stamp_queue is None or row_id is None:
+        return
+    try:
+        stamp_queue.put_nowait((row_id, device_id, stamps))
+    except queue.Full:
+        pass
+    except Exception:
+        pass
+
+
+class LatencyTracker:
+    """汇总样本在各阶段的时间戳，样本走完全流程后写入各阶段直方图"""
+
+    def __init__(self, max_pending=5000):
+        self.max_pending = max_pending
+        self.pending = []  # [(row_id, device_id, stamps)]，按 row_id 递增
+
+    def drain(self, stamp_queue):
+        """取出采集进程发来的全部时间戳"""
+        if stamp_queue is None:
+            return
+        while True:
+            try:
+                self.pending.append(stamp_queue.get_nowait())
+            except queue.Empty:
+                break
+            except Exception:
+                break
+        if len(self.pending) > self.max_pending:
+            # 界面长时间未取数时，丢弃最旧的样本，避免无限增长
+            self.pending = self.pending[-self.max_pending:]
+
+    def complete(self, latest_id, fetch_t, render_t, alarm_t=None, device_id=None):
+        """
+        将设备 device_id 中 row_id <= latest_id 的样本标记为已被界面取出并渲染，记录各阶段耗时。
+        界面只取出并显示当前设备的数据，其他设备 row_id <= latest_id 的样本未被显示，丢弃而不计入直方图。
+        """
+        if latest_id is None or not self.pending:
+            return
+        remaining = []
+        for row_id, row_device, stamps in self.pending:
+            if row_id > latest_id:
+                remaining.append((row_id, row_device, stamps))
+                continue
+            if device_id is not None and row_device != device_id:
+                continue
+            stamps = dict(stamps)
+            stamps['fetch'] = fetch_t
+            stamps['render'] = render_t
+            if alarm_t is not None:
+                stamps['alarm'] = alarm_t
+            record_stamps(stamps)
+        self.pending = remaining
+
+
+def record_stamps(stamps):
+    """根据一个样本的阶段时间戳更新直方图"""
+    for name, start, end in STAGE_SPANS:
+        if start in stamps and end in stamps:
+            histogram(name).observe((stamps[end] - stamps[start]) * 1000.0)
+    last_stage = None
+    for stage in STAGES:
+        if stage in stamps:
+            last_stage = stage
+    if 'recv' in stamps and last_stage and last_stage != 'recv':
+        histogram("end_to_end").observe((stamps[last_stage] - stamps['recv']) * 1000.0)
@@ -0,0 +1,404 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import dbconn
+import devices
+import partition
+import rollup
+import sequence
+
+# 数据库结构版本管理: PRAGMA user_version 记录已应用的最新迁移版本。
+# 需要回填数据的迁移按 id 区间分批执行，每批一个短事务，进度保存在 schema_migration_state 表中，
+# 中途退出后下次启动从断点继续；全部批次完成后才更新 user_version。
+# 原始数据表的索引不在迁移中直接创建 (大表上 CREATE INDEX 会长时间占用写锁)，所有迁移完成后由 ensure_indexes 补建。
+DB_PATH = "db/sqlite.db"
+STATUS_PATH = "db/migration_status.json"  # 迁移进度文件，启动画面读取该文件显示进度
+BATCH_ROWS = 20000                        # 每个回填事务处理的行数
+STATUS_INTERVAL = 0.5                     # 进度文件的最短写入间隔 (秒)
+STALE_STATUS_SECONDS = 30.0               # 进度文件超过该时间未更新时视为迁移进程已退出
+INLINE_INDEX_ROWS = 200000                # 原始数据不超过该行数 (按 id 范围估算) 时直接建索引，更大的表分批重建
+REBUILD_TABLE = "sensor_data_rebuild"     # 分批重建时带全部索引的新表
+INDEX_DESCRIPTION = "重建原始数据表索引"
+
+
+class Migration:
+    """
+    迁移基类。prepare() 在一个事务中执行结构变更 (建表、加列等，不要自行提交)，返回是否需要分批回填数据；
+    需要回填的迁移实现 total() 与 run_batch()。
+    """
+    version = 0
+    description = ""
+
+    def prepare(self, conn):
+        return False
+
+    def total(self, conn):
+        return 0
+
+    def run_batch(self, conn, position, batch_rows):
+        """处理 position 之后的一批数据，返回 (新的 position, 处理行数)；position 为 None 表示已完成"""
+        return None, 0
+
+
+class BaseSchema(Migration):
+    version = 1
+    description = "创建原始数据表"
+
+    def prepare(self, conn):
+        # 已发布的迁移不再修改: 这里保留最初版本的表结构，后续变更由新的迁移完成
+        conn.execute("""
+                     CREATE TABLE IF NOT EXISTS sensor_data
+                     (
+                         id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         timestamp DATETIME NOT NULL,
+                         temperature REAL NOT NULL,
+                         humidity REAL NOT NULL,
+                         pm25 INTEGER NOT NULL,
+                         noise INTEGER NOT NULL
+                     )
+                     """)
+        return False
+
+
+class RollupTables(Migration):
+    version = 2
+    description = "创建汇总表并根据已有数据生成"
+
+    def prepare(self, conn):
+        missing = rollup.rollups_missing(conn)
+        rollup.create_rollup_tables(conn)
+        # 汇总表早于分区与归档功能出现，缺少汇总表的旧数据库中原始数据只在主库里
+        return missing and conn.execute("SELECT 1 FROM sensor_data LIMIT 1").fetchone() is not None
+
+    def total(self, conn):
+        return conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+
+    def run_batch(self, conn, position, batch_rows):
+        rows = conn.execute(
+            "SELECT id, timestamp, temperature, humidity, pm25, noise FROM sensor_data "
+            "WHERE id > ? ORDER BY id LIMIT ?", (position, batch_rows)
+        ).fetchall()
+        rollup.apply_rows(conn, [row[1:] + (devices.DEFAULT_DEVICE_ID,) for row in rows])
+        if len(rows) < batch_rows:
+            return None, len(rows)
+        return rows[-1][0], len(rows)
+
+
+def _add_device_column(conn, schema="main"):
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(sensor_data)")]
+    if "device_id" not in columns:
+        # SQLite 添加带常量默认值的列只修改表定义，不改写已有数据行，大表也能立即完成
+        conn.execute(f"ALTER TABLE {schema}.sensor_data "
+                     f"ADD COLUMN device_id INTEGER NOT NULL DEFAULT {devices.DEFAULT_DEVICE_ID}")
+
+
+class DeviceDimension(Migration):
+    version = 3
+    description = "增加设备维度"
+
+    def prepare(self, conn):
+        import router  # router 在启动时调用迁移，这里延迟导入以免循环依赖
+        devices.create_devices_table(conn)
+        # 已有数据都来自原来唯一的下位机，登记为默认设备
+        conn.execute("INSERT OR IGNORE INTO devices (id, name, address) VALUES (?, ?, ?)",
+                     (devices.DEFAULT_DEVICE_ID, devices.DEFAULT_DEVICE_NAME,
+                      f"{router.ESP_TARGET_IP}:{router.ESP_TARGET_PORT}"))
+        _add_device_column(conn)
+        rollup.add_device_dimension(conn)
+        for _, path in partition.list_partitions():
+            part_conn = dbconn.connect_writer(path)
+            try:
+                with part_conn:
+                    _add_device_column(part_conn)
+            finally:
+                part_conn.close()
+        return False
+
+
+def _add_sequence_column(conn, schema="main"):
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(sensor_data)")]
+    if "seq" not in columns:
+        conn.execute(f"ALTER TABLE {schema}.sensor_data ADD COLUMN seq INTEGER")
+
+
+class SequenceNumbers(Migration):
+    version = 4
+    description = "增加帧序号与去重索引"
+
+    def prepare(self, conn):
+        sequence.create_sequence_stats_table(conn)
+        _add_sequence_column(conn)
+        for _, path in partition.list_partitions():
+            part_conn = dbconn.connect_writer(path)
+            try:
+                with part_conn:
+                    _add_sequence_column(part_conn)
+            finally:
+                part_conn.close()
+        return False
+
+
+def _add_device_time_column(conn, schema="main"):
+    columns = [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(sensor_data)")]
+    if "device_time" not in columns:
+        conn.execute(f"ALTER TABLE {schema}.sensor_data ADD COLUMN device_time INTEGER")
+    # 原来的唯一索引以 timestamp 为键，由 ensure_indexes 按新定义重建
+    conn.execute(f"DROP INDEX IF EXISTS {schema}.idx_device_seq")
+
+
+class DeviceTimeKey(Migration):
+    version = 5
+    description = "帧序号去重改用下位机采样时间"
+
+    def prepare(self, conn):
+        # 已有数据的 device_time 为 NULL (唯一索引中互不相等)，只有升级后写入的样本参与新的去重
+        _add_device_time_column(conn)
+        for _, path in partition.list_partitions():
+            part_conn = dbconn.connect_writer(path)
+            try:
+                with part_conn:
+                    _add_device_time_column(part_conn)
+            finally:
+                part_conn.close()
+        return False
+
+
+MIGRATIONS = [BaseSchema(), RollupTables(), DeviceDimension(), SequenceNumbers(), DeviceTimeKey()]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def missing_indexes(conn):
+    """原始数据表缺少的索引名"""
+    import router
+    existing = {row[1] for row in conn.execute("PRAGMA index_list(sensor_data)")}
+    return [name for name in router.SENSOR_INDEXES if name not in existing]
+
+
+def indexes_ready(conn):
+    """原始数据表的索引是否齐全 (且没有未完成的分批重建)"""
+    return not _table_exists(conn, REBUILD_TABLE) and not missing_indexes(conn)
+
+
+def ensure_indexes(conn, progress=None, batch_rows=BATCH_ROWS):
+    """
+    补建原始数据表缺少的索引 (旧版本的数据库、批量导入中断后未重建等情况)，conn 为主库或分区库的连接。
+    小表直接建索引；CREATE INDEX 要在一个事务中扫描排序整张表且无法断点继续，大表改为新建带全部索引的
+    sensor_data_rebuild，按 id 分批把数据行移过去 (每批一个短事务，同时从原表删除，不额外占用磁盘空间)，
+    最后不足一批的数据在删除原表并改名的同一事务中移动，重建期间仍在写入的新数据不会遗漏。
+    中途退出后下次调用从断点继续。重建期间数据分在两张表中，查询结果不完整，应在采集开始前 (router 启动时) 执行。
+    """
+    import router
+    rebuilding = _table_exists(conn, REBUILD_TABLE)
+    if not rebuilding:
+        missing = missing_indexes(conn)
+        if not missing:
+            return
+        low, high = conn.execute("SELECT MIN(id), MAX(id) FROM sensor_data").fetchone()
+        if low is None or high - low < INLINE_INDEX_ROWS:
+            with conn:
+                router.create_sensor_indexes(conn)
+            return
+        print(f"原始数据表缺少索引 {', '.join(missing)}，分批重建")
+        conn.execute("BEGIN")
+        with conn:
+            # 新表的索引沿用原名，先删除原表上的同名索引 (只释放页面，不扫描排序)
+            for name in router.SENSOR_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+            router.create_sensor_table(conn, table=REBUILD_TABLE)
+    start = time.monotonic()
+    columns = ", ".join(row[1] for row in conn.execute("PRAGMA table_info(sensor_data)"))
+    first = (conn.execute(f"SELECT MIN(id) FROM {REBUILD_TABLE}").fetchone()[0]
+             or conn.execute("SELECT MIN(id) FROM sensor_data").fetchone()[0] or 0)
+    last = conn.execute("SELECT MAX(id) FROM sensor_data").fetchone()[0] or first
+    while True:
+        with conn:
+            row = conn.execute("SELECT id FROM sensor_data ORDER BY id LIMIT 1 OFFSET ?", (batch_rows - 1,)).fetchone()
+            if row is None:
+                break
+            conn.execute(f"INSERT INTO {REBUILD_TABLE} ({columns}) SELECT {columns} FROM sensor_data WHERE id <= ?",
+                         row)
+            conn.execute("DELETE FROM sensor_data WHERE id <= ?", row)
+        if progress:
+            progress(LATEST_VERSION, INDEX_DESCRIPTION, row[0] - first + 1, max(last - first + 1, row[0] - first + 1))
+    conn.execute("BEGIN")
+    with conn:
+        conn.execute(f"INSERT INTO {REBUILD_TABLE} ({columns}) SELECT {columns} FROM sensor_data")
+        old_seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sensor_data'").fetchone()
+        conn.execute("DROP TABLE IF EXISTS sensor_data")
+        conn.execute(f"ALTER TABLE {REBUILD_TABLE} RENAME TO sensor_data")
+        if old_seq is not None:
+            # 保持 AUTOINCREMENT 的计数，已删除的最大id不会被重新使用
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'sensor_data'", old_seq)
+    if progress:
+        progress(LATEST_VERSION, INDEX_DESCRIPTION, last - first + 1, last - first + 1)
+    print(f"原始数据表索引重建完成, 耗时 {time.monotonic() - start:.1f} 秒")
+
+
+class StatusFile:
+    """将迁移进度写入 JSON 文件 (先写临时文件再替换)，供启动画面轮询"""
+
+    def __init__(self, path=STATUS_PATH):
+        self.path = path
+        self.last_write = 0.0
+
+    def write(self, state, version=None, description="", done=0, total=0, force=True):
+        now = time.monotonic()
+        if not force and now - self.last_write < STATUS_INTERVAL:
+            return
+        self.last_write = now
+        data = {"state": state, "version": version, "latest": LATEST_VERSION, "description": description,
+                "done": done, "total": total, "updated": time.time()}
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"写入迁移进度失败: {e}")
+
+    def __call__(self, version, description, done, total):
+        self.write("running", version, description, done, total, force=done >= total)
+
+
+def read_status(path=STATUS_PATH):
+    """读取迁移进度，文件不存在或已过期时返回 None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("state") == "running" and time.time() - data.get("updated", 0) > STALE_STATUS_SECONDS:
+        return None
+    return data
+
+
+def current_version(db_path=DB_PATH):
+    """只读方式读取数据库的 user_version，数据库不存在时返回 None"""
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def startup_pending(db_path=DB_PATH):
+    """只读检查启动时是否还有迁移或索引重建要做 (版本落后或索引不齐全)，数据库不存在时返回 False"""
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=5)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0] < LATEST_VERSION or not indexes_ready(conn)
+    finally:
+        conn.close()
+
+
+def migrate(conn, progress=None, batch_rows=BATCH_ROWS):
+    """
+    应用所有未执行的迁移，返回迁移后的版本。
+    progress(版本, 描述, 已处理行数, 总行数) 用于报告回填进度。
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_migration_state "
+                 "(version INTEGER PRIMARY KEY, position INTEGER NOT NULL, done INTEGER NOT NULL, total INTEGER NOT NULL)")
+    conn.commit()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        start = time.monotonic()
+        state = conn.execute("SELECT position, done, total FROM schema_migration_state WHERE version = ?",
+                             (migration.version,)).fetchone()
+        if state is None:
+            conn.execute("BEGIN")  # 建表、加列等语句不会自动开始事务，显式开始以便整个 prepare 原子地生效
+            with conn:
+                needs_batches = migration.prepare(conn)
+                if needs_batches:
+                    state = (0, 0, migration.total(conn))
+                    conn.execute("INSERT INTO schema_migration_state VALUES (?, ?, ?, ?)",
+                                 (migration.version,) + state)
+        else:
+            print(f"继续未完成的数据库迁移 v{migration.version} ({migration.description}): {state[1]}/{state[2]} 行")
+        if state is not None:
+            position, done, total = state
+            while position is not None:
+                with conn:
+                    position, rows = migration.run_batch(conn, position, batch_rows)
+                    done += rows
+                    if position is not None:
+                        conn.execute("UPDATE schema_migration_state SET position = ?, done = ? WHERE version = ?",
+                                     (position, done, migration.version))
+                if progress:
+                    progress(migration.version, migration.description, min(done, total), total)
+        with conn:
+            conn.execute("DELETE FROM schema_migration_state WHERE version = ?", (migration.version,))
+            conn.execute(f"PRAGMA user_version={migration.version}")
+        version = migration.version
+        print(f"数据库迁移 v{migration.version} ({migration.description}) 完成, "
+              f"耗时 {time.monotonic() - start:.1f} 秒")
+    ensure_indexes(conn, progress, batch_rows)
+    for _, path in partition.list_partitions():
+        part_conn = dbconn.connect_writer(path)
+        try:
+            ensure_indexes(part_conn, batch_rows=batch_rows)
+        finally:
+            part_conn.close()
+    return version
+
+
+def run_startup_migrations(db_path=DB_PATH, status_path=STATUS_PATH):
+    """router 启动时调用: 执行迁移并把进度写入进度文件"""
+    status = StatusFile(status_path)
+    conn = dbconn.connect_writer(db_path)
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= LATEST_VERSION and indexes_ready(conn):
+            return LATEST_VERSION
+        status.write("running", description="检查数据库结构")
+        try:
+            version = migrate(conn, progress=status)
+        except sqlite3.Error:
+            status.write("failed")
+            raise
+        status.write("done", version)
+        return version
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 数据库结构迁移")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件路径")
+    parser.add_argument("--run", action="store_true", help="执行所有未应用的迁移")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="每个回填事务处理的行数")
+    args = parser.parse_args(argv)
+    try:
+        if args.run:
+            conn = dbconn.connect_writer(args.db)
+            try:
+                started = time.monotonic()
+
+                def report(version, description, done, total):
+                    rate = done / max(time.monotonic() - started, 1e-6)
+                    print(f"v{version} {description}: {done}/{total} 行 ({rate:.0f} 行/秒)")
+
+                migrate(conn, progress=report, batch_rows=args.batch_rows)
+            finally:
+                conn.close()
+        version = current_version(args.db)
+        print(f"数据库版本: {version} (最新 {LATEST_VERSION})")
+    except sqlite3.Error as e:
+        print(f"数据库迁移出错: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+# 存储模式: "single" 全部写入 db/sqlite.db；"day"/"month" 原始数据按天/按月写入独立的分区文件，
+# 汇总表仍保存在主库中。读取端总是同时查询主库与存在的分区文件，因此切换模式不影响已有数据。
+STORAGE_MODE = "single"
+PARTITION_DIR = "db/partitions"
+MAX_ATTACHED = 8  # SQLite 默认最多同时附加 10 个数据库，这里留出余量
+
+_FILE_PATTERN = re.compile(r"^sensor_(\d{4}-\d{2}(?:-\d{2})?)\.db$")
+
+
+def partition_key(timestamp, mode=None):
+    """根据 'YYYY-MM-DD HH:MM:SS' 时间戳计算分区键 ('YYYY-MM-DD' 或 'YYYY-MM')"""
+    mode = mode or STORAGE_MODE
+    if mode == "day":
+        return timestamp[:10]
+    if mode == "month":
+        return timestamp[:7]
+    raise ValueError(f"存储模式 {mode} 不使用分区")
+
+
+def partition_path(key, partition_dir=None):
+    return os.path.join(partition_dir or PARTITION_DIR, f"sensor_{key}.db")
+
+
+def key_bounds(key):
+    """返回分区覆盖的时间范围 (起始, 结束) 字符串"""
+    if len(key) == 10:
+        return f"{key} 00:00:00", f"{key} 23:59:59"
+    start = datetime.strptime(key + "-01", "%Y-%m-%d")
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    last_day = next_month - timedelta(days=1)
+    return f"{key}-01 00:00:00", last_day.strftime("%Y-%m-%d") + " 23:59:59"
+
+
+def list_partitions(partition_dir=None):
+    """返回已存在的分区 [(key, path)]，按时间先后排序"""
+    partition_dir = partition_dir or PARTITION_DIR
+    if not os.path.isdir(partition_dir):
+        return []
+    partitions = []
+    for name in os.listdir(partition_dir):
+        match = _FILE_PATTERN.match(name)
+        if match:
+            partitions.append((match.group(1), os.path.join(partition_dir, name)))
+    partitions.sort(key=lambda item: key_bounds(item[0])[0])
+    return partitions
+
+
+def partitions_for_range(start_str, end_str, partition_dir=None):
+    """返回与时间范围有交集的分区 [(key, path)]"""
+    selected = []
+    for key, path in list_partitions(partition_dir):
+        key_start, key_end = key_bounds(key)
+        if key_start <= end_str and key_end >= start_str:
+            selected.append((key, path))
+    return selected
+
+
+def remove_partition(path):
+    """删除分区文件 (连同 WAL 与共享内存文件)，返回删除的字节数"""
+    removed = 0
+    for suffix in ("", "-wal", "-shm"):
+        file_path = path + suffix
+        if os.path.exists(file_path):
+            removed += os.path.getsize(file_path)
+            os.remove(file_path)
+    return removed
+
+
+def query_partitions(conn, partitions, sql, params, descending=False):
+    """
+    依次附加分区并执行查询。
+    sql 中用 {table} 代表数据表，每组最多同时附加 MAX_ATTACHED 个分区；
+    分区之间时间不重叠，按分区顺序拼接各自有序的结果即可保持整体有序。
+    """
+    ordered = list(reversed(partitions)) if descending else list(partitions)
+    results = []
+    for i in range(0, len(ordered), MAX_ATTACHED):
+        group = ordered[i:i + MAX_ATTACHED]
+        aliases = []
+        try:
+            for j, (_, path) in enumerate(group):
+                alias = f"p{j}"
+                conn.execute("ATTACH DATABASE ? AS " + alias, (path,))
+                aliases.append(alias)
+            for alias in aliases:
+                results.extend(conn.execute(sql.format(table=f"{alias}.sensor_data"), params).fetchall())
+        finally:
+            for alias in aliases:
+                conn.execute("DETACH DATABASE " + alias)
+    return results
@@ -0,0 +1,65 @@
+import time
+from datetime import datetime, timedelta
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# 历史回放: 以虚拟时钟代替当前时间，按倍速从 start 走到 end。
+# 主窗口在回放期间用虚拟时间作为"现在"，沿实时刷新相同的路径 (update_all_data) 查询、渲染并检查警报。
+MIN_SPEED = 1
+MAX_SPEED = 1000
+FRAME_INTERVAL_MS = 50  # 回放时界面刷新的间隔 (毫秒)，每次刷新虚拟时间前进 间隔 × 倍速
+SPEED_OPTIONS = (1, 10, 60, 100, 300, 1000)
+
+
+class ReplayClock(QObject):
+    """
+    回放用的虚拟时钟。虚拟时间按真实经过的时间 × 倍速前进 (而不是按定时器次数)，
+    界面渲染变慢时回放不会随之变慢，只是每帧前进得更多。
+    """
+    advanced = pyqtSignal()   # 虚拟时间前进，需要刷新界面
+    finished = pyqtSignal()   # 到达回放终点
+
+    def __init__(self, start, end, speed=1, frame_interval_ms=FRAME_INTERVAL_MS, parent=None):
+        super().__init__(parent)
+        if end <= start:
+            raise ValueError("回放的结束时间必须晚于开始时间")
+        self.start = start
+        self.end = end
+        self.speed = 1
+        self.set_speed(speed)
+        self.frames = 0
+        self._position = start
+        self._last_tick = None
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, frame_interval_ms))
+        self._timer.timeout.connect(self._tick)
+
+    def set_speed(self, speed):
+        self.speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+
+    def now(self) -> datetime:
+        return self._position
+
+    def progress(self) -> float:
+        return (self._position - self.start) / (self.end - self.start)
+
+    def is_running(self) -> bool:
+        return self._timer.isActive()
+
+    def resume(self):
+        self._last_tick = time.monotonic()
+        self._timer.start()
+
+    def pause(self):
+        self._timer.stop()
+
+    def _tick(self):
+        now = time.monotonic()
+        elapsed = now - self._last_tick
+        self._last_tick = now
+        self._position = min(self._position + timedelta(seconds=elapsed * self.speed), self.end)
+        self.frames += 1
+        self.advanced.emit()
+        if self._position >= self.end:
+            self._timer.stop()
+            self.finished.emit()
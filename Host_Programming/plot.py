@@ -4,6 +4,7 @@ from PyQt5.QtGui import QFont, QColor, QLinearGradient, QPen, QBrush
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel
 from qfluentwidgets import BodyLabel, SingleDirectionScrollArea, isDarkTheme, CardWidget, FluentStyleSheet
 import pyqtgraph as pg
+from device_selector import DeviceSelector
 from datetime import datetime
 
 
@@ -516,6 +517,10 @@ class PlotsWidget(QWidget):
         self.title_label.setFont(QFont("Segoe UI", 22))
         layout.addWidget(self.title_label)
 
+        # 设备选择 (只有一个设备时隐藏)
+        self.device_selector = DeviceSelector(self)
+        layout.addWidget(self.device_selector)
+
         # 滚动区域
         self.scroll_area = SingleDirectionScrollArea(self)
         self.scroll_area.setWidgetResizable(True)
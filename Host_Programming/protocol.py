@@ -0,0 +1,195 @@
+import struct
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+# 下位机帧格式 (多字节字段均为大端):
+#   v1     AA BB CC DD | 温度 int16 (0.1°C) | 湿度 uint16 (0.1%) | PM2.5 uint16 | 噪声 uint8          共 11 字节
+#   序号帧 AA BB CC DE | 序号 uint32 | 采样时间 uint32 (Unix 秒) | 同 v1 的 7 字节数据             共 19 字节
+#   v2     AA BB CC E2 | 版本 uint8 (=2) | 标志 uint8 | 样本数 uint16 | 样本 × N | CRC32 uint32
+#          每个样本 15 字节: 序号 uint32 | 采样时间 uint32 | 温度 int16 | 湿度 uint16 | PM2.5 uint16 | 噪声 uint8
+#          CRC32 (与 zlib.crc32 相同的多项式) 覆盖版本字段到最后一个样本。
+# 一帧携带多个样本时头部开销被均摊，样本用 numpy 结构化数组整批解析。
+PACKET_HEADER = b'\xAA\xBB\xCC\xDD'
+PACKET_SIZE = 11
+SEQ_PACKET_HEADER = b'\xAA\xBB\xCC\xDE'
+SEQ_PACKET_SIZE = 19
+V2_HEADER = b'\xAA\xBB\xCC\xE2'
+V2_VERSION = 2
+V2_PREFIX_SIZE = 8         # 头部 + 版本 + 标志 + 样本数
+V2_MAX_RECORDS = 1024      # 单帧样本数上限，超过视为损坏的长度字段
+V2_RECORD_DTYPE = np.dtype([('seq', '>u4'), ('time', '>u4'), ('temperature', '>i2'),
+                            ('humidity', '>u2'), ('pm25', '>u2'), ('noise', 'u1')])
+V2_RECORD_SIZE = V2_RECORD_DTYPE.itemsize
+FRAME_SIZES = {PACKET_HEADER: PACKET_SIZE, SEQ_PACKET_HEADER: SEQ_PACKET_SIZE}  # 定长帧
+MIN_DEVICE_TIME = 1577836800   # 早于 2020-01-01 的采样时间视为下位机时钟未校准，改用上位机接收时间
+
+_V2_PREFIX = struct.Struct('>4sBBH')
+_V2_CRC = struct.Struct('>I')
+
+
+def unpack_data(packet_bytes):
+    expected_len = PACKET_SIZE
+    if len(packet_bytes) != expected_len:
+        raise ValueError(f"无效的数据包长度. 期望 {expected_len}, 收到 {len(packet_bytes)}.")
+    header = packet_bytes[:4]
+    if header != PACKET_HEADER:
+        raise ValueError(f"无效的头部. 期望 b'\\xAA\\xBB\\xCC\\xDD', 收到 {header.hex()}.")
+    return _unpack_payload(packet_bytes[4:11])
+
+
+def unpack_seq_data(packet_bytes):
+    """解析序号帧，返回的样本附带 seq 与 device_time；下位机时钟有效时以采样时间作为 timestamp"""
+    if len(packet_bytes) != SEQ_PACKET_SIZE:
+        raise ValueError(f"无效的数据包长度. 期望 {SEQ_PACKET_SIZE}, 收到 {len(packet_bytes)}.")
+    header = packet_bytes[:4]
+    if header != SEQ_PACKET_HEADER:
+        raise ValueError(f"无效的头部. 期望 {SEQ_PACKET_HEADER.hex()}, 收到 {header.hex()}.")
+    seq, device_time = struct.unpack('>II', packet_bytes[4:12])
+    data = _unpack_payload(packet_bytes[12:19])
+    data['seq'] = seq
+    data['device_time'] = device_time
+    if device_time >= MIN_DEVICE_TIME:
+        data['timestamp'] = datetime.fromtimestamp(device_time).strftime("%Y-%m-%d %H:%M:%S")
+    return data
+
+
+def _unpack_payload(data_payload):
+    try:
+        temperature = struct.unpack('>h', data_payload[0:2])[0] / 10.0
+        humidity = struct.unpack('>H', data_payload[2:4])[0] / 10.0
+        pm25 = struct.unpack('>H', data_payload[4:6])[0]
+        noise = struct.unpack('>B', data_payload[6:7])[0]
+    except struct.error as e:
+        raise ValueError(f"解析数据负载时出错: {e}. 负载: {data_payload.hex()}")
+
+    return {
+        "temperature": temperature,
+        "humidity": humidity,
+        "pm25": pm25,
+        "noise": noise
+    }
+
+
+def v2_frame_size(prefix):
+    """根据 v2 帧的前 8 字节返回整帧长度，版本或样本数不合法时返回 None"""
+    _, version, _, count = _V2_PREFIX.unpack(bytes(prefix[:V2_PREFIX_SIZE]))
+    if version != V2_VERSION or not 0 < count <= V2_MAX_RECORDS:
+        return None
+    return V2_PREFIX_SIZE + count * V2_RECORD_SIZE + _V2_CRC.size
+
+
+def _v2_crc(frame, size):
+    """返回 v2 帧中记录的 CRC 与按内容计算的 CRC"""
+    expected_crc = _V2_CRC.unpack_from(frame, size - _V2_CRC.size)[0]
+    return expected_crc, zlib.crc32(memoryview(frame)[4:size - _V2_CRC.size])
+
+
+def v2_crc_ok(frame, size):
+    """frame 开头 size 字节 (v2_frame_size 的结果) 的 CRC 是否正确"""
+    expected_crc, actual_crc = _v2_crc(frame, size)
+    return expected_crc == actual_crc
+
+
+def decode_v2(frame):
+    """校验 CRC 后整批解析 v2 帧，返回样本列表 (字段同序号帧)"""
+    size = v2_frame_size(frame) if len(frame) >= V2_PREFIX_SIZE else None
+    if size is None or len(frame) != size:
+        raise ValueError(f"无效的 v2 帧长度: {len(frame)} 字节")
+    expected_crc, actual_crc = _v2_crc(frame, size)
+    if actual_crc != expected_crc:
+        raise ValueError(f"v2 帧 CRC 校验失败: 期望 {expected_crc:08x}, 计算得 {actual_crc:08x}")
+    count = (size - V2_PREFIX_SIZE - _V2_CRC.size) // V2_RECORD_SIZE
+    records = np.frombuffer(frame, dtype=V2_RECORD_DTYPE, count=count, offset=V2_PREFIX_SIZE)
+
+    times = records['time']
+    timestamps = _local_timestamps(times)
+
+    samples = []
+    for seq, device_time, timestamp, temperature, humidity, pm25, noise in zip(
+            records['seq'].tolist(), times.tolist(), timestamps,
+            (records['temperature'] / 10.0).tolist(), (records['humidity'] / 10.0).tolist(),
+            records['pm25'].tolist(), records['noise'].tolist()):
+        data = {"temperature": temperature, "humidity": humidity, "pm25": pm25, "noise": noise,
+                "seq": seq, "device_time": device_time}
+        if timestamp is not None:
+            data['timestamp'] = timestamp
+        samples.append(data)
+    return samples
+
+
+def _local_timestamps(times):
+    """将一批 Unix 秒整批格式化为本地时间字符串，时钟未校准的样本为 None"""
+    first, last = int(times.min()), int(times.max())
+    offset = time.localtime(first).tm_gmtoff
+    if offset != time.localtime(last).tm_gmtoff:
+        # 帧内跨越夏令时切换，逐个按本地时间格式化
+        return [datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") if t >= MIN_DEVICE_TIME else None
+                for t in times.tolist()]
+    local = (times.astype(np.int64) + offset).astype('datetime64[s]')
+    labels = np.char.replace(np.datetime_as_string(local), 'T', ' ').tolist()
+    if first < MIN_DEVICE_TIME:
+        labels = [label if t >= MIN_DEVICE_TIME else None for label, t in zip(labels, times.tolist())]
+    return labels
+
+
+def split_frames(data):
+    """将一个数据报 (UDP) 切分为完整的帧；数据报内不做重新对齐，任何一帧不完整或头部无法识别时抛出 ValueError"""
+    frames = []
+    pos = 0
+    while pos < len(data):
+        header = bytes(data[pos:pos + 4])
+        size = FRAME_SIZES.get(header)
+        if header == V2_HEADER and len(data) - pos >= V2_PREFIX_SIZE:
+            size = v2_frame_size(data[pos:pos + V2_PREFIX_SIZE])
+        if size is None or pos + size > len(data):
+            raise ValueError(f"数据报第 {pos} 字节处的帧无效 (数据报共 {len(data)} 字节)")
+        frames.append(data[pos:pos + size])
+        pos += size
+    return frames
+
+
+def decode_frames(frame):
+    """按头部自动识别帧格式，返回其中的样本列表 (v1 与序号帧各一个样本)"""
+    header = bytes(frame[:4])
+    if header == V2_HEADER:
+        return decode_v2(frame)
+    if header == SEQ_PACKET_HEADER:
+        return [unpack_seq_data(frame)]
+    return [unpack_data(frame)]
+
+
+def _payload(sample):
+    return struct.pack('>hHHB', int(round(sample['temperature'] * 10)), int(round(sample['humidity'] * 10)),
+                       int(sample['pm25']), int(sample['noise']))
+
+
+def encode_v1(sample):
+    """模拟下位机: 编码一个 v1 帧"""
+    return PACKET_HEADER + _payload(sample)
+
+
+def encode_seq(sample, seq, device_time):
+    """模拟下位机: 编码一个序号帧"""
+    return SEQ_PACKET_HEADER + struct.pack('>II', seq, device_time) + _payload(sample)
+
+
+def encode_v2(samples, first_seq, device_times):
+    """
+    模拟下位机: 将一批样本编码为一个 v2 帧，序号从 first_seq 连续递增。
+    device_times 为每个样本的采样时间 (Unix 秒) 列表。
+    """
+    count = len(samples)
+    if not 0 < count <= V2_MAX_RECORDS:
+        raise ValueError(f"v2 帧样本数必须在 1..{V2_MAX_RECORDS} 之间，收到 {count}")
+    records = np.empty(count, dtype=V2_RECORD_DTYPE)
+    records['seq'] = (np.arange(count, dtype=np.uint64) + first_seq) % (2 ** 32)
+    records['time'] = device_times
+    records['temperature'] = np.round([s['temperature'] * 10 for s in samples])
+    records['humidity'] = np.round([s['humidity'] * 10 for s in samples])
+    records['pm25'] = [s['pm25'] for s in samples]
+    records['noise'] = [s['noise'] for s in samples]
+    body = _V2_PREFIX.pack(V2_HEADER, V2_VERSION, 0, count)[4:] + records.tobytes()
+    return V2_HEADER + body + _V2_CRC.pack(zlib.crc32(body))
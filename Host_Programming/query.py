@@ -0,0 +1,129 @@
+import archive
+import partition
+import rollup
+
+RESOLUTIONS = ("raw", "1m", "1h", "1d")
+
+# 自动选择分辨率时，各分辨率可覆盖的最大时间跨度 (秒)，超过后使用更粗的汇总表
+AUTO_RESOLUTION_LIMITS = (
+    ("raw", 3 * 3600),
+    ("1m", 3 * 86400),
+    ("1h", 90 * 86400),
+)
+
+RAW_COLUMNS = "timestamp, temperature, humidity, pm25, noise, id, device_id"
+
+
+def pick_resolution(span_seconds):
+    """根据查询的时间跨度选择合适的数据分辨率"""
+    for resolution, limit in AUTO_RESOLUTION_LIMITS:
+        if span_seconds <= limit:
+            return resolution
+    return "1d"
+
+
+def _device_filter(device_id):
+    """指定设备时按 (device_id, timestamp) 索引范围扫描，否则使用时间索引"""
+    if device_id is None:
+        return "", ()
+    return "device_id = ? AND ", (device_id,)
+
+
+def fetch_raw(conn, start_str, end_str, descending=False, device_id=None):
+    """
+    查询原始数据，conn 为主库连接，device_id 为 None 时返回所有设备的数据。
+    依次读取主库中的 sensor_data、时间范围涉及的分区文件 (只附加这些分区) 与冷数据归档，
+    调用方无需关心数据位于哪一层。
+    """
+    order = "DESC" if descending else "ASC"
+    device_sql, device_params = _device_filter(device_id)
+    sql = (f"SELECT {RAW_COLUMNS} FROM {{table}} "
+           f"WHERE {device_sql}timestamp BETWEEN ? AND ? ORDER BY timestamp {order}")
+    params = device_params + (start_str, end_str)
+    sources = [conn.execute(sql.format(table="main.sensor_data"), params).fetchall()]
+    partitions = partition.partitions_for_range(start_str, end_str)
+    if partitions:
+        sources.append(partition.query_partitions(conn, partitions, sql, params, descending))
+    sources.append(archive.read_rows(start_str, end_str, descending, device_id))
+    sources = [rows for rows in sources if rows]
+    if len(sources) <= 1:
+        return sources[0] if sources else []
+    # 切换存储模式或归档前写入主库的数据可能与其他层时间重叠，需要重新排序
+    merged = [row for rows in sources for row in rows]
+    return sorted(merged, key=lambda row: row[0], reverse=descending)
+
+
+def fetch_latest(conn, device_id=None, before=None):
+    """
+    查询最新的一条原始数据 (主库与最新分区中较新的一条)，无数据时返回 None。
+    before: 只查询不晚于该时间的数据 (历史回放时的"当前时间")。
+    """
+    device_sql, params = _device_filter(device_id)
+    if before is not None:
+        device_sql += "timestamp <= ? AND "
+        params += (before,)
+    where = f"WHERE {device_sql[:-len(' AND ')]} " if device_sql else ""
+    sql = f"SELECT {RAW_COLUMNS} FROM {{table}} {where}ORDER BY timestamp DESC LIMIT 1"
+    candidates = conn.execute(sql.format(table="main.sensor_data"), params).fetchall()
+    if before is None:
+        partitions = partition.list_partitions()
+        archives = archive.list_archives()
+    else:
+        partitions = partition.partitions_for_range("", before)
+        archives = archive.archives_for_range("", before)
+    if partitions:
+        candidates += partition.query_partitions(conn, partitions[-1:], sql, params)
+    if not candidates and archives:
+        with archive.ArchiveReader(archives[-1][1]) as reader:
+            candidates = reader.read_rows(end_str=before, device_id=device_id)[-1:]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda row: row[0])
+
+
+def fetch_range(conn, start_str, end_str, resolution="raw", descending=False, device_id=None):
+    """
+    查询时间范围内的数据，device_id 为 None 时返回所有设备的数据。
+    返回 [(timestamp, temperature, humidity, pm25, noise, id, device_id), ...]；
+    汇总分辨率下 timestamp 为时间桶起点，各通道取均值，id 为 None；不指定设备时按记录数加权合并各设备，device_id 为 None。
+    """
+    if resolution == "raw":
+        return fetch_raw(conn, start_str, end_str, descending, device_id)
+    table = rollup.ROLLUP_TABLES.get(resolution)
+    if table is None:
+        raise ValueError(f"未知的数据分辨率: {resolution}")
+    order = "DESC" if descending else "ASC"
+    params = (rollup.bucket_of(start_str, resolution), end_str)
+    if device_id is not None:
+        return conn.execute(
+            "SELECT bucket, temperature_mean, humidity_mean, pm25_mean, noise_mean, NULL, device_id "
+            f"FROM {table} WHERE device_id = ? AND bucket BETWEEN ? AND ? ORDER BY bucket {order}",
+            (device_id,) + params
+        ).fetchall()
+    means = ", ".join(f"SUM({c}_mean * count) / SUM(count)" for c in rollup.CHANNELS)
+    return conn.execute(
+        f"SELECT bucket, {means}, NULL, NULL "
+        f"FROM {table} WHERE bucket BETWEEN ? AND ? GROUP BY bucket ORDER BY bucket {order}",
+        params
+    ).fetchall()
+
+
+def max_row_id(conn):
+    """主库与最新分区中最大的原始数据id (新写入的数据id全局递增)，无数据时返回0"""
+    max_id = conn.execute("SELECT MAX(id) FROM main.sensor_data").fetchone()[0] or 0
+    partitions = partition.list_partitions()
+    if partitions:
+        rows = partition.query_partitions(conn, partitions[-1:], "SELECT MAX(id) FROM {table}", ())
+        max_id = max(max_id, rows[0][0] or 0)
+    return max_id
+
+
+def fetch_after(conn, last_id, limit):
+    """查询id大于 last_id 的原始数据 (主库与最新分区)，按id升序最多返回 limit 条，用于跟踪新写入的数据"""
+    sql = f"SELECT {RAW_COLUMNS} FROM {{table}} WHERE id > ? ORDER BY id LIMIT ?"
+    rows = conn.execute(sql.format(table="main.sensor_data"), (last_id, limit)).fetchall()
+    partitions = partition.list_partitions()
+    if partitions:
+        rows += partition.query_partitions(conn, partitions[-1:], sql, (last_id, limit))
+        rows.sort(key=lambda row: row[5])
+    return rows[:limit]
@@ -0,0 +1,182 @@
+import argparse
+import hashlib
+import json
+import queue
+import sqlite3
+import sys
+import time
+
+import capture
+import dbconn
+import devices
+import log
+import metrics
+import protocol
+import router
+import sequence
+
+# 回放 router.py 录制的原始字节流 (见 capture.py): 按录制时的到达时间间隔 (可加速) 或尽快地
+# 将数据重新送入与实时采集相同的分帧、解析与入库流程。没有采样时间的样本以录制时的到达时间作为时间戳，
+# 因此同一录制文件每次回放得到的样本完全相同，可用摘要 (--verify) 检查解析结果是否发生变化。
+REPLAY_MAX_BACKLOG = 50000  # 入库队列积压超过该样本数时暂停回放，避免尽快回放时内存无限增长
+
+
+class ReplaySink:
+    """代替入库线程接收解析出的样本: 计算摘要并计数，writer 不为 None 时转交给它入库"""
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.samples = writer.samples if writer is not None else queue.Queue()
+        self.addresses = {}  # {设备id: 来源地址}，摘要使用地址而不是与数据库有关的设备id
+        self.digest = hashlib.sha256()
+        self.count = 0
+
+    def submit(self, data, stamps=None):
+        record = {key: value for key, value in data.items() if key != 'device_id'}
+        record['source'] = self.addresses[data['device_id']]
+        self.digest.update(json.dumps(record, sort_keys=True).encode("utf-8"))
+        self.count += 1
+        if self.writer is not None:
+            self.writer.submit(data, stamps)
+
+
+def _wait_backlog(sink):
+    while sink.samples.qsize() > REPLAY_MAX_BACKLOG:
+        time.sleep(0.01)
+
+
+def replay(path, speed=1.0, db_path=None):
+    """
+    回放录制文件并返回统计字典。speed 为回放倍速，None 表示尽快回放；
+    db_path 为 None 时只分帧与解析，不入库 (用于测量解析吞吐量)。
+    """
+    header, records = capture.read_capture(path)
+    started_wall = header['started']
+
+    conn = writer = None
+    if db_path is not None:
+        router.DB_PATH = db_path
+        router.connect_to_db()
+        conn = dbconn.connect_writer(db_path)
+        # 回放不运行数据保留、备份等后台任务，只测量入库本身
+        writer = router.IngestWriter(db_path)
+        writer.start()
+    sink = ReplaySink(writer)
+
+    readers = {}   # {来源地址: FrameReader}
+    trackers = {}  # {来源地址: SequenceTracker}
+    stats = {'records': 0, 'bytes': 0, 'frames': 0, 'invalid': 0, 'datagrams_malformed': 0}
+
+    def device_for(address):
+        if address not in trackers:
+            if conn is not None:
+                with conn:
+                    device_id = devices.register_device(conn, address)
+            else:
+                device_id = len(trackers) + 1
+            sink.addresses[device_id] = address
+            trackers[address] = sequence.SequenceTracker(device_id)
+        return trackers[address]
+
+    def submit_frame(frame, tracker, address, arrival_time):
+        stats['frames'] += 1
+        if router.handle_frame(frame, tracker.device_id, tracker, sink, time.monotonic(), address,
+                               arrival_time, verbose=False) is None:
+            stats['invalid'] += 1
+
+    offset = 0.0
+    t0 = time.monotonic()
+    try:
+        for kind, address, offset, payload in records:
+            if speed is not None:
+                delay = t0 + offset / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            if writer is not None:
+                _wait_backlog(sink)
+            stats['records'] += 1
+            stats['bytes'] += len(payload)
+            arrival_time = started_wall + offset
+            if kind == capture.OPEN:
+                # 新连接从空缓冲区开始分帧，与实时采集一致
+                readers[address] = router.FrameReader(source=address)
+            elif kind == capture.CLOSE:
+                readers.pop(address, None)
+            elif kind == capture.DATA:
+                tracker = device_for(address)
+                reader = readers.setdefault(address, router.FrameReader(source=address))
+                reader.feed(payload)
+                frame = reader.pop_frame()
+                while frame is not None:
+                    submit_frame(frame, tracker, address, arrival_time)
+                    frame = reader.pop_frame()
+            elif kind == capture.DATAGRAM:
+                tracker = device_for(address)
+                try:
+                    frames = protocol.split_frames(payload)
+                except ValueError as e:
+                    stats['datagrams_malformed'] += 1
+                    print(f"UDP 数据报无效 (来自 {address}): {e}")
+                    continue
+                for frame in frames:
+                    submit_frame(frame, tracker, address, arrival_time)
+        feed_seconds = time.monotonic() - t0
+        if writer is not None:
+            writer.stop(timeout=None)
+    finally:
+        if conn is not None:
+            conn.close()
+    elapsed = time.monotonic() - t0
+
+    stats.update({
+        'samples': sink.count,
+        'sources': len(trackers),
+        'capture_seconds': offset,
+        'feed_seconds': feed_seconds,
+        'elapsed': elapsed,
+        'rate': sink.count / elapsed if elapsed else 0.0,
+        'resync_bytes': metrics.counters().get("frame_resync_bytes", 0),
+        'digest': sink.digest.hexdigest(),
+    })
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回放 router.py 录制的原始字节流 (回归测试与基准测试)")
+    parser.add_argument("capture", help="录制文件路径")
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument("--speed", type=float, default=1.0, help="回放倍速，1 为按录制时的实际间隔")
+    pace.add_argument("--fast", action="store_true", help="不等待，尽快回放")
+    parser.add_argument("--db", default=None,
+                        help="写入的数据库文件 (请勿使用正在采集的数据库)，省略时只解析不入库")
+    parser.add_argument("--verify", metavar="DIGEST", default=None,
+                        help="与期望的样本摘要比较，不一致时返回非零退出码")
+    args = parser.parse_args(argv)
+    if not args.fast and args.speed <= 0:
+        parser.error("--speed 必须大于 0")
+    log.setup("replay", log_dir=None)
+
+    try:
+        stats = replay(args.capture, None if args.fast else args.speed, args.db)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"回放失败: {e}", file=sys.stderr)
+        return 1
+
+    print(f"回放 {stats['records']} 条记录 ({stats['bytes']} 字节, {stats['sources']} 个来源), "
+          f"录制时长 {stats['capture_seconds']:.1f} 秒")
+    print(f"帧 {stats['frames']} 个 (无效 {stats['invalid']}), 样本 {stats['samples']} 个, "
+          f"无效数据报 {stats['datagrams_malformed']}, 重新对齐丢弃 {stats['resync_bytes']} 字节")
+    target = f", 入库完成 {stats['elapsed']:.2f} 秒" if args.db else ""
+    print(f"送入用时 {stats['feed_seconds']:.2f} 秒{target}, 吞吐量 {stats['rate']:.0f} 样本/秒")
+    duplicates = metrics.counters().get("samples_duplicate", 0)
+    if duplicates:
+        print(f"重复样本 {duplicates} 个 (已由唯一索引忽略)")
+    print(f"样本摘要: {stats['digest']}")
+    if args.verify and args.verify != stats['digest']:
+        print(f"摘要不一致: 期望 {args.verify}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
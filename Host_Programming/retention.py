@@ -0,0 +1,217 @@
+import argparse
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import dbconn
+import log
+import metrics
+import partition
+import rollup
+
+DB_PATH = "db/sqlite.db"
+
+RAW_RETENTION_DAYS = 30          # 原始数据保留天数
+ROLLUP_RETENTION_DAYS = {        # 各级汇总数据保留天数 (None 表示永久保留)
+    "1m": 180,
+    "1h": 3 * 365,
+    "1d": None,
+}
+RETENTION_INTERVAL = 3600.0      # 两次清理之间的间隔 (秒)
+DELETE_CHUNK_ROWS = 2000         # 每个删除事务最多删除的行数
+STEP_TIME_BUDGET = 0.05          # 每次执行清理步骤的时间预算 (秒)，超出后让出给入库事务
+VACUUM_PAGES_PER_STEP = 256      # 每次 incremental_vacuum 回收的页数
+
+logger = log.get_logger("retention")
+
+
+class RetentionJob:
+    """
+    数据保留清理任务。
+    由入库线程在两次批量提交之间调用 step()，每次只删除一小段 id 范围，不会长时间占用写锁。
+    分区模式下过期的原始数据整文件删除。
+    """
+
+    def __init__(self, raw_days=RAW_RETENTION_DAYS, rollup_days=None, interval=RETENTION_INTERVAL,
+                 chunk_rows=DELETE_CHUNK_ROWS, step_budget=STEP_TIME_BUDGET):
+        self.raw_days = raw_days
+        self.rollup_days = dict(ROLLUP_RETENTION_DAYS if rollup_days is None else rollup_days)
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.step_budget = step_budget
+        self.next_run = time.monotonic()
+        self.plan = None
+        self.report = None
+
+    def _start_run(self, conn):
+        now = datetime.now()
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.plan = []
+        if self.raw_days is not None:
+            cutoff = (now - timedelta(days=self.raw_days)).strftime("%Y-%m-%d %H:%M:%S")
+            self.plan.append(("partitions", cutoff))
+            self.plan.append(("sensor_data", cutoff))
+            self.plan.append(("sensor_data_backfill", cutoff))
+        for level, days in self.rollup_days.items():
+            if days is not None and rollup.ROLLUP_TABLES[level] in existing:
+                cutoff = (now - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+                self.plan.append((rollup.ROLLUP_TABLES[level], cutoff))
+        self.plan.append(("vacuum", None))
+        self.report = {'removed': {}, 'removed_files': 0, 'removed_bytes': 0, 'vacuum_pages': 0,
+                       'busy_seconds': 0.0, 'started': time.monotonic()}
+
+    def _delete_partition(self, cutoff):
+        """删除一个完全早于截止时间的分区文件"""
+        for key, path in partition.list_partitions():
+            if partition.key_bounds(key)[1] >= cutoff:
+                break
+            try:
+                self.report['removed_bytes'] += partition.remove_partition(path)
+                self.report['removed_files'] += 1
+            except OSError as e:
+                logger.error("删除过期分区 %s 失败: %s", path, e)
+                return 0
+            return 1
+        return 0
+
+    def _delete_raw_chunk(self, conn, cutoff):
+        first = conn.execute("SELECT MIN(id) FROM sensor_data").fetchone()[0]
+        if first is None:
+            return 0
+        # 按 id 区间删除: 每次只处理 [first, first + chunk_rows) 区间内早于截止时间的记录
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM sensor_data WHERE id >= ? AND id < ? AND timestamp < ?",
+                (first, first + self.chunk_rows, cutoff)
+            )
+        # 区间内没有过期数据 (返回0) 说明已清理到截止时间
+        return cursor.rowcount
+
+    def _delete_backfill_chunk(self, conn, cutoff):
+        # 批量导入的历史数据 id 较大，不在上面按 id 递增清理的范围内，这里按时间索引补充清理
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM sensor_data WHERE id IN "
+                "(SELECT id FROM sensor_data WHERE timestamp < ? LIMIT ?)",
+                (cutoff, self.chunk_rows)
+            )
+        return cursor.rowcount
+
+    def _delete_rollup_chunk(self, conn, table, cutoff):
+        with conn:
+            cursor = conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {table} WHERE bucket < ? LIMIT ?)",
+                (cutoff, self.chunk_rows)
+            )
+        return cursor.rowcount
+
+    def _vacuum_chunk(self, conn):
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if free_pages == 0 or auto_vacuum != 2:  # 2 = INCREMENTAL
+            return 0
+        pages = min(free_pages, VACUUM_PAGES_PER_STEP)
+        # 通过 executescript 执行才会把整条 PRAGMA 跑完，execute 每次只回收一页
+        conn.executescript(f"PRAGMA incremental_vacuum({pages})")
+        return pages
+
+    def step(self, conn):
+        """执行一小步清理，返回本次是否做了工作"""
+        if self.plan is None:
+            if time.monotonic() < self.next_run:
+                return False
+            self._start_run(conn)
+
+        step_start = time.monotonic()
+        deadline = step_start + self.step_budget
+        try:
+            while self.plan and time.monotonic() < deadline:
+                table, cutoff = self.plan[0]
+                if table == "vacuum":
+                    done = self._vacuum_chunk(conn)
+                    self.report['vacuum_pages'] += done
+                elif table == "partitions":
+                    done = self._delete_partition(cutoff)
+                elif table == "sensor_data":
+                    done = self._delete_raw_chunk(conn, cutoff)
+                elif table == "sensor_data_backfill":
+                    done = self._delete_backfill_chunk(conn, cutoff)
+                    table = "sensor_data"
+                else:
+                    done = self._delete_rollup_chunk(conn, table, cutoff)
+                if table not in ("vacuum", "partitions"):
+                    self.report['removed'][table] = self.report['removed'].get(table, 0) + done
+                if done == 0:
+                    self.plan.pop(0)
+        except sqlite3.Error as e:
+            logger.error("数据保留清理出错: %s，将在下个周期重试", e)
+            self.plan = []
+
+        elapsed = time.monotonic() - step_start
+        self.report['busy_seconds'] += elapsed
+        metrics.histogram("retention_step").observe(elapsed * 1000.0)
+        if not self.plan:
+            self._finish_run()
+        return True
+
+    def _finish_run(self):
+        report = self.report
+        removed = ", ".join(f"{table} {count} 行" for table, count in report['removed'].items())
+        if report['removed_files']:
+            removed += f", 分区文件 {report['removed_files']} 个 ({report['removed_bytes'] / 1048576:.1f} MB)"
+        logger.info("数据保留清理完成: 删除 %s; 回收 %d 页; 耗时 %.2f 秒 (总历时 %.1f 秒)", removed,
+                    report['vacuum_pages'], report['busy_seconds'], time.monotonic() - report['started'])
+        self.plan = None
+        self.next_run = time.monotonic() + self.interval
+
+    def run_to_completion(self, conn):
+        """立即执行一次完整清理 (命令行使用)，返回清理报告"""
+        self.next_run = time.monotonic()
+        self.step(conn)
+        while self.plan is not None:
+            self.step(conn)
+        return self.report
+
+
+def enable_incremental_vacuum(db_path=DB_PATH):
+    """将已有数据库切换为 auto_vacuum=INCREMENTAL (需要执行一次完整 VACUUM，应在停止采集时运行)"""
+    conn = dbconn.connect_writer(db_path)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"已启用增量回收: auto_vacuum={conn.execute('PRAGMA auto_vacuum').fetchone()[0]}")
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 数据保留清理工具")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件路径")
+    parser.add_argument("--raw-days", type=int, default=RAW_RETENTION_DAYS, help="原始数据保留天数")
+    parser.add_argument("--run", action="store_true", help="立即执行一次清理")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="为旧数据库启用 auto_vacuum=INCREMENTAL (会执行一次完整 VACUUM)")
+    args = parser.parse_args(argv)
+    log.setup("retention", log_dir=None)
+    if not (args.run or args.enable_incremental_vacuum):
+        parser.print_help()
+        return 1
+    try:
+        if args.enable_incremental_vacuum:
+            enable_incremental_vacuum(args.db)
+        if args.run:
+            conn = dbconn.connect_writer(args.db)
+            try:
+                RetentionJob(raw_days=args.raw_days).run_to_completion(conn)
+            finally:
+                conn.close()
+    except sqlite3.Error as e:
+        print(f"数据保留清理出错: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
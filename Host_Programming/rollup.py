@@ -0,0 +1,229 @@
+import argparse
+import sqlite3
+import sys
+import time
+
+import archive
+import dbconn
+import devices
+import partition
+
+DB_PATH = "db/sqlite.db"
+
+CHANNELS = ("temperature", "humidity", "pm25", "noise")
+
+# 汇总级别 -> 表名
+ROLLUP_TABLES = {
+    "1m": "sensor_rollup_1m",
+    "1h": "sensor_rollup_1h",
+    "1d": "sensor_rollup_1d",
+}
+
+REBUILD_CHUNK_SIZE = 50000  # 重建汇总表时每次读取的原始记录数
+
+
+def bucket_of(timestamp, level):
+    """根据 'YYYY-MM-DD HH:MM:SS' 格式的时间戳计算所属时间桶的起始时间"""
+    if level == "1m":
+        return timestamp[:16] + ":00"
+    if level == "1h":
+        return timestamp[:13] + ":00:00"
+    if level == "1d":
+        return timestamp[:10] + " 00:00:00"
+    raise ValueError(f"未知的汇总级别: {level}")
+
+
+def create_rollup_tables(conn):
+    """创建汇总表 (每个设备、每个时间桶一行，每个通道保存 min/max/mean/last)"""
+    channel_columns = ",\n".join(
+        f"{c}_min REAL NOT NULL, {c}_max REAL NOT NULL, {c}_mean REAL NOT NULL, {c}_last REAL NOT NULL"
+        for c in CHANNELS
+    )
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"""
+                     CREATE TABLE IF NOT EXISTS {table}
+                     (
+                         device_id INTEGER NOT NULL DEFAULT {devices.DEFAULT_DEVICE_ID},
+                         bucket DATETIME NOT NULL,
+                         count INTEGER NOT NULL,
+                         last_timestamp DATETIME NOT NULL,
+                         {channel_columns},
+                         PRIMARY KEY (device_id, bucket)
+                     )
+                     """)
+        # 不指定设备的查询与保留清理按时间桶范围扫描
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+
+
+def rollups_missing(conn):
+    """检查汇总表是否尚未创建 (旧版本数据库升级时需要重建)"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return any(table not in existing for table in ROLLUP_TABLES.values())
+
+
+def add_device_dimension(conn):
+    """
+    将旧版汇总表 (以 bucket 为主键) 转换为按 (device_id, bucket) 存储，已有数据归属默认设备。
+    中途中断后可重复执行。
+    """
+    stat_columns = ["bucket", "count", "last_timestamp"] + [
+        f"{c}_{stat}" for c in CHANNELS for stat in ("min", "max", "mean", "last")]
+    for table in ROLLUP_TABLES.values():
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        old_exists = conn.execute(f"PRAGMA table_info({table}_old)").fetchone() is not None
+        if columns and "device_id" not in columns and not old_exists:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    create_rollup_tables(conn)
+    for table in ROLLUP_TABLES.values():
+        if conn.execute(f"PRAGMA table_info({table}_old)").fetchone() is None:
+            continue
+        with conn:
+            conn.execute(f"INSERT OR IGNORE INTO {table} (device_id, {', '.join(stat_columns)}) "
+                         f"SELECT {devices.DEFAULT_DEVICE_ID}, {', '.join(stat_columns)} FROM {table}_old")
+            conn.execute(f"DROP TABLE {table}_old")
+
+
+def _aggregate(rows, level):
+    """将 (timestamp, temperature, humidity, pm25, noise, device_id) 行按 (设备, 时间桶) 聚合"""
+    buckets = {}
+    for row in rows:
+        timestamp = row[0]
+        key = (row[5], bucket_of(timestamp, level))
+        agg = buckets.get(key)
+        if agg is None:
+            agg = {'count': 0, 'last_timestamp': timestamp}
+            for i, c in enumerate(CHANNELS, start=1):
+                agg[c] = [row[i], row[i], 0.0, row[i]]  # min, max, sum, last
+            buckets[key] = agg
+        agg['count'] += 1
+        newer = timestamp >= agg['last_timestamp']
+        if newer:
+            agg['last_timestamp'] = timestamp
+        for i, c in enumerate(CHANNELS, start=1):
+            value = row[i]
+            stats = agg[c]
+            if value < stats[0]:
+                stats[0] = value
+            if value > stats[1]:
+                stats[1] = value
+            stats[2] += value
+            if newer:
+                stats[3] = value
+    return buckets
+
+
+def _upsert_sql(table):
+    columns = ["device_id", "bucket", "count", "last_timestamp"]
+    updates = ["count = count + excluded.count",
+               "last_timestamp = MAX(last_timestamp, excluded.last_timestamp)"]
+    for c in CHANNELS:
+        columns += [f"{c}_min", f"{c}_max", f"{c}_mean", f"{c}_last"]
+        updates += [
+            f"{c}_min = MIN({c}_min, excluded.{c}_min)",
+            f"{c}_max = MAX({c}_max, excluded.{c}_max)",
+            f"{c}_mean = ({c}_mean * count + excluded.{c}_mean * excluded.count) / (count + excluded.count)",
+            f"{c}_last = CASE WHEN excluded.last_timestamp >= last_timestamp "
+            f"THEN excluded.{c}_last ELSE {c}_last END",
+        ]
+    placeholders = ", ".join("?" for _ in columns)
+    # SQLite 中 SET 子句引用的是更新前的列值，因此各表达式的先后顺序无关
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) "
+            f"ON CONFLICT(device_id, bucket) DO UPDATE SET {', '.join(updates)}")
+
+
+_UPSERT_SQL = {table: _upsert_sql(table) for table in ROLLUP_TABLES.values()}
+
+
+def apply_rows(conn, rows):
+    """
+    将一批新写入的原始数据增量合并到所有汇总表。
+    rows: [(timestamp, temperature, humidity, pm25, noise, device_id), ...]，调用方负责事务提交。
+    """
+    if not rows:
+        return
+    for level, table in ROLLUP_TABLES.items():
+        params = []
+        for (device_id, key), agg in _aggregate(rows, level).items():
+            values = [device_id, key, agg['count'], agg['last_timestamp']]
+            for c in CHANNELS:
+                mn, mx, total, last = agg[c]
+                values += [mn, mx, total / agg['count'], last]
+            params.append(values)
+        conn.executemany(_UPSERT_SQL[table], params)
+
+
+def rebuild_rollups(db_path=DB_PATH, chunk_size=REBUILD_CHUNK_SIZE, progress=None):
+    """清空并根据原始数据重新生成全部汇总表，返回处理的记录数"""
+    start = time.monotonic()
+    processed = 0
+    conn = dbconn.connect_writer(db_path)
+    try:
+        with conn:
+            create_rollup_tables(conn)
+            for table in ROLLUP_TABLES.values():
+                conn.execute(f"DELETE FROM {table}")
+            # 原始数据可能分布在主库、各分区文件与归档中，分区逐个附加 (SQLite 限制同时附加的数量)
+            partitions = partition.list_partitions()
+            total = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+            for _, path in partitions:
+                part_conn = dbconn.connect_reader(path)
+                try:
+                    total += part_conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+                finally:
+                    part_conn.close()
+            for _, path in archive.list_archives():
+                with archive.ArchiveReader(path) as reader:
+                    total += reader.rows
+            for path in [None] + [path for _, path in partitions]:
+                if path is not None:
+                    conn.commit()
+                    conn.execute("ATTACH DATABASE ? AS src", (path,))
+                source = "main" if path is None else "src"
+                last_id = 0
+                while True:
+                    rows = conn.execute(
+                        "SELECT id, timestamp, temperature, humidity, pm25, noise, device_id "
+                        f"FROM {source}.sensor_data WHERE id > ? ORDER BY id LIMIT ?", (last_id, chunk_size)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    apply_rows(conn, [row[1:] for row in rows])
+                    processed += len(rows)
+                    if progress:
+                        progress(processed, total)
+                if path is not None:
+                    conn.commit()
+                    conn.execute("DETACH DATABASE src")
+            # 已归档的冷数据
+            for _, path in archive.list_archives():
+                with archive.ArchiveReader(path) as reader:
+                    rows = reader.read_rows()
+                apply_rows(conn, [row[:5] + row[6:7] for row in rows])
+                processed += len(rows)
+                if progress:
+                    progress(processed, total)
+    finally:
+        conn.close()
+    print(f"汇总表重建完成: {processed} 条记录, 耗时 {time.monotonic() - start:.1f} 秒")
+    return processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 汇总表工具")
+    parser.add_argument("--rebuild", action="store_true", help="根据原始数据重建 1分钟/1小时/1天 汇总表")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件路径")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+    try:
+        rebuild_rollups(args.db, progress=lambda done, total: print(f"已处理 {done}/{total} 条记录"))
+    except sqlite3.Error as e:
+        print(f"重建汇总表时出错: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,70 @@
+import argparse
+import logging
+import queue
+import select
 import socket
-import sqlite3
 import struct
+import sqlite3
+import sys
+import threading
 import time
 from datetime import datetime
 import os
 
+import backup
+import capture
+import dbconn
+import devices
+import exporter
+import ingest_lock
+import log
+import maintenance
+import migrations
+import metrics
+import partition
+import protocol
+import retention
+import rollup
+import sequence
+
 ESP_TARGET_IP = "192.168.4.1"
 ESP_TARGET_PORT = 6666
 
 DB_PATH = "db/sqlite.db"  # 数据库文件路径
-PACKET_SIZE = 11          # 预期的数据包大小 (4字节头部 + 7字节数据)
 CLIENT_CONNECT_TIMEOUT = 10.0  # 连接到服务器的超时时间 (秒)
 CLIENT_RECV_TIMEOUT = 30.0     # 从服务器接收数据的超时时间 (秒)
 RECONNECT_DELAY = 5.0          # 连接失败或断开后，重新尝试连接的延迟时间 (秒)
+RECV_CHUNK_SIZE = 65536        # 单次从套接字读取的最大字节数 (v2 帧可能包含上千个样本)
+WRITE_BATCH_SIZE = 500         # 入库线程单个事务最多写入的样本数
+WRITE_FLUSH_INTERVAL = 0.5     # 入库线程凑批的最长等待时间 (秒)
+WRITE_RETRIES = 5              # 数据库忙或被锁定时入库事务的最大重试次数，仍失败才丢弃该批样本
+WRITE_RETRY_DELAY = 0.5        # 第一次重试前的等待时间 (秒)，之后每次加倍
+# 同时采集的其他下位机 [(IP, 端口)]，每台下位机登记为一个设备，由单独的接收线程读取
+EXTRA_DEVICE_TARGETS = []
+# UDP 接收: 大量下位机向同一端口发送与 TCP 相同格式的帧 (一个数据报包含一个或多个完整的帧)，按源 IP 区分设备
+UDP_LISTEN_PORT = None         # 设置端口后 run_tcp_client 同时监听 UDP，None 表示不启用
+UDP_BIND_IP = "0.0.0.0"
+UDP_RECV_BUFFER = 4 * 1024 * 1024  # 套接字接收缓冲区，突发流量时由内核暂存
+UDP_MAX_DATAGRAM = 65535
+UDP_DRAIN_MAX = 256            # 每次唤醒后最多连续读取的数据报数
+UDP_MAX_BACKLOG = 100000       # 入库队列积压超过该样本数时丢弃新到的数据报，避免内存无限增长
+UDP_REPORT_INTERVAL = 10.0     # 打印 UDP 接收统计的间隔 (秒)
+# 设置文件路径后录制收到的原始字节流及到达时间 (见 capture.py)，可用 replay.py 回放；None 表示不录制
+CAPTURE_PATH = None
+# 入库线程每次提交后调用 listener(rows)，rows 为新写入的 [(timestamp, temperature, humidity, pm25, noise, id, device_id)]，
+# 与 query 返回的行格式相同。用于同一进程中的实时推送 (见 live.py)，listener 必须很快返回
+SAMPLE_LISTENERS = []
+
+# 原始数据表的索引 {名称: 建索引语句}，{schema} 与 {table} 为库名与表名。
+# 已有数据库缺少的索引由 migrations.ensure_indexes 补建 (大表分批重建，不长时间占用写锁)
+SENSOR_INDEXES = {
+    'idx_timestamp': "CREATE INDEX IF NOT EXISTS {schema}.idx_timestamp ON {table}(timestamp)",
+    'idx_device_timestamp': "CREATE INDEX IF NOT EXISTS {schema}.idx_device_timestamp ON {table}(device_id, timestamp)",
+    'idx_device_seq': "CREATE UNIQUE INDEX IF NOT EXISTS {schema}.idx_device_seq "
+                      "ON {table}(device_id, seq, device_time) WHERE seq IS NOT NULL",
+}
+
+logger = log.get_logger("router")
 
 def connect_to_db():
     db_dir = os.path.dirname(DB_PATH)
@@ -20,128 +72,664 @@ def connect_to_db():
         try:
             os.makedirs(db_dir, exist_ok=True)
         except OSError as e:
-            print(f"创建数据库失败 {db_dir}: {e}")
+            logger.error("创建数据库失败 %s: %s", db_dir, e)
     try:
-        with sqlite3.connect(DB_PATH, timeout=10) as conn:
+        conn = dbconn.connect_writer(DB_PATH)
+        with conn:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL") # 仅对新建的数据库生效，便于清理后回收空间
             conn.execute("PRAGMA journal_mode=WAL") # 启用WAL模式以获得更好的并发性能
-            conn.execute("""
-                         CREATE TABLE IF NOT EXISTS sensor_data
-                         (
-                             id INTEGER PRIMARY KEY AUTOINCREMENT,
-                             timestamp DATETIME NOT NULL,
-                             temperature REAL NOT NULL,
-                             humidity REAL NOT NULL,
-                             pm25 INTEGER NOT NULL,
-                             noise INTEGER NOT NULL
-                         )
-                         """)
+        conn.close()
+        # 建表与结构升级由迁移完成，大表的数据回填分批进行，进度写入进度文件供启动画面显示
+        migrations.run_startup_migrations(DB_PATH)
     except sqlite3.Error as e:
-        print(f"数据库操作错误: {e}")
+        logger.error("数据库操作错误: %s", e)
         raise
 
+def create_sensor_table(conn, schema="main", table="sensor_data"):
+    """在指定的数据库 (主库或附加的分区) 中创建原始数据表及其索引"""
+    conn.execute(f"""
+                 CREATE TABLE IF NOT EXISTS {schema}.{table}
+                 (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     timestamp DATETIME NOT NULL,
+                     temperature REAL NOT NULL,
+                     humidity REAL NOT NULL,
+                     pm25 INTEGER NOT NULL,
+                     noise INTEGER NOT NULL,
+                     device_id INTEGER NOT NULL DEFAULT {devices.DEFAULT_DEVICE_ID},
+                     seq INTEGER,
+                     device_time INTEGER
+                 )
+                 """)
+    create_sensor_indexes(conn, schema, table)
+
+
+def create_sensor_indexes(conn, schema="main", table="sensor_data"):
+    for sql in SENSOR_INDEXES.values():
+        conn.execute(sql.format(schema=schema, table=table))
+
+
+def save_samples(conn, samples, schema="main"):
+    """
+    在当前事务中写入一批样本并增量更新汇总表，返回各样本的新记录id。
+    samples: [{'timestamp', 'temperature', 'humidity', 'pm25', 'noise', 'device_id', 'seq', 'device_time'}, ...]，
+    未指定设备时归属默认设备；带序号的样本按 (设备, 序号, 下位机采样时间) 去重，重复样本的id为 None 且不计入汇总表。
+    下位机时钟未校准时 timestamp 是上位机接收时间，重发的帧会得到新的 timestamp，因此去重不能使用 timestamp。
+    schema: 原始数据写入的库 (分区模式下为附加的分区库)，汇总表始终写入主库。
+    """
+    row_ids = []
+    rows = []
+    duplicates = {}
+    for data in samples:
+        row = (
+            data.get('timestamp') or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            data['temperature'],
+            data['humidity'],
+            data['pm25'],
+            data['noise'],
+            data.get('device_id', devices.DEFAULT_DEVICE_ID)
+        )
+        seq = data.get('seq')
+        verb = "INSERT" if seq is None else "INSERT OR IGNORE"
+        cursor = conn.execute(f"""
+                              {verb} INTO {schema}.sensor_data
+                                  (timestamp, temperature, humidity, pm25, noise, device_id, seq, device_time)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                              """, row + (seq, data.get('device_time')))
+        if cursor.rowcount == 0:
+            key = (row[5], row[0][:10])
+            duplicates[key] = duplicates.get(key, 0) + 1
+            row_ids.append(None)
+            continue
+        row_ids.append(cursor.lastrowid)
+        rows.append(row)
+    rollup.apply_rows(conn, rows)
+    if duplicates:
+        sequence.record_duplicates(conn, duplicates)
+    return row_ids
+
+
 def save_to_db(data):
+    """保存一条数据，返回新记录的id (失败时返回None)"""
     try:
-        with sqlite3.connect(DB_PATH, timeout=10) as conn:
-            conn.execute("""
-                         INSERT INTO sensor_data
-                             (timestamp, temperature, humidity, pm25, noise)
-                         VALUES (?, ?, ?, ?, ?)
-                         """, (
-                             datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                             data['temperature'],
-                             data['humidity'],
-                             data['pm25'],
-                             data['noise']
-                         ))
+        conn = dbconn.connect_writer(DB_PATH)
+        try:
+            with conn:
+                return save_samples(conn, [data])[0]
+        finally:
+            conn.close()
     except sqlite3.Error as e:
-        print(f"保存数据到数据库时出错: {e}")
+        logger.error("保存数据到数据库时出错: %s", e)
+        return None
 
 
+def _is_transient(error):
+    """数据库忙 (SQLITE_BUSY) 或被锁定 (SQLITE_LOCKED) 的错误，稍后重试可能成功"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
 
-def unpack_data(packet_bytes):
-    expected_len = PACKET_SIZE
-    if len(packet_bytes) != expected_len:
-        raise ValueError(f"无效的数据包长度. 期望 {expected_len}, 收到 {len(packet_bytes)}.")
-    header = packet_bytes[:4]
-    if header != b'\xAA\xBB\xCC\xDD':
-        raise ValueError(f"无效的头部. 期望 b'\\xAA\\xBB\\xCC\\xDD', 收到 {header.hex()}.")
-    data_payload = packet_bytes[4:11]
-    try:
-        temperature = struct.unpack('>h', data_payload[0:2])[0] / 10.0
-        humidity = struct.unpack('>H', data_payload[2:4])[0] / 10.0
-        pm25 = struct.unpack('>H', data_payload[4:6])[0]
-        noise = struct.unpack('>B', data_payload[6:7])[0]
-    except struct.error as e:
-        raise ValueError(f"解析数据负载时出错: {e}. 负载: {data_payload.hex()}")
-
-    return {
-        "temperature": temperature,
-        "humidity": humidity,
-        "pm25": pm25,
-        "noise": noise
-    }
-
-
-def run_tcp_client(server_ip, server_port):
+
+class IngestWriter(threading.Thread):
+    """
+    入库线程: 从队列中批量取出样本，在一个事务内写入原始数据并更新汇总表。
+    background_jobs 中的任务 (如数据保留清理) 在两次提交之间、没有积压时执行一小步，
+    与入库共用同一连接，因此不会与写入争抢锁。
+    """
+
+    def __init__(self, db_path=DB_PATH, latency_queue=None,
+                 batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, background_jobs=None,
+                 storage_mode=None):
+        super().__init__(name="IngestWriter", daemon=True)
+        self.db_path = db_path
+        self.storage_mode = storage_mode or partition.STORAGE_MODE
+        self.attached_key = None  # 当前附加为 part 的分区键
+        self.last_row_id = 0
+        self.latency_queue = latency_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background_jobs = list(background_jobs or [])
+        self.samples = queue.Queue()
+        self._stop_event = threading.Event()
+
+    def submit(self, data, stamps=None):
+        """提交一个已解析的样本 (由接收线程调用，不阻塞)"""
+        if 'timestamp' not in data:
+            data = dict(data, timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        self.samples.put((data, stamps))
+
+    def stop(self, timeout=5.0):
+        """停止线程并写入队列中剩余的样本"""
+        self._stop_event.set()
+        self.join(timeout)
+
+    def _next_batch(self):
+        try:
+            batch = [self.samples.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.samples.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        conn = dbconn.connect_writer(self.db_path)
+        self.last_row_id = self._max_row_id(conn)
+        try:
+            while not (self._stop_event.is_set() and self.samples.empty()):
+                batch = self._next_batch()
+                if batch:
+                    self.write_batch(conn, batch)
+                if self.samples.qsize() < self.batch_size:
+                    self.run_background_jobs(conn)
+        finally:
+            conn.close()
+
+    def write_pending(self, conn):
+        """在耗时较长的后台任务 (如备份) 的步骤之间调用，写入已到达的样本而不等待"""
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.samples.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self.write_batch(conn, batch)
+
+    def run_background_jobs(self, conn):
+        for job in self.background_jobs:
+            try:
+                job.step(conn)
+            except Exception as e:
+                logger.error("后台任务 %s 出错: %s", type(job).__name__, e)
+
+    def _max_row_id(self, conn):
+        """主库与最新分区中的最大id，新分区从该值继续编号，保证id全局递增"""
+        max_id = conn.execute("SELECT MAX(id) FROM sensor_data").fetchone()[0] or 0
+        partitions = partition.list_partitions()
+        if partitions:
+            rows = partition.query_partitions(conn, partitions[-1:], "SELECT MAX(id) FROM {table}", ())
+            max_id = max(max_id, rows[0][0] or 0)
+        return max_id
+
+    def _attach_partition(self, conn, key):
+        """将分区库附加为 part (必要时创建)，返回写入的 schema 名"""
+        if self.attached_key == key:
+            return "part"
+        if self.attached_key is not None:
+            conn.execute("DETACH DATABASE part")
+            self.attached_key = None
+        os.makedirs(partition.PARTITION_DIR, exist_ok=True)
+        conn.execute("ATTACH DATABASE ? AS part", (partition.partition_path(key),))
+        self.attached_key = key
+        conn.execute("PRAGMA part.journal_mode=WAL")
+        with conn:
+            create_sensor_table(conn, "part")
+            seeded = conn.execute("SELECT seq FROM part.sqlite_sequence WHERE name = 'sensor_data'").fetchone()
+            if seeded is None:
+                conn.execute("INSERT INTO part.sqlite_sequence (name, seq) VALUES ('sensor_data', ?)",
+                             (self.last_row_id,))
+        return "part"
+
+    def _split_by_storage(self, batch):
+        """按写入目标拆分批次: 单库模式整体写入主库，分区模式按分区键分组"""
+        if self.storage_mode == "single":
+            return [(None, batch)]
+        groups = {}
+        for item in batch:
+            key = partition.partition_key(item[0]['timestamp'], self.storage_mode)
+            groups.setdefault(key, []).append(item)
+        return sorted(groups.items())
+
+    def _save_with_retry(self, conn, key, items):
+        """
+        在一个事务中写入一组样本，返回 (各样本的id, 最后一次尝试的开始时间)。
+        数据库忙或被锁定时保留这组样本，按 WRITE_RETRY_DELAY 加倍等待后重试 (新样本在队列中暂存)；
+        其他错误或重试 WRITE_RETRIES 次仍失败时丢弃并计入 samples_write_failed，返回 (None, None)。
+        """
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(WRITE_RETRIES + 1):
+            start = time.perf_counter()
+            try:
+                schema = "main" if key is None else self._attach_partition(conn, key)
+                with conn:
+                    return save_samples(conn, [data for data, _ in items], schema), start
+            except sqlite3.Error as e:
+                if not _is_transient(e) or attempt == WRITE_RETRIES:
+                    logger.error("保存数据到数据库时出错，丢弃 %d 条样本: %s", len(items), e)
+                    metrics.increment("samples_write_failed", len(items))
+                    return None, None
+                logger.warning("数据库忙 (%s)，%.1f 秒后重试写入 %d 条样本", e, delay, len(items))
+                metrics.increment("ingest_write_retries")
+                time.sleep(delay)
+                delay *= 2
+
+    def write_batch(self, conn, batch):
+        for key, items in self._split_by_storage(batch):
+            row_ids, start = self._save_with_retry(conn, key, items)
+            if row_ids is None:
+                continue
+            commit_t = time.monotonic()
+            metrics.histogram("ingest_commit").observe((time.perf_counter() - start) * 1000.0)
+            metrics.histogram("ingest_batch_size", metrics.COUNT_BOUNDS).observe(len(items))
+            metrics.set_gauge("ingest_last_commit_time", time.time())
+            written = [row_id for row_id in row_ids if row_id is not None]
+            metrics.increment("samples_written", len(written))
+            if written:
+                self.last_row_id = max(self.last_row_id, written[-1])
+                if SAMPLE_LISTENERS:
+                    rows = [(data['timestamp'], data['temperature'], data['humidity'], data['pm25'], data['noise'],
+                             row_id, data.get('device_id', devices.DEFAULT_DEVICE_ID))
+                            for row_id, (data, _) in zip(row_ids, items) if row_id is not None]
+                    for listener in SAMPLE_LISTENERS:
+                        listener(rows)
+            for row_id, (data, stamps) in zip(row_ids, items):
+                if stamps is not None:
+                    metrics.publish_stamps(self.latency_queue, row_id, dict(stamps, commit=commit_t),
+                                           data.get('device_id', devices.DEFAULT_DEVICE_ID))
+        metrics.set_gauge("ingest_backlog", self.samples.qsize())
+
+
+def start_ingest(latency_queue=None):
+    """
+    取得采集锁、初始化数据库并启动入库线程 (TCP 与 UDP 接收共用)。
+    已有其他采集进程在运行或数据库初始化失败时返回 None。
+    """
+    log.setup("router")  # 界面启动的采集进程从这里开始运行，已配置时不重复配置
+    if not ingest_lock.acquire("router"):
+        owner = ingest_lock.holder() or {}
+        logger.error("已有采集进程在运行 (PID %s, %s)，不再重复采集", owner.get('pid'), owner.get('role'))
+        return None
     try:
         connect_to_db()
     except Exception as e:
-        print(f"关键错误: 数据库初始化失败: {e}. 程序无法继续。")
+        logger.critical("数据库初始化失败: %s. 程序无法继续。", e)
+        return None
+
+    backup_job = backup.BackupJob(DB_PATH)
+    maintenance_job = maintenance.MaintenanceJob(DB_PATH)
+    writer = IngestWriter(DB_PATH, latency_queue,
+                          background_jobs=[retention.RetentionJob(), backup_job, maintenance_job])
+    backup_job.between_steps = writer.write_pending
+    maintenance_job.backlog = writer.samples.qsize
+    writer.start()
+    exporter.start(exporter.ROUTER_PORT)
+    return writer
+
+
+def open_capture():
+    """按 CAPTURE_PATH 创建录制器，未设置或无法创建时返回 None (不影响采集)"""
+    if not CAPTURE_PATH:
+        return None
+    try:
+        return capture.CaptureWriter(CAPTURE_PATH)
+    except OSError as e:
+        logger.warning("无法创建录制文件 %s: %s. 继续采集但不录制。", CAPTURE_PATH, e)
+        return None
+
+
+def run_udp_listener(bind_ip=UDP_BIND_IP, port=UDP_LISTEN_PORT, latency_queue=None):
+    """只通过 UDP 接收数据 (不主动连接下位机)"""
+    writer = start_ingest(latency_queue)
+    if writer is None:
         return
+    UdpReceiver(bind_ip, port, writer, recorder=open_capture()).run()
+
+
+def run_tcp_client(server_ip, server_port, latency_queue=None):
+    """
+    连接下位机并持续接收数据。
+    latency_queue: 可选的 multiprocessing.Queue，用于将每个样本的阶段时间戳 (recv/decode/commit) 发送给界面进程。
+    """
+    writer = start_ingest(latency_queue)
+    if writer is None:
+        return
+    recorder = open_capture()
+    if UDP_LISTEN_PORT:
+        threading.Thread(target=UdpReceiver(UDP_BIND_IP, UDP_LISTEN_PORT, writer, recorder=recorder).run,
+                         name="UdpReceiver", daemon=True).start()
+
+    targets = [(server_ip, server_port)] + [t for t in EXTRA_DEVICE_TARGETS if t != (server_ip, server_port)]
+    conn = dbconn.connect_writer(DB_PATH)
+    with conn:
+        device_ids = [devices.register_device(conn, f"{ip}:{port}") for ip, port in targets]
+    conn.close()
+    for (ip, port), device_id in list(zip(targets, device_ids))[1:]:
+        threading.Thread(target=receive_from_device, args=(ip, port, writer, device_id, recorder),
+                         name=f"Receiver-{ip}:{port}", daemon=True).start()
+    receive_from_device(server_ip, server_port, writer, device_ids[0], recorder)
+
+
+class FrameReader:
+    """
+    按帧切分字节流，自动识别 v1、序号帧与 v2 帧 (见 protocol.py)。
+    接收到的数据整块追加到缓冲区 (feed)，再从中取出完整的帧 (pop_frame)；
+    头部无法识别、v2 长度字段不合法或 v2 帧 CRC 校验失败时逐字节滑动，直到重新对齐到帧头。
+    (CRC 失败说明样本数字段可能已损坏，按它切掉整段会连带丢弃后面完好的帧。)
+    sock 为 None 时只做切分 (用于回放录制的数据)，recorder 不为 None 时录制收到的原始字节。
+    """
+
+    def __init__(self, sock=None, recorder=None, source=None):
+        self.sock = sock
+        self.recorder = recorder
+        self.source = source
+        self.buffer = bytearray()
+        self.skipped = 0
+
+    def feed(self, chunk):
+        self.buffer += chunk
+
+    def pop_frame(self):
+        """取出缓冲区中的下一个完整帧，数据不足时返回 None"""
+        buffer = self.buffer
+        while len(buffer) >= 4:
+            header = bytes(buffer[:4])
+            size = protocol.FRAME_SIZES.get(header)
+            if header == protocol.V2_HEADER:
+                if len(buffer) < protocol.V2_PREFIX_SIZE:
+                    return None
+                size = protocol.v2_frame_size(buffer)
+            if size is None:
+                del buffer[0]
+                self.skipped += 1
+                continue
+            if len(buffer) < size:
+                return None
+            if header == protocol.V2_HEADER and not protocol.v2_crc_ok(buffer, size):
+                metrics.increment("frames_invalid")
+                del buffer[0]
+                self.skipped += 1
+                continue
+            if self.skipped:
+                logger.warning("丢弃 %d 字节无法识别的数据后重新对齐到帧头", self.skipped)
+                metrics.increment("frame_resync_bytes", self.skipped)
+                self.skipped = 0
+            frame = bytes(buffer[:size])
+            del buffer[:size]
+            return frame
+        return None
+
+    def _receive(self):
+        """从套接字读取一块数据。缓冲区为空时超时继续等待，数据包中途超时视为连接损坏"""
+        while True:
+            try:
+                chunk = self.sock.recv(RECV_CHUNK_SIZE)
+            except socket.timeout:
+                if self.buffer:
+                    logger.warning("接收数据包中途超时 (缓冲区中有 %d 字节未组成完整的帧). 连接可能已损坏.",
+                                   len(self.buffer))
+                    raise
+                continue
+            if not chunk:
+                raise ConnectionAbortedError("Server closed connection gracefully")
+            if self.recorder is not None:
+                self.recorder.data(self.source, chunk)
+            self.feed(chunk)
+            return
+
+    def next_frame(self):
+        """阻塞读取直到得到一个完整的帧"""
+        while True:
+            frame = self.pop_frame()
+            if frame is not None:
+                return frame
+            self._receive()
+
+
+def handle_frame(frame, device_id, tracker, writer, recv_t, source, arrival_time=None, verbose=True):
+    """
+    解析一个帧并把样本交给入库线程 (TCP、UDP 接收与回放共用)，返回样本数；帧无效时返回 None。
+    arrival_time: 回放时的原始到达时间 (Unix 秒)，用作没有采样时间的样本的时间戳，使回放结果可复现。
+    verbose: 是否逐帧记录收到的数据 (DEBUG 级别；UDP 高速接收时只记录周期统计)。
+    """
+    metrics.increment("frames_received")
+    try:
+        samples = protocol.decode_frames(frame)
+    except ValueError as e:
+        metrics.increment("frames_invalid")
+        logger.warning("数据包解析错误来自 %s: %s", source, e)
+        return None
+    decode_t = time.monotonic()
+    metrics.increment("frames_decoded")
+    metrics.increment("samples_decoded", len(samples))
+    stamps = {'recv': recv_t, 'decode': decode_t}
+    default_timestamp = None
+    if arrival_time is not None:
+        default_timestamp = datetime.fromtimestamp(arrival_time).strftime("%Y-%m-%d %H:%M:%S")
+    for sensor_data in samples:
+        sensor_data['device_id'] = device_id
+        if default_timestamp is not None and 'timestamp' not in sensor_data:
+            sensor_data['timestamp'] = default_timestamp
+        if 'seq' in sensor_data:
+            tracker.observe(sensor_data['seq'], sensor_data['device_time'])
+        writer.submit(sensor_data, stamps)
+    if verbose and logger.isEnabledFor(logging.DEBUG):
+        if len(samples) == 1:
+            logger.debug("接收数据来自 %s: %s", source, dict(samples[0]))
+        else:
+            logger.debug("接收数据来自 %s: %d 个样本, 序号 %s..%s", source, len(samples),
+                         samples[0]['seq'], samples[-1]['seq'])
+    return len(samples)
+
+
+def _decodes(frame):
+    """帧能否成功解析 (只校验，不交给入库线程)"""
+    try:
+        protocol.decode_frames(frame)
+    except ValueError:
+        return False
+    return True
 
+
+def receive_from_device(server_ip, server_port, writer, device_id=devices.DEFAULT_DEVICE_ID, recorder=None):
+    """连接一台下位机并持续接收数据，样本标记为 device_id 后交给入库线程；recorder 用于录制原始字节流"""
     client_socket = None
+    tracker = sequence.SequenceTracker(device_id)  # 跨重连保留，重连期间丢失的帧在下一帧到达时统计
+    source = f"{server_ip}:{server_port}"
+    connected_before = False  # 之前是否连接成功过，用于只统计真正的重新连接
 
     while True:
         try:
-            print(f"尝试连接到下位机 {server_ip}:{server_port}...")
+            logger.info("尝试连接到下位机 %s:%s...", server_ip, server_port)
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.settimeout(CLIENT_CONNECT_TIMEOUT)
             client_socket.connect((server_ip, server_port))
-            print(f"成功连接到下位机 {server_ip}:{server_port}")
+            logger.info("成功连接到下位机 %s:%s", server_ip, server_port)
+            if connected_before:
+                metrics.increment("tcp_reconnects")
+            connected_before = True
             client_socket.settimeout(CLIENT_RECV_TIMEOUT)
+            if recorder is not None:
+                recorder.open(source)
 
+            reader = FrameReader(client_socket, recorder, source)
             while True:
-                received_data_buffer = b''
-                bytes_to_read = PACKET_SIZE
-
-                while len(received_data_buffer) < PACKET_SIZE:
-                    try:
-                        chunk = client_socket.recv(bytes_to_read - len(received_data_buffer))
-                        if not chunk:
-                            raise ConnectionAbortedError("Server closed connection gracefully")
-                        received_data_buffer += chunk
-                    except socket.timeout:
-                        if received_data_buffer:
-                             print(f"接收数据包中途超时 (已收到 {len(received_data_buffer)}/{PACKET_SIZE} 字节). 连接可能已损坏.")
-                             raise socket.timeout
-                        else:
-                            pass
-
-                # 处理完整的数据包
-                if len(received_data_buffer) == PACKET_SIZE:
-                    try:
-                        sensor_data = unpack_data(received_data_buffer)
-                        print(f"接收数据来自 {server_ip}: {sensor_data} (时间: {datetime.now().strftime('%H:%M:%S')})")
-                        save_to_db(sensor_data)
-                    except ValueError as e:
-                        print(f"数据包解析错误来自 {server_ip}: {e}")
-
+                received_data_buffer = reader.next_frame()
+                handle_frame(received_data_buffer, device_id, tracker, writer, time.monotonic(), server_ip)
 
         except socket.timeout:
-            print(f"连接或接收数据超时。")
+            logger.warning("连接或接收数据超时 (%s)。", source)
         except ConnectionRefusedError:
-            print(f"连接被 {server_ip}:{server_port} 拒绝。请确保下位机服务器已启动并监听。")
+            logger.warning("连接被 %s 拒绝。请确保下位机服务器已启动并监听。", source)
         except ConnectionAbortedError as e:
-            print(f"连接被中止: {e}。")
+            logger.warning("连接被中止 (%s): %s。", source, e)
         except OSError as e:
-            print(f"网络错误: {e}。请检查网络连接和服务器状态。")
+            logger.warning("网络错误 (%s): %s。请检查网络连接和服务器状态。", source, e)
         except Exception as e:
-            print(f"处理与 {server_ip} 通信时发生意外错误: {e}")
+            logger.exception("处理与 %s 通信时发生意外错误: %s", server_ip, e)
         finally:
             if client_socket:
                 client_socket.close()
-            print(f"等待 {RECONNECT_DELAY} 秒后重试连接...")
+            if recorder is not None:
+                recorder.close(source)
+            logger.info("等待 %s 秒后重试连接 %s...", RECONNECT_DELAY, source)
             time.sleep(RECONNECT_DELAY)
 
+class UdpReceiver:
+    """
+    在一个 UDP 套接字上接收所有下位机的数据报，按源 IP 登记设备，解析后交给入库线程。
+    每次唤醒后以非阻塞方式连续读取多个数据报 (效果类似 recvmmsg)，减少唤醒与加锁次数。
+    计数器: udp_datagrams、udp_datagrams_malformed (帧无效或校验失败)、
+    udp_datagrams_dropped (入库积压时主动丢弃)；内核因缓冲区满丢弃的数据报数记入 udp_kernel_drops。
+    """
+
+    def __init__(self, bind_ip, port, writer, db_path=DB_PATH, recorder=None):
+        self.bind_ip = bind_ip
+        self.port = port
+        self.writer = writer
+        self.db_path = db_path
+        self.recorder = recorder
+        self.device_ids = {}  # {源 IP: 设备id}
+        self.trackers = {}    # {设备id: SequenceTracker}
+        self.stats = {'datagrams': 0, 'samples': 0, 'malformed': 0, 'dropped': 0}
+        self.kernel_drops = 0
+        self._conn = None
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECV_BUFFER)
+        self.track_overflow = False
+        overflow_option = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+        if hasattr(sock, "recvmsg") and overflow_option is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, overflow_option, 1)
+                self.overflow_option = overflow_option
+                self.track_overflow = True
+            except OSError:
+                pass
+        sock.bind((self.bind_ip, self.port))
+        sock.setblocking(False)
+        return sock
+
+    def _device_id(self, ip):
+        device_id = self.device_ids.get(ip)
+        if device_id is None:
+            if self._conn is None:
+                self._conn = dbconn.connect_writer(self.db_path)
+            with self._conn:
+                device_id = devices.register_device(self._conn, ip)
+            self.device_ids[ip] = device_id
+            self.trackers[device_id] = sequence.SequenceTracker(device_id)
+            logger.info("UDP: 新设备 %s 登记为设备 %s", ip, device_id)
+        return device_id
+
+    def _receive(self, sock):
+        """读取一个数据报，返回 (数据, 源地址)；没有数据时抛出 BlockingIOError"""
+        if not self.track_overflow:
+            return sock.recvfrom(UDP_MAX_DATAGRAM)
+        data, ancdata, _, address = sock.recvmsg(UDP_MAX_DATAGRAM, socket.CMSG_SPACE(4))
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == self.overflow_option and len(value) >= 4:
+                # 内核累计丢弃数 (自套接字创建起)
+                self.kernel_drops = struct.unpack("=I", value[:4])[0]
+        return data, address
+
+    def _drain(self, sock):
+        """连续读取已到达的数据报，返回 [(数据, 源地址)]"""
+        datagrams = []
+        while len(datagrams) < UDP_DRAIN_MAX:
+            try:
+                datagrams.append(self._receive(sock))
+            except (BlockingIOError, InterruptedError):
+                break
+        return datagrams
+
+    def handle_datagram(self, data, address, recv_t, arrival_time=None):
+        self.stats['datagrams'] += 1
+        if self.recorder is not None:
+            self.recorder.datagram(address[0], data)
+        if self.writer.samples.qsize() > UDP_MAX_BACKLOG:
+            self.stats['dropped'] += 1
+            metrics.increment("udp_datagrams_dropped")
+            return
+        try:
+            frames = protocol.split_frames(data)
+        except ValueError as e:
+            self.stats['malformed'] += 1
+            metrics.increment("udp_datagrams_malformed")
+            logger.warning("UDP 数据报无效 (来自 %s): %s", address[0], e)
+            return
+        device_id = self.device_ids.get(address[0])
+        if device_id is None:
+            # 未登记的来源至少有一个帧能解析时才登记为设备，避免扫描或杂散数据报产生设备记录
+            if not any(_decodes(frame) for frame in frames):
+                self.stats['malformed'] += 1
+                metrics.increment("udp_datagrams_malformed")
+                logger.warning("UDP 数据报中没有可解析的帧 (来自未登记的 %s)，不登记设备", address[0])
+                return
+            device_id = self._device_id(address[0])
+        for frame in frames:
+            count = handle_frame(frame, device_id, self.trackers[device_id], self.writer, recv_t, address[0],
+                                 arrival_time, verbose=False)
+            if count is None:
+                self.stats['malformed'] += 1
+                metrics.increment("udp_datagrams_malformed")
+            else:
+                self.stats['samples'] += count
+
+    def report(self):
+        metrics.set_gauge("udp_kernel_drops", self.kernel_drops)
+        logger.info("UDP: %.0f 秒内收到 %d 个数据报、%d 个样本, 无效 %d, 积压丢弃 %d, 内核累计丢弃 %d",
+                    UDP_REPORT_INTERVAL, self.stats['datagrams'], self.stats['samples'], self.stats['malformed'],
+                    self.stats['dropped'], self.kernel_drops)
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    def run(self):
+        sock = self._open_socket()
+        logger.info("UDP: 正在 %s:%s 接收数据", self.bind_ip, self.port)
+        next_report = time.monotonic() + UDP_REPORT_INTERVAL
+        try:
+            while True:
+                readable, _, _ = select.select([sock], [], [], UDP_REPORT_INTERVAL)
+                if readable:
+                    datagrams = self._drain(sock)
+                    metrics.increment("udp_datagrams", len(datagrams))
+                    recv_t = time.monotonic()
+                    for data, address in datagrams:
+                        self.handle_datagram(data, address, recv_t)
+                if time.monotonic() >= next_report:
+                    if self.stats['datagrams']:
+                        self.report()
+                    next_report = time.monotonic() + UDP_REPORT_INTERVAL
+        finally:
+            sock.close()
+            if self._conn is not None:
+                self._conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 数据采集服务")
+    parser.add_argument("--host", default=ESP_TARGET_IP, help="TCP 模式下位机地址")
+    parser.add_argument("--port", type=int, default=ESP_TARGET_PORT, help="TCP 模式下位机端口")
+    parser.add_argument("--udp", type=int, metavar="PORT", default=None,
+                        help="只通过 UDP 接收，监听指定端口 (不连接 TCP 下位机)")
+    parser.add_argument("--bind", default=UDP_BIND_IP, help="UDP 监听地址")
+    parser.add_argument("--capture", metavar="PATH", default=None,
+                        help="将收到的原始字节流录制到文件 (以 .gz 结尾时压缩)，可用 replay.py 回放")
+    parser.add_argument("--metrics-port", type=int, default=exporter.ROUTER_PORT,
+                        help="在本机该端口以 Prometheus 格式导出监控指标，0 表示不导出")
+    parser.add_argument("--log-level", type=log.parse_levels, default={},
+                        help='日志级别，如 "DEBUG" 或 "router=DEBUG,alarm=WARNING"')
+    args = parser.parse_args(argv)
+    log.setup("router", args.log_level)
+    global CAPTURE_PATH
+    if args.capture:
+        CAPTURE_PATH = args.capture
+    exporter.ROUTER_PORT = args.metrics_port
+    if args.udp:
+        run_udp_listener(args.bind, args.udp)
+    else:
+        run_tcp_client(args.host, args.port)
+    return 0
+
+
 if __name__ == "__main__":
-    run_tcp_client(ESP_TARGET_IP, ESP_TARGET_PORT)
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,159 @@
+import argparse
+import sqlite3
+import sys
+
+import dbconn
+import log
+import metrics
+import partition
+
+# 扩展帧带有下位机的 32 位序号与采样时间。重连后下位机可能重发已发送过的帧，
+# 原始数据表上 (device_id, seq, device_time) 的唯一索引保证重发的样本只写入一次
+# (不使用 timestamp: 下位机时钟未校准时它是上位机的接收时间，重发时会变)；
+# 序号的跳变用于统计丢包。下位机重启后序号从 0 重新开始，采样时间仍然前进，据此与重发区分。
+DB_PATH = "db/sqlite.db"
+SEQ_MODULUS = 2 ** 32   # 序号为 uint32，溢出后回到 0
+MAX_REPORTED_GAPS = 20  # 报告中列出的最大缺口数
+
+logger = log.get_logger("sequence")
+
+
+def create_sequence_stats_table(conn):
+    """按设备、按天累计被唯一索引忽略的重复样本数 (原始数据表中不会留下重复样本的痕迹)"""
+    conn.execute("""
+                 CREATE TABLE IF NOT EXISTS sequence_stats
+                 (
+                     device_id INTEGER NOT NULL,
+                     day TEXT NOT NULL,
+                     duplicates INTEGER NOT NULL DEFAULT 0,
+                     PRIMARY KEY (device_id, day)
+                 )
+                 """)
+
+
+def record_duplicates(conn, counts):
+    """在当前事务中累加重复样本数，counts: {(device_id, 'YYYY-MM-DD'): 数量}"""
+    conn.executemany("""
+                     INSERT INTO main.sequence_stats (device_id, day, duplicates)
+                     VALUES (?, ?, ?)
+                     ON CONFLICT(device_id, day) DO UPDATE SET duplicates = duplicates + excluded.duplicates
+                     """, [(device_id, day, count) for (device_id, day), count in counts.items()])
+    metrics.increment("samples_duplicate", sum(counts.values()))
+
+
+def seq_distance(previous, current):
+    """从 previous 到 current 的前进步数 (考虑溢出)，后退时返回负数"""
+    diff = (current - previous) % SEQ_MODULUS
+    return diff if diff < SEQ_MODULUS // 2 else diff - SEQ_MODULUS
+
+
+class SequenceTracker:
+    """
+    接收线程中跟踪单台设备的序号，实时报告丢包、重发与下位机重启。
+    跨重连保留状态，重连期间丢失的帧会在下一帧到达时被发现；
+    重发的帧在这里只计数，是否真正重复由数据库唯一索引判定。
+    """
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.last_seq = None
+        self.last_time = None  # 下位机采样时间 (Unix 秒)
+
+    def observe(self, seq, device_time=None):
+        if self.last_seq is None:
+            self.last_seq, self.last_time = seq, device_time
+            return
+        step = seq_distance(self.last_seq, seq)
+        if step == 1:
+            pass
+        elif step > 1:
+            lost = step - 1
+            metrics.increment("packets_lost", lost)
+            logger.warning("设备 %s 序号不连续: 丢失 %d 个样本 (%d..%d)", self.device_id, lost,
+                           (self.last_seq + 1) % SEQ_MODULUS, (seq - 1) % SEQ_MODULUS)
+        elif device_time is not None and self.last_time is not None and device_time > self.last_time and seq < self.last_seq:
+            metrics.increment("device_restarts")
+            logger.warning("设备 %s 序号从 %d 回到 %d，下位机可能已重启", self.device_id, self.last_seq, seq)
+        else:
+            metrics.increment("packets_resent")
+            return
+        self.last_seq, self.last_time = seq, device_time
+
+
+def _sequence_rows(conn, start_str, end_str, device_id=None):
+    """读取主库与相关分区中带序号的样本 [(device_id, seq, timestamp)]，按设备与时间排序"""
+    device_sql = "device_id = ? AND " if device_id is not None else ""
+    sql = (f"SELECT device_id, seq, timestamp FROM {{table}} "
+           f"WHERE {device_sql}seq IS NOT NULL AND timestamp BETWEEN ? AND ?")
+    params = ((device_id,) if device_id is not None else ()) + (start_str, end_str)
+    rows = conn.execute(sql.format(table="main.sensor_data"), params).fetchall()
+    partitions = partition.partitions_for_range(start_str, end_str)
+    if partitions:
+        rows += partition.query_partitions(conn, partitions, sql, params)
+    rows.sort(key=lambda row: (row[0], row[2], row[1]))
+    return rows
+
+
+def gap_report(conn, start_str, end_str, device_id=None):
+    """
+    统计时间范围内各设备的收包、丢包与重复情况，返回 {device_id: 统计}。
+    丢包按已入库样本的序号缺口计算 (重发补齐的帧不计入)，重复数取自 sequence_stats。
+    冷数据归档不保存序号，归档范围内的数据不参与统计。
+    """
+    report = {}
+    previous = None
+    for row_device, seq, timestamp in _sequence_rows(conn, start_str, end_str, device_id):
+        stats = report.setdefault(row_device, {'received': 0, 'lost': 0, 'duplicates': 0,
+                                               'restarts': 0, 'gaps': []})
+        stats['received'] += 1
+        if previous is not None and previous[0] == row_device:
+            step = seq_distance(previous[1], seq)
+            if step > 1:
+                stats['lost'] += step - 1
+                if len(stats['gaps']) < MAX_REPORTED_GAPS:
+                    stats['gaps'].append((previous[2], timestamp, (previous[1] + 1) % SEQ_MODULUS,
+                                          (seq - 1) % SEQ_MODULUS, step - 1))
+            elif step <= 0:
+                stats['restarts'] += 1
+        previous = (row_device, seq, timestamp)
+
+    device_sql = "device_id = ? AND " if device_id is not None else ""
+    params = ((device_id,) if device_id is not None else ()) + (start_str[:10], end_str[:10])
+    try:
+        duplicate_rows = conn.execute(f"SELECT device_id, SUM(duplicates) FROM sequence_stats "
+                                      f"WHERE {device_sql}day BETWEEN ? AND ? GROUP BY device_id", params).fetchall()
+    except sqlite3.OperationalError:
+        duplicate_rows = []
+    for row_device, duplicates in duplicate_rows:
+        report.setdefault(row_device, {'received': 0, 'lost': 0, 'duplicates': 0,
+                                       'restarts': 0, 'gaps': []})['duplicates'] = duplicates
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 序号统计: 丢包与重复报告")
+    parser.add_argument("--start", required=True, help="开始时间，如 2025-05-01 00:00:00")
+    parser.add_argument("--end", required=True, help="结束时间，如 2025-05-31 23:59:59")
+    parser.add_argument("--device-id", type=int, default=None, help="只统计指定设备")
+    parser.add_argument("--db", default=DB_PATH, help="数据库文件路径")
+    args = parser.parse_args(argv)
+    try:
+        report = gap_report(dbconn.connect_reader(args.db), args.start, args.end, args.device_id)
+    except sqlite3.Error as e:
+        print(f"统计序号时出错: {e}", file=sys.stderr)
+        return 1
+    if not report:
+        print("时间范围内没有带序号的数据")
+        return 0
+    for device_id, stats in sorted(report.items()):
+        expected = stats['received'] + stats['lost']
+        loss_rate = stats['lost'] / expected * 100 if expected else 0.0
+        print(f"设备 {device_id}: 收到 {stats['received']} 个样本, 丢失 {stats['lost']} 个 ({loss_rate:.2f}%), "
+              f"重复 {stats['duplicates']} 个, 序号重置 {stats['restarts']} 次")
+        for gap_start, gap_end, first, last, count in stats['gaps']:
+            print(f"  缺口 {gap_start} ~ {gap_end}: 序号 {first}..{last} ({count} 个样本)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
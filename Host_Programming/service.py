@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import alarm
+import dbconn
+import devices
+import exporter
+import ingest_lock
+import log
+import query
+import router
+
+# 无界面的后台服务: 在没有显示器的服务器上运行数据采集、警报规则判断与邮件通知，不加载任何 Qt 模块。
+# 服务运行期间定期更新状态文件 (心跳)，界面启动时发现服务在运行就不再自行启动采集进程，只作为查看端读取数据库。
+DB_PATH = "db/sqlite.db"
+SERVICE_FILE = "db/service.json"
+HEARTBEAT_INTERVAL = 5.0      # 更新状态文件的间隔 (秒)
+HEARTBEAT_STALE = 3 * HEARTBEAT_INTERVAL  # 超过该时长未更新视为服务已退出 (异常退出时状态文件会残留)
+ALARM_CHECK_INTERVAL = 2.0    # 检查警报规则的间隔 (秒)，与界面的默认刷新间隔一致
+ALARM_FRESHNESS_SECONDS = 3   # 最新数据距今不超过该时长才检查规则，与界面一致
+
+logger = log.get_logger("service")
+
+
+def read_service(path=SERVICE_FILE):
+    """返回正在运行的后台服务的状态 (pid、启动时间、采集方式等)，没有服务或心跳已过期时返回 None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - info.get('heartbeat', 0) > HEARTBEAT_STALE:
+        return None
+    return info
+
+
+def _memory_mb():
+    """进程的峰值常驻内存 (MB)，平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+
+class Heartbeat(threading.Thread):
+    """定期将服务状态写入状态文件 (先写临时文件再替换，读取方不会读到半个文件)"""
+
+    def __init__(self, info, path=SERVICE_FILE, interval=HEARTBEAT_INTERVAL):
+        super().__init__(name="Heartbeat", daemon=True)
+        self.info = info
+        self.path = path
+        self.interval = interval
+        self.stopped = False
+
+    def beat(self):
+        if self.stopped:
+            return
+        self.info['heartbeat'] = time.time()
+        self.info['memory_mb'] = _memory_mb()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.info, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while True:
+            try:
+                self.beat()
+            except OSError as e:
+                logger.warning("更新服务状态文件失败: %s", e)
+            time.sleep(self.interval)
+
+    def remove(self):
+        self.stopped = True
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class AlarmMonitor(threading.Thread):
+    """
+    按界面相同的规则 (rule.json) 检查各设备的最新数据并发送邮件通知。
+    每台设备使用独立的规则副本 (alarm.DeviceAlarms)，触发与恢复状态互不影响；规则文件被界面修改后自动重新加载。
+    """
+
+    def __init__(self, db_path=DB_PATH, interval=ALARM_CHECK_INTERVAL):
+        super().__init__(name="AlarmMonitor", daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self.manager = alarm.AlarmManager(sound_enabled=False)
+        self.alarms = alarm.DeviceAlarms(self.manager)
+        self.rules_mtime = None
+        self.last_checked = {}   # {设备id: 最近检查过的记录id}
+
+    def reload_rules(self):
+        """规则文件有变化时重新加载，保留同一规则在各设备上的触发状态"""
+        try:
+            mtime = os.path.getmtime(alarm.RULES_FILE)
+        except OSError:
+            mtime = None
+        if mtime == self.rules_mtime:
+            return
+        self.rules_mtime = mtime
+        self.alarms.set_rules(alarm.load_rules_from_json())
+        logger.info("已加载 %d 条警报规则", len(self.alarms.rules))
+
+    def check_device(self, conn, device_id, device_name, now):
+        latest = query.fetch_latest(conn, device_id=device_id)
+        if latest is None or latest[5] == self.last_checked.get(device_id):
+            return
+        self.last_checked[device_id] = latest[5]
+        data_time = datetime.strptime(latest[0], "%Y-%m-%d %H:%M:%S")
+        if (now - data_time).total_seconds() > ALARM_FRESHNESS_SECONDS:
+            return
+        data = {'temperature': latest[1], 'humidity': latest[2], 'pm25': latest[3], 'noise': latest[4]}
+        for rule in self.alarms.check(device_id, data, device_name):
+            state = "触发" if rule.is_triggered else "恢复"
+            logger.info("设备 %s 警报%s: %s %s %s (当前值 %s, 时间 %s)", device_id, state, rule.sensor_type,
+                        rule.condition_type, rule.threshold, data[rule.sensor_type], latest[0])
+
+    def step(self, conn):
+        self.reload_rules()
+        if not self.alarms.rules:
+            return
+        now = datetime.now()
+        for device_id, name, _ in devices.list_devices(conn):
+            self.check_device(conn, device_id, name, now)
+
+    def run(self):
+        conn = None
+        while True:
+            try:
+                if conn is None:
+                    conn = dbconn.connect_reader(self.db_path)
+                self.step(conn)
+            except Exception as e:
+                logger.error("检查警报规则时出错: %s", e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            time.sleep(self.interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FluentSensor 后台服务: 无界面运行数据采集与警报通知")
+    parser.add_argument("--host", default=router.ESP_TARGET_IP, help="TCP 模式下位机地址")
+    parser.add_argument("--port", type=int, default=router.ESP_TARGET_PORT, help="TCP 模式下位机端口")
+    parser.add_argument("--udp", type=int, metavar="PORT", default=None,
+                        help="只通过 UDP 接收，监听指定端口 (不连接 TCP 下位机)")
+    parser.add_argument("--bind", default=router.UDP_BIND_IP, help="UDP 监听地址")
+    parser.add_argument("--capture", metavar="PATH", default=None, help="将收到的原始字节流录制到文件")
+    parser.add_argument("--no-alarms", action="store_true", help="不检查警报规则")
+    parser.add_argument("--api", type=int, metavar="PORT", default=None,
+                        help="同时在本机指定端口提供 HTTP 接口 (见 api.py)，实时推送直接取自入库线程")
+    parser.add_argument("--metrics-port", type=int, default=exporter.ROUTER_PORT,
+                        help="在本机该端口以 Prometheus 格式导出监控指标，0 表示不导出")
+    parser.add_argument("--log-level", type=log.parse_levels, default={},
+                        help='日志级别，如 "DEBUG" 或 "router=DEBUG,alarm=WARNING"')
+    args = parser.parse_args(argv)
+
+    running = read_service()
+    if running is not None:
+        print(f"后台服务已在运行 (PID {running['pid']}, 启动于 {running['started']})", file=sys.stderr)
+        return 1
+    if not ingest_lock.acquire("service"):
+        # 界面或单独运行的 router.py 已在采集，再启动会重复连接同一台下位机
+        owner = ingest_lock.holder() or {}
+        print(f"已有采集进程在运行 (PID {owner.get('pid')}, {owner.get('role')}, 启动于 {owner.get('started')})，"
+              f"请先关闭它", file=sys.stderr)
+        return 1
+    log.setup("service", args.log_level)
+    if args.capture:
+        router.CAPTURE_PATH = args.capture
+    exporter.ROUTER_PORT = args.metrics_port
+
+    try:
+        # 先完成建表与迁移，警报线程启动时数据库结构已是最新
+        router.connect_to_db()
+    except sqlite3.Error:
+        return 1
+    os.makedirs(os.path.dirname(SERVICE_FILE), exist_ok=True)
+    heartbeat = Heartbeat({
+        'pid': os.getpid(),
+        'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'mode': f"udp:{args.bind}:{args.udp}" if args.udp else f"tcp:{args.host}:{args.port}",
+        'alarms': not args.no_alarms,
+        'api': args.api,
+        'metrics': args.metrics_port or None,
+    })
+    heartbeat.beat()
+
+    def exit_on_signal(signum, frame):
+        # 采集线程退出前还会等待重连间隔，先删除状态文件，界面不会连接到正在退出的服务
+        heartbeat.remove()
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    try:
+        heartbeat.start()
+        if not args.no_alarms:
+            AlarmMonitor().start()
+        if args.api:
+            import api  # api 导入了本模块 (读取服务状态)，在这里导入以避免循环导入
+            threading.Thread(target=api.run_api, kwargs={'port': args.api, 'live_feed': "ingest"},
+                             name="Api", daemon=True).start()
+        logger.info("后台服务已启动 (PID %d)", os.getpid())
+        if args.udp:
+            router.run_udp_listener(args.bind, args.udp)
+        else:
+            router.run_tcp_client(args.host, args.port)
+        return 1  # 采集函数只在数据库初始化失败时返回
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        heartbeat.remove()
+        logger.info("后台服务已停止")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
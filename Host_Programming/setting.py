@@ -1,9 +1,11 @@
 from enum import Enum
 from PyQt5.QtCore import Qt, pyqtSignal
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QButtonGroup
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QButtonGroup, QFileDialog, QTableWidgetItem
 from qfluentwidgets import (BodyLabel, HeaderCardWidget, ComboBox, Slider, PrimaryPushButton,
                             RadioButton, InfoBar, InfoBarPosition, isDarkTheme, StyleSheetBase,
-                            Theme, qconfig)
+                            Theme, qconfig, PushButton, TableWidget)
+
+import metrics
 
 class StyleSheet(StyleSheetBase, Enum):
     MAIN_WINDOW = "main_window"
@@ -79,6 +81,29 @@ class TimeRangeSettings(QWidget):
         self.applyButton.clicked.connect(self.apply_settings)
         button_layout.addWidget(self.applyButton)
         layout.addLayout(button_layout)
+        self.latency_card = HeaderCardWidget(self)
+        self.latency_card.setTitle("延迟统计")
+        self.latency_card.setBorderRadius(8)
+        self.latency_table = TableWidget(self.latency_card)
+        self.latency_table.setBorderVisible(True)
+        self.latency_table.setBorderRadius(8)
+        self.latency_table.setColumnCount(6)
+        self.latency_table.setEditTriggers(TableWidget.NoEditTriggers)
+        self.latency_table.setHorizontalHeaderLabels(['阶段', '样本数', 'P50(ms)', 'P90(ms)', 'P99(ms)', '最大(ms)'])
+        self.latency_table.verticalHeader().hide()
+        self.latency_table.horizontalHeader().setStretchLastSection(True)
+        self.latency_table.setMinimumHeight(200)
+        self.latency_card.viewLayout.addWidget(self.latency_table)
+        latency_button_layout = QHBoxLayout()
+        latency_button_layout.addStretch()
+        self.latency_refresh_button = PushButton("刷新", self.latency_card)
+        self.latency_refresh_button.clicked.connect(self.refresh_latency_table)
+        latency_button_layout.addWidget(self.latency_refresh_button)
+        self.latency_export_button = PushButton("导出为JSON", self.latency_card)
+        self.latency_export_button.clicked.connect(self.export_latency_stats)
+        latency_button_layout.addWidget(self.latency_export_button)
+        self.latency_card.viewLayout.addLayout(latency_button_layout)
+        layout.addWidget(self.latency_card)
         layout.addStretch()
 
     def on_refresh_slider_changed(self, value):
@@ -94,4 +119,31 @@ class TimeRangeSettings(QWidget):
         if dark_mode != self.dark_mode:
             self.themeChanged.emit(dark_mode)
             self.dark_mode = dark_mode
-        InfoBar.success(title='设置已应用', content='您的设置已成功应用', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
\ No newline at end of file
+        InfoBar.success(title='设置已应用', content='您的设置已成功应用', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
+
+    def refresh_latency_table(self):
+        stats = metrics.snapshot()
+        self.latency_table.setRowCount(0)
+        names = [name for name, _, _ in metrics.STAGE_SPANS] + ["end_to_end"]
+        names += sorted(name for name in stats if name not in names)
+        for name in names:
+            summary = stats.get(name)
+            if not summary or not summary['count']:
+                continue
+            row = self.latency_table.rowCount()
+            self.latency_table.insertRow(row)
+            self.latency_table.setItem(row, 0, QTableWidgetItem(name))
+            self.latency_table.setItem(row, 1, QTableWidgetItem(str(summary['count'])))
+            for col, key in enumerate(('p50', 'p90', 'p99', 'max'), start=2):
+                self.latency_table.setItem(row, col, QTableWidgetItem(f"{summary[key]:.1f}"))
+        self.latency_table.resizeColumnsToContents()
+
+    def export_latency_stats(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "保存延迟统计", "latency_stats.json", "JSON 文件 (*.json)")
+        if not file_path:
+            return
+        try:
+            metrics.dump_metrics(file_path)
+            InfoBar.success(title='导出成功', content=f'延迟统计已保存至 {file_path}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=2000, parent=self.window())
+        except Exception as e:
+            InfoBar.error(title='导出失败', content=f'发生错误: {str(e)}', orient=Qt.Horizontal, isClosable=True, position=InfoBarPosition.TOP, duration=3000, parent=self.window())
@@ -0,0 +1,329 @@
+import argparse
+import math
+import random
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+import protocol
+
+# 本地模拟下位机: 与 ESP 板相同，作为 TCP 服务器等待上位机连接后持续发送数据帧 (默认 11 字节 v1 帧)；
+# 也可以改为向上位机的 UDP 端口发送数据报。支持多台设备、可调速率、接近真实的信号曲线与故障注入。
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 6666
+TICK_SECONDS = 0.01           # 发送节拍，每个节拍发送期间应产生的全部样本
+UDP_PAYLOAD_LIMIT = 1400      # 单个数据报的最大负载，避免 IP 分片
+STATS_INTERVAL = 5.0          # 命令行模式下打印统计的间隔 (秒)
+
+
+class SignalModel:
+    """
+    生成接近真实的传感器读数: 温度按昼夜正弦变化并叠加缓慢漂移，湿度与温度负相关，
+    PM2.5 偶发污染峰值后指数衰减，噪声白天较高并伴有随机突发。
+    """
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.drift = 0.0
+        self.pm25_spike = 0.0
+        self.last_time = None
+
+    def sample(self, now):
+        dt = 0.0 if self.last_time is None else max(now - self.last_time, 0.0)
+        self.last_time = now
+        moment = datetime.fromtimestamp(now)
+        hour = moment.hour + moment.minute / 60.0 + moment.second / 3600.0
+        daylight = math.sin(2 * math.pi * (hour - 9) / 24)
+
+        self.drift = max(-2.0, min(2.0, self.drift + self.random.gauss(0, 0.02) * math.sqrt(dt + 1e-3)))
+        temperature = 22 + 4 * daylight + self.drift + self.random.gauss(0, 0.1)
+        humidity = 60 - 1.5 * (temperature - 22) + self.random.gauss(0, 0.5)
+
+        self.pm25_spike *= math.exp(-dt / 300.0)
+        if self.random.random() < dt / 600.0:  # 平均每 10 分钟一次污染事件
+            self.pm25_spike += self.random.uniform(50, 150)
+        pm25 = 15 + self.pm25_spike + self.random.gauss(0, 2)
+
+        noise = 35 + 10 * max(daylight, 0) + self.random.gauss(0, 2)
+        if self.random.random() < 0.01:
+            noise += self.random.uniform(10, 30)
+
+        return {
+            'temperature': round(max(-40.0, min(80.0, temperature)), 1),
+            'humidity': round(max(0.0, min(100.0, humidity)), 1),
+            'pm25': int(max(0, min(999, pm25))),
+            'noise': int(max(0, min(130, noise))),
+        }
+
+
+class Faults:
+    """故障注入配置，概率均按每帧计算"""
+
+    def __init__(self, partial=0.0, garbage=0.0, disconnect=0.0, stall=0.0, stall_seconds=3.0, resend=0):
+        self.partial = partial          # 只发送帧的前一部分
+        self.garbage = garbage          # 在帧前插入随机字节
+        self.disconnect = disconnect    # 发送后断开连接 (UDP 模式忽略)
+        self.stall = stall              # 停止发送 stall_seconds 秒
+        self.stall_seconds = stall_seconds
+        self.resend = resend            # 重连后重发最近的帧数 (序号帧与 v2 帧用于验证去重)
+
+
+class FakeDevice(threading.Thread):
+    """
+    一台模拟下位机。udp_target 为 None 时在 (host, port) 上作为 TCP 服务器，每次接受一个上位机连接；
+    否则从 source_ip 向 udp_target 发送数据报。rate 为每秒样本数，fmt 为 v1 / seq / v2。
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, rate=1.0, fmt="v1", batch=50, faults=None,
+                 udp_target=None, source_ip=None, seed=None):
+        super().__init__(name=f"FakeDevice-{port}", daemon=True)
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.fmt = fmt
+        self.batch = batch
+        self.faults = faults or Faults()
+        self.udp_target = udp_target
+        self.source_ip = source_ip
+        self.signal = SignalModel(seed)
+        self.random = random.Random(seed)
+        self.seq = 0
+        self.recent = []  # 最近发送的帧，用于重连后重发
+        self.stats = {'samples': 0, 'frames': 0, 'bytes': 0, 'connections': 0,
+                      'partial': 0, 'garbage': 0, 'disconnect': 0, 'stall': 0, 'resent': 0}
+        self.stop_event = threading.Event()
+        self.ready = threading.Event()  # TCP 已开始监听 / UDP 套接字已创建
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _encode(self, samples, now):
+        """把一批样本编码为帧列表 [(帧字节, 样本数)]"""
+        device_time = int(now)
+        if self.fmt == "v2":
+            frames = []
+            for i in range(0, len(samples), self.batch):
+                chunk = samples[i:i + self.batch]
+                frames.append((protocol.encode_v2(chunk, self.seq, [device_time] * len(chunk)), len(chunk)))
+                self.seq = (self.seq + len(chunk)) % (2 ** 32)
+            return frames
+        if self.fmt == "seq":
+            frames = []
+            for sample in samples:
+                frames.append((protocol.encode_seq(sample, self.seq, device_time), 1))
+                self.seq = (self.seq + 1) % (2 ** 32)
+            return frames
+        return [(protocol.encode_v1(sample), 1) for sample in samples]
+
+    def _apply_faults(self, frame, count):
+        """返回 (实际发送的字节, 完整发送的样本数, 是否在发送后断开)"""
+        faults = self.faults
+        data = frame
+        if faults.garbage and self.random.random() < faults.garbage:
+            data = bytes(self.random.getrandbits(8) for _ in range(self.random.randint(1, 16))) + data
+            self.stats['garbage'] += 1
+        if faults.partial and self.random.random() < faults.partial:
+            data = data[:len(data) - self.random.randint(1, len(frame) - 1)]
+            self.stats['partial'] += 1
+            count = 0
+        disconnect = bool(self.udp_target is None and faults.disconnect and self.random.random() < faults.disconnect)
+        return data, count, disconnect
+
+    def _due_frames(self, start, emitted):
+        """根据速率计算当前应发送的样本并编码，返回 (帧列表, 新的已产生样本数)"""
+        now = time.time()
+        due = int((time.monotonic() - start) * self.rate) - emitted
+        if due <= 0:
+            return [], emitted
+        samples = [self.signal.sample(now) for _ in range(due)]
+        return self._encode(samples, now), emitted + due
+
+    def _stall(self):
+        if self.faults.stall and self.random.random() < self.faults.stall:
+            self.stats['stall'] += 1
+            self.stop_event.wait(self.faults.stall_seconds)
+            return True
+        return False
+
+    def _serve_client(self, conn):
+        """向已连接的上位机持续发送，返回时连接已断开"""
+        self.stats['connections'] += 1
+        if self.faults.resend and self.recent and self.stats['connections'] > 1:
+            for frame, count in self.recent[-self.faults.resend:]:
+                conn.sendall(frame)
+                self.stats['resent'] += count
+        start = time.monotonic()
+        emitted = 0
+        while not self.stop_event.is_set():
+            frames, emitted = self._due_frames(start, emitted)
+            out = bytearray()
+            disconnect = False
+            for frame, count in frames:
+                data, sent, disconnect = self._apply_faults(frame, count)
+                out += data
+                self.stats['samples'] += sent
+                self.stats['frames'] += 1
+                self.recent.append((frame, count))
+                if disconnect:
+                    break
+            del self.recent[:-max(self.faults.resend, 1)]
+            if out:
+                conn.sendall(out)
+                self.stats['bytes'] += len(out)
+            if disconnect:
+                self.stats['disconnect'] += 1
+                return
+            if frames and self._stall():
+                # 停顿期间的样本视为下位机未采集，恢复后从当前时刻重新计时
+                start, emitted = time.monotonic(), 0
+            time.sleep(TICK_SECONDS)
+
+    def _run_tcp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((self.host, self.port))
+        server.listen(1)
+        server.settimeout(0.5)
+        self.ready.set()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                try:
+                    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._serve_client(conn)
+                except OSError:
+                    pass  # 上位机断开连接，等待重连
+                finally:
+                    conn.close()
+        finally:
+            server.close()
+
+    def _run_udp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.source_ip:
+            sock.bind((self.source_ip, 0))
+        self.ready.set()
+        start = time.monotonic()
+        emitted = 0
+        try:
+            while not self.stop_event.is_set():
+                frames, emitted = self._due_frames(start, emitted)
+                datagram = bytearray()
+                for frame, count in frames:
+                    data, sent, _ = self._apply_faults(frame, count)
+                    if datagram and len(datagram) + len(data) > UDP_PAYLOAD_LIMIT:
+                        sock.sendto(datagram, self.udp_target)
+                        datagram = bytearray()
+                    datagram += data
+                    self.stats['samples'] += sent
+                    self.stats['frames'] += 1
+                    self.stats['bytes'] += len(data)
+                if datagram:
+                    sock.sendto(datagram, self.udp_target)
+                if frames and self._stall():
+                    start, emitted = time.monotonic(), 0
+                time.sleep(TICK_SECONDS)
+        finally:
+            sock.close()
+
+    def run(self):
+        if self.udp_target is None:
+            self._run_tcp()
+        else:
+            self._run_udp()
+
+
+def start_devices(count, rate, host=DEFAULT_HOST, base_port=DEFAULT_PORT, fmt="v1", batch=50, faults=None,
+                  udp_target=None, seed=None):
+    """
+    启动 count 台模拟下位机，每台 rate 个样本/秒。
+    TCP 模式下第 i 台监听 base_port + i；UDP 模式下向本机目标发送时第 i 台使用源地址 127.0.1.(i+1)，以便上位机区分设备。
+    """
+    device_list = []
+    for i in range(count):
+        source_ip = None
+        if udp_target is not None and udp_target[0].startswith("127."):
+            source_ip = f"127.0.1.{i + 1}"
+        device = FakeDevice(host, base_port + i, rate, fmt, batch, faults, udp_target, source_ip,
+                            None if seed is None else seed + i)
+        device.start()
+        device.ready.wait(5)
+        device_list.append(device)
+    return device_list
+
+
+def total_stats(device_list):
+    totals = {}
+    for device in device_list:
+        for key, value in device.stats.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def add_device_arguments(parser):
+    """模拟器与负载生成器共用的命令行参数"""
+    parser.add_argument("--devices", type=int, default=1, help="模拟的下位机数量")
+    parser.add_argument("--format", choices=("v1", "seq", "v2"), default="v1", help="帧格式")
+    parser.add_argument("--batch", type=int, default=50, help="v2 帧每帧最多包含的样本数")
+    parser.add_argument("--partial", type=float, default=0.0, help="每帧只发送一部分的概率")
+    parser.add_argument("--garbage", type=float, default=0.0, help="每帧前插入随机字节的概率")
+    parser.add_argument("--disconnect", type=float, default=0.0, help="每帧发送后断开连接的概率 (仅 TCP)")
+    parser.add_argument("--stall", type=float, default=0.0, help="每帧发送后停止发送一段时间的概率")
+    parser.add_argument("--stall-seconds", type=float, default=3.0, help="每次停顿的时长 (秒)")
+    parser.add_argument("--resend", type=int, default=0, help="重连后重发最近的帧数")
+    parser.add_argument("--seed", type=int, default=None, help="随机数种子")
+
+
+def faults_from_args(args):
+    return Faults(args.partial, args.garbage, args.disconnect, args.stall, args.stall_seconds, args.resend)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or DEFAULT_HOST, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模拟 ESP 下位机 (用于在没有开发板时测试数据采集)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="TCP 监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="第一台设备的 TCP 端口，其余设备依次加一")
+    parser.add_argument("--rate", type=float, default=1.0, help="每台设备每秒发送的样本数")
+    parser.add_argument("--udp", default=None, metavar="HOST:PORT", help="改为向上位机的 UDP 端口发送")
+    parser.add_argument("--duration", type=float, default=None, help="运行时长 (秒)，默认一直运行")
+    add_device_arguments(parser)
+    args = parser.parse_args(argv)
+
+    udp_target = parse_address(args.udp) if args.udp else None
+    try:
+        device_list = start_devices(args.devices, args.rate, args.host, args.port, args.format, args.batch,
+                                    faults_from_args(args), udp_target, args.seed)
+    except OSError as e:
+        print(f"启动模拟设备失败: {e}", file=sys.stderr)
+        return 1
+    if udp_target:
+        print(f"{args.devices} 台模拟设备正在向 UDP {udp_target[0]}:{udp_target[1]} 发送 ({args.format}, 每台 {args.rate} 样本/秒)")
+    else:
+        print(f"{args.devices} 台模拟设备正在监听 {args.host}:{args.port}..{args.port + args.devices - 1} "
+              f"({args.format}, 每台 {args.rate} 样本/秒)")
+    started = time.monotonic()
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            time.sleep(STATS_INTERVAL if args.duration is None else min(STATS_INTERVAL, args.duration))
+            stats = total_stats(device_list)
+            print(f"已发送 {stats['samples']} 个样本 / {stats['frames']} 帧, 连接 {stats['connections']} 次; "
+                  f"故障: 不完整 {stats['partial']}, 乱码 {stats['garbage']}, 断开 {stats['disconnect']}, "
+                  f"停顿 {stats['stall']}, 重发 {stats['resent']}")
+    except KeyboardInterrupt:
+        pass
+    for device in device_list:
+        device.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,12 @@ from PyQt5.QtWidgets import QApplication, QVBoxLayout, QLabel
 from PyQt5.QtGui import QFont
 from qfluentwidgets import ProgressRing, setTheme, Theme, CardWidget, isDarkTheme
 
+import migrations
+
+DB_PATH = "db/sqlite.db"
+MIGRATION_POLL_INTERVAL = 200     # 轮询数据库迁移进度的间隔 (毫秒)
+MIGRATION_START_TIMEOUT = 15.0    # 等待数据服务开始迁移的最长时间 (秒)
+
 def start_script_in_process(script_name, entry_function_name, *args_for_entry):
     module_name = script_name.replace(".py", "")
     try:
@@ -100,11 +106,48 @@ class SplashScreenClientSimplified(CardWidget):
             return
 
         print("INFO: Splash - Fluent process seems to be alive.")
-        self.statusLabel.setText("加载完成!")
-        self.progressRing.setValue(100)
         self.processes_launched_successfully = True
+        status = migrations.read_status()
+        pending = status is not None and status.get("state") == "running"
+        if not pending:
+            try:
+                pending = migrations.startup_pending(DB_PATH)
+            except Exception as e:
+                print(f"WARN: Splash - 无法读取数据库版本: {e}", file=sys.stderr)
+        if pending:
+            # 数据服务启动时会先升级数据库结构并补建缺少的索引 (例如导入中断后)，大数据库可能需要较长时间，
+            # 在启动画面上显示进度
+            self.statusLabel.setText("正在升级数据库...")
+            self.migration_wait_start = time.monotonic()
+            self.migration_wait_wall = time.time()
+            self.migrationTimer = QTimer(self)
+            self.migrationTimer.timeout.connect(self.poll_migration)
+            self.migrationTimer.start(MIGRATION_POLL_INTERVAL)
+            return
+        self.finish_loading()
+
+    def finish_loading(self, text="加载完成!"):
+        self.statusLabel.setText(text)
+        self.progressRing.setValue(100)
         QTimer.singleShot(700, self.close_splash_only)
 
+    def poll_migration(self):
+        status = migrations.read_status()
+        if status and status.get("updated", 0) >= self.migration_wait_wall - 1:
+            if status["state"] == "running":
+                done, total = status["done"], status["total"]
+                self.statusLabel.setText(f"正在升级数据库 (v{status['version'] or '-'}/{status['latest']})\n"
+                                         f"{status['description']} {done}/{total}")
+                self.progressRing.setValue(60 + int(39 * done / total) if total else 60)
+                return
+            self.migrationTimer.stop()
+            self.finish_loading("加载完成!" if status["state"] == "done" else "数据库升级失败!")
+            return
+        if time.monotonic() - self.migration_wait_start > MIGRATION_START_TIMEOUT:
+            print("WARN: Splash - 等待数据库迁移超时，关闭启动画面。", file=sys.stderr)
+            self.migrationTimer.stop()
+            self.finish_loading()
+
     def center_on_screen(self):
         try:
             if self.parent_app: